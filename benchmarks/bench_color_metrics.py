@@ -0,0 +1,76 @@
+"""
+色差公式基准测试
+
+对每种色差公式测量批量匹配的吞吐量，并统计其 Top 1 结果与 ΔE2000 不一致的比例。
+输入颜色默认是 RGB 立方体中的均匀随机采样，也可以用 --image 从图片中采样像素。
+
+用法：
+    python benchmarks/bench_color_metrics.py [--samples 20000] [--image debug.jpg]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.color_difference import DEFAULT_METRIC, METRICS
+from src.color_mapper import PerlerBeadColorMapper
+
+
+def sample_colors(samples: int, image_path: str = None, seed: int = 0) -> np.ndarray:
+    """生成测试颜色：随机 RGB 或图片中的随机像素"""
+    rng = np.random.default_rng(seed)
+    if image_path is None:
+        return rng.integers(0, 256, (samples, 3))
+
+    import cv2
+
+    image = cv2.imread(image_path)
+    if image is None:
+        raise FileNotFoundError(f"无法读取图片: {image_path}")
+    pixels = cv2.cvtColor(image, cv2.COLOR_BGR2RGB).reshape(-1, 3)
+    return pixels[rng.integers(0, len(pixels), samples)].astype(np.int64)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='色差公式吞吐量与一致性基准')
+    parser.add_argument(
+        '--palette',
+        default=os.path.join(os.path.dirname(__file__), '..', 'adjusted_colors.xlsx'),
+    )
+    parser.add_argument('--samples', type=int, default=20000)
+    parser.add_argument('--image', default=None, help='从图片中采样像素（默认随机 RGB）')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # 关闭缓存和查找表，测量的是公式本身的全量计算
+    mapper = PerlerBeadColorMapper(args.palette, memo_size=0)
+    colors = sample_colors(args.samples, args.image)
+
+    results = {}
+    for name in METRICS:
+        # 预热：调色板坐标在首次使用时计算
+        mapper.find_closest_colors(colors[:16], metric=name)
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            indices, _ = mapper.find_closest_colors(colors, top_n=1, metric=name)
+            best = min(best, time.perf_counter() - start)
+        results[name] = (indices[:, 0], best)
+
+    reference = results[DEFAULT_METRIC][0]
+    print(f"\n调色板: {len(mapper.codes)} 色，输入: {len(colors)} 个颜色")
+    print("-" * 60)
+    print(f"{'公式':<12}{'耗时 (ms)':>12}{'颜色/秒':>14}{'与 ΔE2000 不一致':>20}")
+    for name, (top1, seconds) in results.items():
+        disagree = np.mean(top1 != reference) * 100
+        print(f"{name:<12}{seconds * 1000:>12.1f}{len(colors) / seconds:>14,.0f}{disagree:>19.2f}%")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""
+调色板合并基准测试
+
+在不同的唯一颜色数下测量 _merge_similar_palette 的耗时，并与逐簇比较的参考实现
+对照，确认两者的簇划分完全一致。输入颜色围绕若干主色加噪声生成，模拟噪点较多的照片。
+
+用法：
+    python benchmarks/bench_palette_merge.py [--sizes 250 1000 4000] [--threshold 5] [--repeat 3]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+# 添加项目根目录和测试目录（参考实现）到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+
+from src.color_processing import _merge_similar_palette
+from reference import reference_merge_palette, sample_palette
+
+
+def main():
+    parser = argparse.ArgumentParser(description='调色板合并耗时与一致性基准')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[250, 1000, 4000])
+    parser.add_argument('--threshold', type=float, default=5.0)
+    parser.add_argument(
+        '--skip-reference', action='store_true', help='不运行参考实现（颜色很多时较慢）'
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    def best_time(function, colors, counts):
+        best = float('inf')
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            result = function(colors, counts, args.threshold)
+            best = min(best, time.perf_counter() - start)
+        return result, best
+
+    # 预热：OpenCV 第一次颜色转换要初始化（约 0.1 秒），不计入任何一方
+    warmup_colors, warmup_counts = sample_palette(20)
+    _merge_similar_palette(warmup_colors, warmup_counts, args.threshold)
+    reference_merge_palette(warmup_colors, warmup_counts, args.threshold)
+
+    print(f"\n合并阈值: {args.threshold}")
+    print("-" * 64)
+    print(f"{'唯一颜色':>8}{'簇数':>8}{'向量化 (ms)':>14}{'参考 (ms)':>12}{'加速':>8}{'一致':>8}")
+    for size in args.sizes:
+        colors, counts = sample_palette(size)
+
+        mapping, fast = best_time(_merge_similar_palette, colors, counts)
+        clusters = len(set(mapping.values()))
+
+        if args.skip_reference:
+            print(f"{size:>8}{clusters:>8}{fast * 1000:>14.1f}{'-':>12}{'-':>8}{'-':>8}")
+            continue
+
+        expected, slow = best_time(reference_merge_palette, colors, counts)
+        same = '是' if mapping == expected else '否'
+        speedup = f"{slow / fast:.1f}x"
+        print(f"{size:>8}{clusters:>8}{fast * 1000:>14.1f}{slow * 1000:>12.1f}{speedup:>8}{same:>8}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+"""
+加权 K-means 聚类
+
+纯 NumPy 实现，k-means++ 初始化，每个点可以带权重。颜色聚类通常在唯一颜色表上进行，
+以出现次数作为权重，结果与在所有像素上聚类等价，但计算量只取决于唯一颜色数。
+
+- weighted_kmeans: NumPy 实现
+- kmeans: 按后端名分派；'sklearn' 时才导入 scikit-learn
+"""
+
+from __future__ import annotations
+
+from typing import Optional, Tuple
+
+import numpy as np
+
+DEFAULT_BACKEND = 'numpy'
+
+
+def _squared_distances(
+    points: np.ndarray, centers: np.ndarray, point_norms: np.ndarray
+) -> np.ndarray:
+    # |p - c|² = |p|² - 2 p·c + |c|²，用矩阵乘法代替 (N, K, D) 的中间数组
+    distances = point_norms[:, None] - 2.0 * (points @ centers.T)
+    distances += (centers**2).sum(axis=-1)[None, :]
+    return np.maximum(distances, 0.0, out=distances)
+
+
+def _kmeans_plus_plus(
+    points: np.ndarray, weights: np.ndarray, n_clusters: int, rng: np.random.Generator
+) -> np.ndarray:
+    """k-means++ 初始化：下一个中心按 权重 × 到最近中心距离² 的比例抽样"""
+    first = rng.choice(len(points), p=weights / weights.sum())
+    centers = [points[first]]
+    closest = ((points - points[first]) ** 2).sum(axis=-1)
+
+    for _ in range(1, n_clusters):
+        scores = weights * closest
+        total = scores.sum()
+        if total <= 0:
+            # 剩余的点都与已有中心重合
+            break
+        chosen = rng.choice(len(points), p=scores / total)
+        centers.append(points[chosen])
+        closest = np.minimum(closest, ((points - points[chosen]) ** 2).sum(axis=-1))
+
+    return np.array(centers)
+
+
+def _lloyd(
+    points: np.ndarray, weights: np.ndarray, centers: np.ndarray, max_iter: int, tol: float
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    point_norms = (points**2).sum(axis=-1)
+    labels = np.zeros(len(points), dtype=np.intp)
+    for iteration in range(max_iter):
+        distances = _squared_distances(points, centers, point_norms)
+        new_labels = np.argmin(distances, axis=1)
+        if iteration > 0 and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+
+        cluster_weights = np.bincount(labels, weights=weights, minlength=len(centers))
+        new_centers = centers.copy()
+        filled = cluster_weights > 0
+        one_hot = np.zeros((len(points), len(centers)))
+        one_hot[np.arange(len(points)), labels] = weights
+        sums = one_hot.T @ points
+        new_centers[filled] = sums[filled] / cluster_weights[filled, None]
+
+        shift = float(((new_centers - centers) ** 2).sum())
+        centers = new_centers
+        if shift <= tol:
+            labels = np.argmin(_squared_distances(points, centers, point_norms), axis=1)
+            break
+
+    distances = _squared_distances(points, centers, point_norms)
+    inertia = float((weights * distances[np.arange(len(points)), labels]).sum())
+    return centers, labels, inertia
+
+
+def weighted_kmeans(
+    points: np.ndarray,
+    n_clusters: int,
+    weights: Optional[np.ndarray] = None,
+    n_init: int = 3,
+    max_iter: int = 300,
+    random_state: Optional[int] = 42,
+    tol: float = 1e-4,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    加权 K-means。
+
+    points: (N, D) 数组
+    weights: (N,) 非负权重，默认全为 1
+    返回 (centers, labels)：centers 为 (K, D) float64，labels 为每个点所属簇的下标。
+    点的种类少于 n_clusters 时，返回的簇数也会相应减少。n_init 次初始化中取加权误差最小的一次。
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if points.ndim != 2 or len(points) == 0:
+        raise ValueError("聚类输入必须是非空的 (N, D) 数组")
+    if weights is None:
+        weights = np.ones(len(points))
+    else:
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.shape != (len(points),) or weights.sum() <= 0:
+            raise ValueError("权重必须与输入点一一对应且总和为正")
+
+    n_clusters = max(1, min(n_clusters, len(points)))
+    # 收敛阈值相对于数据方差，与 scikit-learn 的约定一致
+    tolerance = tol * float(np.mean(np.var(points, axis=0)))
+    rng = np.random.default_rng(random_state)
+
+    best = None
+    for _ in range(max(1, n_init)):
+        centers = _kmeans_plus_plus(points, weights, n_clusters, rng)
+        result = _lloyd(points, weights, centers, max_iter, tolerance)
+        if best is None or result[2] < best[2]:
+            best = result
+
+    centers, labels, _ = best
+    return centers, labels
+
+
+def kmeans(
+    points: np.ndarray,
+    n_clusters: int,
+    weights: Optional[np.ndarray] = None,
+    n_init: int = 3,
+    max_iter: int = 300,
+    random_state: Optional[int] = 42,
+    backend: str = DEFAULT_BACKEND,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按后端执行加权 K-means，返回 (centers, labels)。
+
+    backend: 'numpy'（默认）或 'sklearn'；scikit-learn 只在选择该后端时才导入
+    """
+    if backend == 'numpy':
+        return weighted_kmeans(points, n_clusters, weights, n_init, max_iter, random_state)
+    if backend == 'sklearn':
+        from sklearn.cluster import KMeans
+
+        model = KMeans(
+            n_clusters=n_clusters, random_state=random_state, n_init=n_init, max_iter=max_iter
+        )
+        model.fit(points, sample_weight=weights)
+        return model.cluster_centers_, model.labels_
+    raise ValueError(f"未知的聚类后端: {backend}")
@@ -0,0 +1,344 @@
+"""
+色差公式
+
+所有公式都是向量化的，输入按 NumPy 规则广播：lab1 为 (N, 1, 3)、lab2 为 (M, 3) 时
+得到 (N, M) 的色差矩阵。按速度从快到慢：
+
+- cie76: LAB 空间的欧氏距离
+- cam02ucs: CAM02-UCS 均匀色空间的欧氏距离（固定 sRGB 观察条件）；坐标只依赖单个颜色，
+  可以预先计算，查询时与 cie76 一样快，感知均匀性接近 ciede2000
+- cie94: 图形艺术参数（kL=1，K1=0.045，K2=0.015），以第一个参数为参考色
+- ciede2000: 最精确也最慢，默认使用
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from .colorspace import lab_to_xyz
+
+DEFAULT_METRIC = 'ciede2000'
+
+
+def _identity(lab: np.ndarray) -> np.ndarray:
+    return lab
+
+
+def _euclidean(c1: np.ndarray, c2: np.ndarray) -> np.ndarray:
+    c1 = np.asarray(c1, dtype=np.float64)
+    c2 = np.asarray(c2, dtype=np.float64)
+    return np.sqrt(
+        (c2[..., 0] - c1[..., 0]) ** 2
+        + (c2[..., 1] - c1[..., 1]) ** 2
+        + (c2[..., 2] - c1[..., 2]) ** 2
+    )
+
+
+def delta_e_cie76(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """CIE76 色差（LAB 欧氏距离）"""
+    return _euclidean(lab1, lab2)
+
+
+def delta_e_cie94(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """CIE94 色差，lab1 为参考色"""
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    C1 = np.sqrt(lab1[..., 1] ** 2 + lab1[..., 2] ** 2)
+    C2 = np.sqrt(lab2[..., 1] ** 2 + lab2[..., 2] ** 2)
+
+    delta_L = lab1[..., 0] - lab2[..., 0]
+    delta_C = C1 - C2
+    delta_ab = (lab1[..., 1] - lab2[..., 1]) ** 2 + (lab1[..., 2] - lab2[..., 2]) ** 2
+    # ΔH² = Δa² + Δb² - ΔC²，浮点误差可能使其略小于 0
+    delta_H_sq = np.maximum(delta_ab - delta_C**2, 0.0)
+
+    S_C = 1 + 0.045 * C1
+    S_H = 1 + 0.015 * C1
+    return np.sqrt(delta_L**2 + (delta_C / S_C) ** 2 + delta_H_sq / S_H**2)
+
+
+def delta_e_ciede2000(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """
+    CIEDE2000 色差
+
+    考虑了人眼对不同亮度、色度、色相的敏感度差异，
+    以及中性色区域的补偿和蓝色区域的旋转补偿。
+    """
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    L1, a1, b1 = lab1[..., 0], lab1[..., 1], lab1[..., 2]
+    L2, a2, b2 = lab2[..., 0], lab2[..., 1], lab2[..., 2]
+
+    # 计算 C1, C2
+    C1 = np.sqrt(a1**2 + b1**2)
+    C2 = np.sqrt(a2**2 + b2**2)
+    C_bar = (C1 + C2) / 2
+
+    # 计算 G
+    G = 0.5 * (1 - np.sqrt(C_bar**7 / (C_bar**7 + 25**7)))
+
+    # 计算 a'
+    a1_prime = a1 * (1 + G)
+    a2_prime = a2 * (1 + G)
+
+    # 计算 C'
+    C1_prime = np.sqrt(a1_prime**2 + b1**2)
+    C2_prime = np.sqrt(a2_prime**2 + b2**2)
+    C_bar_prime = (C1_prime + C2_prime) / 2
+
+    # 计算 h'
+    def calc_h_prime(a_prime, b):
+        h = np.arctan2(b, a_prime)
+        h = np.where(h < 0, h + 2 * np.pi, h)
+        return np.where((a_prime == 0) & (b == 0), 0.0, h)
+
+    h1_prime = calc_h_prime(a1_prime, b1)
+    h2_prime = calc_h_prime(a2_prime, b2)
+
+    # 计算 ΔL', ΔC', ΔH'
+    delta_L_prime = L2 - L1
+    delta_C_prime = C2_prime - C1_prime
+
+    # 计算 Δh'
+    zero_chroma = C1_prime * C2_prime == 0
+    h_diff = h2_prime - h1_prime
+    delta_h_prime = np.where(
+        zero_chroma,
+        0.0,
+        np.where(
+            np.abs(h_diff) <= np.pi,
+            h_diff,
+            np.where(h_diff > np.pi, h_diff - 2 * np.pi, h_diff + 2 * np.pi),
+        ),
+    )
+
+    delta_H_prime = 2 * np.sqrt(C1_prime * C2_prime) * np.sin(delta_h_prime / 2)
+
+    # 计算 L̄'
+    L_bar_prime = (L1 + L2) / 2
+
+    # 计算 H̄'
+    h_sum = h1_prime + h2_prime
+    H_bar_prime = np.where(
+        zero_chroma,
+        h_sum,
+        np.where(
+            np.abs(h1_prime - h2_prime) <= np.pi,
+            h_sum / 2,
+            np.where(h_sum < 2 * np.pi, (h_sum + 2 * np.pi) / 2, (h_sum - 2 * np.pi) / 2),
+        ),
+    )
+
+    # 计算 T
+    T = (
+        1
+        - 0.17 * np.cos(H_bar_prime - np.pi / 6)
+        + 0.24 * np.cos(2 * H_bar_prime)
+        + 0.32 * np.cos(3 * H_bar_prime + np.pi / 30)
+        - 0.20 * np.cos(4 * H_bar_prime - 63 * np.pi / 180)
+    )
+
+    # 计算 S_L, S_C, S_H
+    S_L = 1 + (0.015 * (L_bar_prime - 50) ** 2) / np.sqrt(20 + (L_bar_prime - 50) ** 2)
+    S_C = 1 + 0.045 * C_bar_prime
+    S_H = 1 + 0.015 * C_bar_prime * T
+
+    # 计算 R_T
+    delta_theta = 30 * np.exp(-(((H_bar_prime - 275 * np.pi / 180) / (25 * np.pi / 180)) ** 2))
+    R_C = 2 * np.sqrt(C_bar_prime**7 / (C_bar_prime**7 + 25**7))
+    R_T = -np.sin(2 * delta_theta * np.pi / 180) * R_C
+
+    # 计算 ΔE00
+    return np.sqrt(
+        (delta_L_prime / S_L) ** 2
+        + (delta_C_prime / S_C) ** 2
+        + (delta_H_prime / S_H) ** 2
+        + R_T * (delta_C_prime / S_C) * (delta_H_prime / S_H)
+    )
+
+
+def ciede2000_lower_bound(lab1: np.ndarray, lab2: np.ndarray) -> np.ndarray:
+    """
+    ΔE2000 的廉价下界（不含三角函数），广播规则与 delta_e_ciede2000 相同
+
+    推导要点：
+    - L' = L，S_L 只依赖 L̄'，可以精确计算
+    - G 只依赖未修正的 C̄，可以精确计算；C' ≤ (1+G)·C 给出 C̄' 的上界，
+      进而给出 S_C、R_C 的上界，且 T ≤ 1.93 使 S_H ≤ S_C
+    - ΔC'² + ΔH'² 等于 (a', b) 平面上的距离²，即 (1+G)²Δa² + Δb²
+    - |R_T| ≤ 2·sin(60°)·R_C/2，交叉项满足 R_T·x·y ≥ -|R_T|/2·(x² + y²)
+    """
+    lab1 = np.asarray(lab1, dtype=np.float64)
+    lab2 = np.asarray(lab2, dtype=np.float64)
+    C1 = np.sqrt(lab1[..., 1] ** 2 + lab1[..., 2] ** 2)
+    C2 = np.sqrt(lab2[..., 1] ** 2 + lab2[..., 2] ** 2)
+
+    C_bar = (C1 + C2) / 2
+    G = 0.5 * (1 - np.sqrt(C_bar**7 / (C_bar**7 + 25**7)))
+    C_bar_prime = (1 + G) * C_bar
+
+    L_bar = (lab1[..., 0] + lab2[..., 0]) / 2
+    S_L = 1 + (0.015 * (L_bar - 50) ** 2) / np.sqrt(20 + (L_bar - 50) ** 2)
+    S_C = 1 + 0.045 * C_bar_prime
+    R_C = 2 * np.sqrt(C_bar_prime**7 / (C_bar_prime**7 + 25**7))
+
+    delta_L = lab2[..., 0] - lab1[..., 0]
+    delta_ab = ((1 + G) * (lab2[..., 1] - lab1[..., 1])) ** 2 + (lab2[..., 2] - lab1[..., 2]) ** 2
+    return np.sqrt((delta_L / S_L) ** 2 + (1 - np.sin(np.pi / 3) * R_C / 2) * delta_ab / S_C**2)
+
+
+# L̄ ∈ [0, 100] 时 S_L 的最大值（L̄ = 0 或 100）
+_MAX_S_L = 1 + (0.015 * 50**2) / np.sqrt(20 + 50**2)
+
+
+def ciede2000_search_radius(lab: np.ndarray, delta_e: np.ndarray) -> np.ndarray:
+    """
+    LAB 欧氏半径 r：与 lab 的 ΔE2000 不超过 delta_e 的颜色都在以 lab 为中心、半径 r 的球内。
+
+    由 ciede2000_lower_bound 放缩得到，记 d 为欧氏距离、C 为 lab 的彩度：
+    - S_L ≤ _MAX_S_L，因此下界的亮度项 ≥ ΔL² / _MAX_S_L²
+    - (1+G)²Δa² + Δb² ≥ Δa² + Δb²，1 - sin(60°)·R_C/2 ≥ 1 - sin(60°)
+    - 另一颜色的彩度 ≤ C + d，故 S_C ≤ 1 + 0.0675·(C + d/2)
+    两项取较小的系数得到 ΔE2000 ≥ d·min(1/_MAX_S_L, √κ / S_C(d))，再对 d 求解。
+    √κ / S_C(d) 随 d 增大趋于常数，delta_e 超过该极限时返回 inf（无法剪枝）。
+    """
+    lab = np.asarray(lab, dtype=np.float64)
+    delta_e = np.asarray(delta_e, dtype=np.float64)
+    chroma = np.sqrt(lab[..., 1] ** 2 + lab[..., 2] ** 2)
+    kappa = np.sqrt(1 - np.sin(np.pi / 3))
+
+    lightness_radius = delta_e * _MAX_S_L
+    denominator = kappa - 0.03375 * delta_e
+    with np.errstate(divide='ignore', invalid='ignore'):
+        chroma_radius = np.where(
+            denominator > 0, delta_e * (1 + 0.0675 * chroma) / denominator, np.inf
+        )
+    return np.maximum(lightness_radius, chroma_radius)
+
+
+# CIECAM02 观察条件：sRGB 标准（环境亮度 64 lux，平均环绕，背景 Y=20）
+_L_A = 64 / np.pi / 5
+_Y_B = 20.0
+_F, _C, _NC = 1.0, 0.69, 1.0
+
+_M_CAT02 = np.array(
+    [
+        [0.7328, 0.4296, -0.1624],
+        [-0.7036, 1.6975, 0.0061],
+        [0.0030, 0.0136, 0.9834],
+    ]
+)
+_M_HPE = np.array(
+    [
+        [0.38971, 0.68898, -0.07868],
+        [-0.22981, 1.18340, 0.04641],
+        [0.00000, 0.00000, 1.00000],
+    ]
+)
+
+
+def _cam02_constants() -> Dict[str, float]:
+    white = lab_to_xyz(np.array([100.0, 0.0, 0.0])) * 100
+    rgb_w = _M_CAT02 @ white
+    D = np.clip(_F * (1 - (1 / 3.6) * np.exp((-_L_A - 42) / 92)), 0, 1)
+    k = 1 / (5 * _L_A + 1)
+    F_L = 0.2 * k**4 * (5 * _L_A) + 0.1 * (1 - k**4) ** 2 * (5 * _L_A) ** (1 / 3)
+    n = _Y_B / white[1]
+    N_bb = 0.725 * n ** (-0.2)
+    constants = {
+        'adapt': white[1] * D / rgb_w + 1 - D,
+        'F_L': F_L,
+        'n': n,
+        'z': 1.48 + np.sqrt(n),
+        'N_bb': N_bb,
+    }
+    # 白点的无色响应
+    constants['A_w'] = _achromatic_response(_cam02_compress(rgb_w, constants), N_bb)
+    return constants
+
+
+def _cam02_compress(rgb: np.ndarray, constants: Dict) -> np.ndarray:
+    """色适应、转换到 HPE 锥响应并做非线性压缩"""
+    rgb_c = rgb * constants['adapt']
+    rgb_p = rgb_c @ (_M_HPE @ np.linalg.inv(_M_CAT02)).T
+    x = (constants['F_L'] * np.abs(rgb_p) / 100) ** 0.42
+    return np.sign(rgb_p) * 400 * x / (x + 27.13) + 0.1
+
+
+def _achromatic_response(rgb_a: np.ndarray, N_bb: float) -> np.ndarray:
+    return (2 * rgb_a[..., 0] + rgb_a[..., 1] + rgb_a[..., 2] / 20 - 0.305) * N_bb
+
+
+_CAM02 = _cam02_constants()
+
+
+def lab_to_cam02ucs(lab: np.ndarray) -> np.ndarray:
+    """
+    LAB 转 CAM02-UCS 的 J'a'b' 坐标
+
+    lab: 形状为 (..., 3) 的数组
+    返回形状相同的 float64 数组，坐标间的欧氏距离即为 CAM02-UCS 色差。
+    """
+    xyz = lab_to_xyz(lab) * 100
+    rgb_a = _cam02_compress(xyz @ _M_CAT02.T, _CAM02)
+    R, G, B = rgb_a[..., 0], rgb_a[..., 1], rgb_a[..., 2]
+
+    a = R - 12 * G / 11 + B / 11
+    b = (R + G - 2 * B) / 9
+    h = np.arctan2(b, a)
+    e_t = 0.25 * (np.cos(h + 2) + 3.8)
+
+    A = _achromatic_response(rgb_a, _CAM02['N_bb'])
+    J = 100 * np.maximum(A / _CAM02['A_w'], 0) ** (_C * _CAM02['z'])
+    t = (50000 / 13 * _NC * _CAM02['N_bb'] * e_t * np.sqrt(a**2 + b**2)) / (R + G + 21 / 20 * B)
+    C = t**0.9 * np.sqrt(J / 100) * (1.64 - 0.29 ** _CAM02['n']) ** 0.73
+    M = C * _CAM02['F_L'] ** 0.25
+
+    # CAM02-UCS（Luo 等，2006）
+    J_prime = 1.7 * J / (1 + 0.007 * J)
+    M_prime = np.log1p(0.0228 * M) / 0.0228
+    return np.stack([J_prime, M_prime * np.cos(h), M_prime * np.sin(h)], axis=-1)
+
+
+@dataclass(frozen=True)
+class ColorDifference:
+    """
+    色差公式
+
+    to_coords 把 LAB 转换为公式使用的坐标（对单个颜色计算，可预先缓存），
+    distance 在该坐标上计算广播的色差。lower_bound 为可选的廉价下界（输入为 LAB），
+    search_radius(lab, d) 为可选的 LAB 欧氏半径，色差不超过 d 的颜色都在该半径内；
+    两者都提供时可以用空间索引做精确剪枝。
+    """
+
+    name: str
+    distance: Callable[[np.ndarray, np.ndarray], np.ndarray]
+    to_coords: Callable[[np.ndarray], np.ndarray] = _identity
+    lower_bound: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None
+    search_radius: Optional[Callable[[np.ndarray, np.ndarray], np.ndarray]] = None
+
+
+METRICS: Dict[str, ColorDifference] = {
+    'cie76': ColorDifference('cie76', delta_e_cie76),
+    'cam02ucs': ColorDifference('cam02ucs', _euclidean, to_coords=lab_to_cam02ucs),
+    'cie94': ColorDifference('cie94', delta_e_cie94),
+    'ciede2000': ColorDifference(
+        'ciede2000',
+        delta_e_ciede2000,
+        lower_bound=ciede2000_lower_bound,
+        search_radius=ciede2000_search_radius,
+    ),
+}
+
+
+def get_metric(name: Optional[str] = None) -> ColorDifference:
+    """按名称获取色差公式，None 表示默认的 ciede2000"""
+    if name is None:
+        name = DEFAULT_METRIC
+    try:
+        return METRICS[name.lower()]
+    except KeyError:
+        raise ValueError(f"未知的色差公式: {name}，可选: {', '.join(METRICS)}") from None
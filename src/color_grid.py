@@ -0,0 +1,189 @@
+"""
+颜色网格
+
+ColorGrid 用 (rows, cols, 3) uint8 数组保存每个单元格的 RGB 颜色，并缓存去重后的颜色表：
+
+- palette: (K, 3) uint8，去重后的颜色，按 24 位打包值升序
+- inverse: (rows, cols)，每个单元格在 palette 中的下标
+- counts: (K,)，每种颜色占据的单元格数
+- first_index: (K,)，每种颜色第一次出现的单元格（按行展开后的下标）
+
+网格创建后只读，重映射返回新网格（palette[inverse]）。为兼容原有的
+List[List[Tuple[int, int, int]]] 用法，ColorGrid 支持按行下标、迭代、len 和与列表比较，
+to_list() 返回列表视图。
+"""
+
+from __future__ import annotations
+
+from collections import Counter
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+RGB = Tuple[int, int, int]
+
+
+class ColorGrid:
+    """只读的二维颜色网格"""
+
+    def __init__(self, colors):
+        """
+        Args:
+            colors: (rows, cols, 3) 数组，或二维颜色列表 [[(r, g, b), ...], ...]
+        """
+        array = np.array(colors, dtype=np.uint8)
+        if array.size == 0 and array.ndim < 3:
+            # [] 或 [[], ...]：没有列的网格
+            array = np.zeros((array.shape[0] if array.ndim == 2 else 0, 0, 3), dtype=np.uint8)
+        if array.ndim != 3 or array.shape[2] != 3:
+            raise ValueError(f"颜色网格的形状应为 (rows, cols, 3)，实际为 {array.shape}")
+        array.flags.writeable = False
+
+        self._array = array
+        self._palette: Optional[np.ndarray] = None
+        self._inverse: Optional[np.ndarray] = None
+        self._counts: Optional[np.ndarray] = None
+        self._first_index: Optional[np.ndarray] = None
+        self._rows_view: Optional[List[List[RGB]]] = None
+
+    @classmethod
+    def from_colors(cls, colors) -> ColorGrid:
+        """把颜色网格统一转换为 ColorGrid，已经是 ColorGrid 时直接返回"""
+        if isinstance(colors, cls):
+            return colors
+        return cls(colors)
+
+    @property
+    def array(self) -> np.ndarray:
+        """(rows, cols, 3) uint8 只读数组"""
+        return self._array
+
+    @property
+    def rows(self) -> int:
+        return self._array.shape[0]
+
+    @property
+    def cols(self) -> int:
+        return self._array.shape[1]
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.rows, self.cols
+
+    def _build_tables(self) -> None:
+        pixels = self._array.reshape(-1, 3)
+        packed = (
+            (pixels[:, 0].astype(np.uint32) << 16)
+            | (pixels[:, 1].astype(np.uint32) << 8)
+            | pixels[:, 2]
+        )
+        unique_packed, first_index, inverse, counts = np.unique(
+            packed, return_index=True, return_inverse=True, return_counts=True
+        )
+        palette = np.stack(
+            [(unique_packed >> 16) & 0xFF, (unique_packed >> 8) & 0xFF, unique_packed & 0xFF],
+            axis=-1,
+        ).astype(np.uint8)
+        for table in (palette, first_index, inverse, counts):
+            table.flags.writeable = False
+        self._palette = palette
+        self._inverse = inverse.reshape(self.rows, self.cols)
+        self._counts = counts
+        self._first_index = first_index
+
+    @property
+    def palette(self) -> np.ndarray:
+        """(K, 3) uint8，去重后的颜色"""
+        if self._palette is None:
+            self._build_tables()
+        return self._palette
+
+    @property
+    def inverse(self) -> np.ndarray:
+        """(rows, cols)，每个单元格在 palette 中的下标"""
+        if self._inverse is None:
+            self._build_tables()
+        return self._inverse
+
+    @property
+    def counts(self) -> np.ndarray:
+        """(K,)，palette 中每种颜色的单元格数"""
+        if self._counts is None:
+            self._build_tables()
+        return self._counts
+
+    @property
+    def first_index(self) -> np.ndarray:
+        """(K,)，palette 中每种颜色第一次出现的单元格（按行展开后的下标）"""
+        if self._first_index is None:
+            self._build_tables()
+        return self._first_index
+
+    def unique_colors(self) -> List[RGB]:
+        """去重后的颜色元组，顺序与 palette 相同"""
+        return [tuple(color) for color in self.palette.tolist()]
+
+    def first_seen_colors(self) -> List[RGB]:
+        """去重后的颜色元组，按逐行扫描时第一次出现的顺序"""
+        return [tuple(color) for color in self.palette[self._first_seen_order()].tolist()]
+
+    def color_counts(self) -> Counter:
+        """每种颜色的单元格数，键按第一次出现的顺序（与逐个单元格计数的 Counter 相同）"""
+        order = self._first_seen_order()
+        return Counter(dict(zip(self.first_seen_colors(), self.counts[order].tolist())))
+
+    def _first_seen_order(self) -> np.ndarray:
+        return np.argsort(self.first_index)
+
+    def remap(self, palette: np.ndarray) -> ColorGrid:
+        """
+        按新颜色表重映射。
+
+        palette: (K, 3)，与 self.palette 一一对应的新颜色
+        """
+        palette = np.asarray(palette, dtype=np.uint8)
+        if palette.shape != self.palette.shape:
+            raise ValueError(f"新颜色表的形状应为 {self.palette.shape}，实际为 {palette.shape}")
+        return ColorGrid(palette[self.inverse])
+
+    def map_colors(self, color_map: Dict[RGB, RGB]) -> ColorGrid:
+        """按 {原颜色: 新颜色} 重映射，未出现在字典中的颜色保持不变"""
+        unique = self.unique_colors()
+        mapped = [color_map.get(color, color) for color in unique]
+        if mapped == unique:
+            return self
+        return self.remap(np.array(mapped, dtype=np.uint8).reshape(-1, 3))
+
+    def to_list(self) -> List[List[RGB]]:
+        """List[List[Tuple[int, int, int]]] 兼容视图（缓存，请勿修改）"""
+        if self._rows_view is None:
+            self._rows_view = [[tuple(color) for color in row] for row in self._array.tolist()]
+        return self._rows_view
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, index):
+        return self.to_list()[index]
+
+    def __iter__(self) -> Iterator[List[RGB]]:
+        return iter(self.to_list())
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ColorGrid):
+            return self._array.shape == other._array.shape and bool(
+                np.array_equal(self._array, other._array)
+            )
+        if isinstance(other, list):
+            return self.to_list() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __array__(self, dtype=None, copy=None) -> np.ndarray:
+        if dtype is None:
+            return self._array.copy() if copy else self._array
+        return self._array.astype(dtype)
+
+    def __repr__(self) -> str:
+        return f"ColorGrid(rows={self.rows}, cols={self.cols})"
@@ -1,25 +1,85 @@
 """拼豆标准色号映射模块
 
-使用 CIEDE2000 算法将任意颜色映射到最接近的拼豆标准色号。
-CIEDE2000 是目前最先进的颜色相似度算法，考虑了人眼对颜色差异的感知特性。
+默认使用 CIEDE2000 算法将任意颜色映射到最接近的拼豆标准色号。
+CIEDE2000 是目前最先进的颜色相似度算法，考虑了人眼对颜色差异的感知特性；
+也可以按映射器或按调用选择更快的色差公式（见 `color_difference`），
+例如批量预览用 cie76 / cam02ucs，最终导出用 ciede2000。
 """
 
-import pandas as pd
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
 import numpy as np
-from typing import Tuple, Dict, List, Union
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+from .color_difference import ColorDifference, get_metric
+from .color_grid import ColorGrid
+from .colorspace import rgb_to_lab, rgb_to_lab_cached
 
 
 class PerlerBeadColorMapper:
     """拼豆颜色映射器"""
     
-    def __init__(self, excel_path: str):
+    # 批量计算色差时每块处理的输入颜色数
+    BATCH_SIZE = 2048
+    # 查找表支持的最大 top_n，以及每个量化格子最多保存的候选数量
+    LUT_TOP_N = 3
+    LUT_WIDTH = 10
+    # 空间索引首轮取的欧氏近邻数量
+    INDEX_CANDIDATES = 32
+    
+    def __init__(
+        self,
+        excel_path: str,
+        memo_size: int = 65536,
+        lut_size: int = 0,
+        lut_cache_size: int = 4,
+        lut_top_n: int = 1,
+        index_threshold: int = 1000,
+        metric: str = 'ciede2000',
+    ):
         """初始化颜色映射器
         
         Args:
             excel_path: 拼豆色号Excel文件路径
+            memo_size: 颜色匹配结果缓存的最大条目数，0 表示不缓存
+            lut_size: RGB 查找表每个通道的量化级数（如 32、64），0 表示不使用查找表。
+                查找表是近似方法：格子的候选来自角点的排名，不能严格保证包含格子内
+                每个颜色的真实前几名
+            lut_cache_size: 按允许色号集合缓存的查找表（及空间索引）数量上限
+            lut_top_n: 查找表服务的最大 top_n（不超过 LUT_TOP_N），更大的 top_n 走精确查找。
+                第 1 名在 20 万个随机颜色上与精确查找完全一致；第 2、3 名在决策边界附近
+                偶有不同（lut_size 为 16 时约万分之三），需要时显式设为 3
+            index_threshold: 候选色号数达到该值时使用 LAB 空间索引，0 表示总是使用，
+                None 表示不使用
+            metric: 默认的色差公式（cie76、cie94、ciede2000、cam02ucs），
+                各查询方法也可以单独指定
         """
+        if lut_size and (lut_size > 256 or 256 % lut_size != 0):
+            raise ValueError(f"lut_size 必须能整除 256: {lut_size}")
+        if not 1 <= lut_top_n <= self.LUT_TOP_N:
+            raise ValueError(f"lut_top_n 必须在 1 到 {self.LUT_TOP_N} 之间: {lut_top_n}")
+        
         self.color_map: Dict[str, Tuple[int, int, int]] = {}
         self.lab_colors: Dict[str, np.ndarray] = {}
+        self.memo_size = memo_size
+        self.lut_size = lut_size
+        self.lut_cache_size = lut_cache_size
+        self.lut_top_n = lut_top_n
+        self.index_threshold = index_threshold
+        self.metric = get_metric(metric).name
+        # 色差公式名称 -> 调色板在该公式坐标下的数组
+        self._palette_coords: Dict[str, np.ndarray] = {}
+        # (色差公式, 允许色号集合, top_n, rgb) -> (下标元组, 色差元组)，按最近使用顺序淘汰
+        self._memo: "OrderedDict[tuple, Tuple[tuple, tuple]]" = OrderedDict()
+        # (色差公式, 允许色号集合) -> 查找表，按最近使用顺序淘汰
+        self._lut_cache: "OrderedDict[tuple, Dict[str, np.ndarray]]" = OrderedDict()
+        # 允许色号集合 -> LAB 空间索引
+        self._index_cache: "OrderedDict[Optional[frozenset], Optional[Dict]]" = OrderedDict()
+        # 映射器可能被多个线程共用（如 web 服务），上面三个缓存的读改写都在锁内进行
+        self._cache_lock = threading.Lock()
         self._load_colors(excel_path)
     
     def _rgb_to_lab(self, rgb: Tuple[int, int, int]) -> np.ndarray:
@@ -31,39 +91,7 @@ class PerlerBeadColorMapper:
         Returns:
             LAB值的numpy数组 [L, a, b]
         """
-        # 归一化到 0-1
-        r, g, b = rgb[0] / 255.0, rgb[1] / 255.0, rgb[2] / 255.0
-        
-        # Gamma 校正
-        def gamma_correct(c):
-            return ((c + 0.055) / 1.055) ** 2.4 if c > 0.04045 else c / 12.92
-        
-        r = gamma_correct(r)
-        g = gamma_correct(g)
-        b = gamma_correct(b)
-        
-        # RGB to XYZ
-        x = r * 0.4124564 + g * 0.3575761 + b * 0.1804375
-        y = r * 0.2126729 + g * 0.7151522 + b * 0.0721750
-        z = r * 0.0193339 + g * 0.1191920 + b * 0.9503041
-        
-        # XYZ to LAB (使用 D65 标准光源)
-        x = x / 0.95047
-        y = y / 1.00000
-        z = z / 1.08883
-        
-        def f(t):
-            return t ** (1/3) if t > 0.008856 else (7.787 * t + 16/116)
-        
-        fx = f(x)
-        fy = f(y)
-        fz = f(z)
-        
-        L = 116 * fy - 16
-        a = 500 * (fx - fy)
-        b = 200 * (fy - fz)
-        
-        return np.array([L, a, b])
+        return np.array(rgb_to_lab_cached(tuple(int(v) for v in rgb)))
     
     def _delta_e_cie2000(self, lab1: np.ndarray, lab2: np.ndarray) -> float:
         """计算 CIEDE2000 色差
@@ -162,13 +190,556 @@ class PerlerBeadColorMapper:
         
         return float(delta_E)
     
+    def _resolve_metric(self, metric: Optional[str]) -> ColorDifference:
+        """按名称取色差公式，None 表示使用映射器的默认公式"""
+        return get_metric(metric if metric is not None else self.metric)
+    
+    def _get_palette_coords(self, metric: ColorDifference) -> np.ndarray:
+        """调色板在色差公式坐标下的数组（按公式缓存）"""
+        coords = self._palette_coords.get(metric.name)
+        if coords is None:
+            coords = metric.to_coords(self.palette_lab)
+            self._palette_coords[metric.name] = coords
+        return coords
+    
+    def _select_palette(self, allowed_colors: Optional[Iterable[str]] = None) -> np.ndarray:
+        """返回允许参与匹配的色号在调色板数组中的下标（保持原有顺序）"""
+        if allowed_colors is not None and len(allowed_colors) > 0:
+            allowed = set(allowed_colors)
+            return np.array(
+                [i for i, code in enumerate(self.codes) if code in allowed], dtype=np.intp
+            )
+        return np.arange(len(self.codes), dtype=np.intp)
+    
+    def _top_k(self, delta_e: np.ndarray, k: int) -> np.ndarray:
+        """按色差选出每行前 k 个下标
+        
+        使用 argpartition 只对前 k 个元素排序；色差相同时按调色板顺序排列，
+        与逐个计算后稳定排序的结果一致。
+        
+        Args:
+            delta_e: (N, M) 色差矩阵
+            k: 需要的结果数量
+        
+        Returns:
+            (N, k) 的下标数组
+        """
+        n, m = delta_e.shape
+        k = min(k, m)
+        if k >= m:
+            return np.argsort(delta_e, axis=1, kind='stable')
+        
+        part = np.argpartition(delta_e, k - 1, axis=1)[:, :k]
+        part_values = np.take_along_axis(delta_e, part, axis=1)
+        # 第 k 小的值；若有并列值跨越分区边界，需要回退到稳定排序
+        kth = part_values.max(axis=1)
+        ties = (delta_e <= kth[:, None]).sum(axis=1) > k
+        
+        # 先按下标、再按色差稳定排序，得到 (色差, 下标) 的字典序
+        part.sort(axis=1)
+        part_values = np.take_along_axis(delta_e, part, axis=1)
+        order = np.argsort(part_values, axis=1, kind='stable')
+        top = np.take_along_axis(part, order, axis=1)
+        
+        for row in np.flatnonzero(ties):
+            top[row] = np.argsort(delta_e[row], kind='stable')[:k]
+        return top
+    
+    def _find_closest_exact(
+        self,
+        rgb_array: np.ndarray,
+        top_n: int,
+        candidates: np.ndarray,
+        metric: ColorDifference,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """对候选色号逐一计算色差的精确查找（分块的全量矩阵运算）"""
+        input_coords = metric.to_coords(rgb_to_lab(rgb_array))
+        candidate_coords = self._get_palette_coords(metric)[candidates][None, :, :]
+        k = min(top_n, len(candidates))
+        indices = np.empty((len(input_coords), k), dtype=np.intp)
+        distances = np.empty((len(input_coords), k), dtype=np.float64)
+        
+        # 分块计算，避免 N×M 的中间数组过大
+        for start in range(0, len(input_coords), self.BATCH_SIZE):
+            stop = start + self.BATCH_SIZE
+            delta_e = metric.distance(input_coords[start:stop, None, :], candidate_coords)
+            top = self._top_k(delta_e, k)
+            indices[start:stop] = candidates[top]
+            distances[start:stop] = np.take_along_axis(delta_e, top, axis=1)
+        
+        return indices, distances
+    
+    def _get_index(self, allowed_colors: List[str], candidates: np.ndarray) -> Optional[Dict]:
+        """获取（必要时构建）候选色号 LAB 坐标上的 KD 树
+        
+        索引与色差公式无关，可供所有提供下界的公式共用。
+        scipy 不可用时返回 None，调用方回退到全量计算。
+        """
+        key = self._allowed_key(allowed_colors)
+        with self._cache_lock:
+            if key in self._index_cache:
+                self._index_cache.move_to_end(key)
+                return self._index_cache[key]
+        
+        try:
+            from scipy.spatial import cKDTree
+        except ImportError:
+            index = None
+        else:
+            lab = self.palette_lab[candidates]
+            index = {'tree': cKDTree(lab), 'lab': lab}
+        
+        self._cache_put(self._index_cache, key, index, self.lut_cache_size)
+        return index
+    
+    def _find_closest_indexed(
+        self,
+        rgb_array: np.ndarray,
+        top_n: int,
+        candidates: np.ndarray,
+        index: Dict,
+        metric: ColorDifference,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """空间索引查找
+        
+        先用 KD 树取欧氏近邻，用色差公式重新排序得到第 top_n 名的色差 d。色差不超过 d 的
+        色号都在 LAB 欧氏半径 search_radius(lab, d) 的球内，用 query_ball_point 取出球内
+        色号，再用 lower_bound 过滤，只对剩下的色号计算精确色差，结果与全量计算一致。
+        半径为 inf（d 太大，无法剪枝）的颜色退回到对全部候选计算。
+        """
+        input_lab = rgb_to_lab(rgb_array)
+        input_coords = metric.to_coords(input_lab)
+        candidate_coords = self._get_palette_coords(metric)[candidates]
+        k = min(top_n, len(candidates))
+        n_neighbors = min(len(candidates), max(self.INDEX_CANDIDATES, 4 * k))
+        indices = np.empty((len(rgb_array), k), dtype=np.intp)
+        distances = np.empty((len(rgb_array), k), dtype=np.float64)
+        
+        for start in range(0, len(input_lab), self.BATCH_SIZE):
+            stop = start + self.BATCH_SIZE
+            chunk = input_lab[start:stop]
+            chunk_coords = input_coords[start:stop]
+            
+            _, neighbors = index['tree'].query(chunk, k=n_neighbors)
+            neighbors = neighbors.reshape(len(chunk), n_neighbors)
+            neighbor_delta = metric.distance(chunk_coords[:, None, :], candidate_coords[neighbors])
+            # 下界、半径可能与真实色差恰好相等，留出浮点误差余量
+            kth = np.partition(neighbor_delta, k - 1, axis=1)[:, k - 1] * (1 + 1e-9) + 1e-9
+            
+            radius = metric.search_radius(chunk, kth) * (1 + 1e-9) + 1e-9
+            rows, cols = self._ball_pairs(index, chunk, radius, len(candidates))
+            keep = metric.lower_bound(chunk[rows], index['lab'][cols]) <= kth[rows]
+            rows, cols = rows[keep], cols[keep]
+            delta_e = metric.distance(chunk_coords[rows], candidate_coords[cols])
+            
+            # 每行按 (色差, 调色板顺序) 取前 k 个，与 _top_k 的并列规则相同
+            order = np.lexsort((cols, delta_e, rows))
+            rows, cols, delta_e = rows[order], cols[order], delta_e[order]
+            first = np.searchsorted(rows, np.arange(len(chunk) + 1))
+            if np.any(np.diff(first) < k):
+                # 浮点误差导致某行候选不足时，该块退回全量计算
+                chunk_indices, chunk_distances = self._find_closest_exact(
+                    rgb_array[start:stop], top_n, candidates, metric
+                )
+                indices[start:stop] = chunk_indices
+                distances[start:stop] = chunk_distances
+                continue
+            take = first[:-1, None] + np.arange(k)[None, :]
+            indices[start:stop] = candidates[cols[take]]
+            distances[start:stop] = delta_e[take]
+        
+        return indices, distances
+    
+    def _ball_pairs(
+        self, index: Dict, lab: np.ndarray, radius: np.ndarray, n_candidates: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """KD 树球查询，返回 (输入行号, 候选下标) 对；半径为 inf 的行与全部候选配对"""
+        bounded = np.isfinite(radius)
+        rows_list: List[np.ndarray] = []
+        cols_list: List[np.ndarray] = []
+        
+        bounded_rows = np.flatnonzero(bounded)
+        if len(bounded_rows):
+            balls = index['tree'].query_ball_point(lab[bounded_rows], r=radius[bounded_rows])
+            lengths = np.array([len(ball) for ball in balls], dtype=np.intp)
+            rows_list.append(np.repeat(bounded_rows, lengths))
+            cols_list.append(
+                np.concatenate([np.asarray(ball, dtype=np.intp) for ball in balls])
+                if lengths.sum()
+                else np.empty(0, dtype=np.intp)
+            )
+        
+        unbounded_rows = np.flatnonzero(~bounded)
+        if len(unbounded_rows):
+            rows_list.append(np.repeat(unbounded_rows, n_candidates))
+            cols_list.append(np.tile(np.arange(n_candidates), len(unbounded_rows)))
+        
+        return np.concatenate(rows_list), np.concatenate(cols_list)
+    
+    def _search(
+        self,
+        rgb_array: np.ndarray,
+        top_n: int,
+        allowed_colors: List[str],
+        candidates: np.ndarray,
+        metric: ColorDifference,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """精确查找：候选数量较多且公式提供下界时走空间索引，否则全量计算"""
+        if (
+            self.index_threshold is not None
+            and metric.lower_bound is not None
+            and metric.search_radius is not None
+            and len(candidates) >= self.index_threshold
+        ):
+            index = self._get_index(allowed_colors, candidates)
+            if index is not None:
+                return self._find_closest_indexed(rgb_array, top_n, candidates, index, metric)
+        return self._find_closest_exact(rgb_array, top_n, candidates, metric)
+    
+    def _get_lut(
+        self, allowed_colors: List[str], metric: ColorDifference
+    ) -> Dict[str, np.ndarray]:
+        """获取（必要时构建）允许色号集合和色差公式对应的 RGB 查找表
+        
+        查找表把 RGB 立方体量化为 lut_size³ 个格子。对格子的 8 个角点做精确匹配，
+        取各角点前 LUT_TOP_N + 1 名的并集作为该格子的候选（最多 LUT_WIDTH 个，不足时用
+        哨兵下标补齐）。并集过大说明格子跨越多条决策边界，标记为不稳定，
+        查询时走精确计算。
+        
+        Returns:
+            包含 candidates（候选下标）、top（格子候选，候选内下标）、
+            stable（格子是否远离决策边界）的字典
+        """
+        key = (metric.name, self._allowed_key(allowed_colors))
+        with self._cache_lock:
+            lut = self._lut_cache.get(key)
+            if lut is not None:
+                self._lut_cache.move_to_end(key)
+                return lut
+        
+        candidates = self._select_palette(allowed_colors)
+        n = self.lut_size
+        step = 256 // n
+        # 角点多取一名作为余量，减少格子内部排名变化被漏掉的情况
+        k = min(self.LUT_TOP_N + 1, len(candidates))
+        sentinel = len(candidates)
+        
+        # 角点网格 (n+1)³，最后一个角点取 255
+        levels = np.minimum(np.arange(n + 1) * step, 255)
+        r, g, b = np.meshgrid(levels, levels, levels, indexing='ij')
+        corners = np.stack([r, g, b], axis=-1).reshape(-1, 3)
+        
+        corner_top, _ = self._search(corners, k, allowed_colors, candidates, metric)
+        # 转换为候选列表内的下标（candidates 递增）
+        corner_top = np.searchsorted(candidates, corner_top).reshape(n + 1, n + 1, n + 1, k)
+        
+        # 每个格子取 8 个角点 Top k 的并集作为候选
+        union = np.concatenate(
+            [
+                corner_top[di:di + n, dj:dj + n, dk:dk + n]
+                for di in (0, 1)
+                for dj in (0, 1)
+                for dk in (0, 1)
+            ],
+            axis=-1,
+        )
+        union.sort(axis=-1)
+        duplicate = np.zeros(union.shape, dtype=bool)
+        duplicate[..., 1:] = union[..., 1:] == union[..., :-1]
+        union[duplicate] = sentinel
+        union.sort(axis=-1)
+        
+        width = self.LUT_WIDTH
+        stable = (union < sentinel).sum(axis=-1) <= width
+        top = union[..., :width]
+        lut = {
+            'candidates': candidates,
+            'top': top.astype(np.uint16),
+            'stable': stable,
+        }
+        self._cache_put(self._lut_cache, key, lut, self.lut_cache_size)
+        return lut
+    
+    def _cache_put(self, cache: OrderedDict, key, value, limit: int) -> None:
+        """在锁内写入 LRU 缓存并淘汰最久未使用的条目（构建过程本身不持有锁）"""
+        with self._cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > limit:
+                cache.popitem(last=False)
+    
+    def _find_closest_lut(
+        self,
+        rgb_array: np.ndarray,
+        top_n: int,
+        allowed_colors: List[str],
+        metric: ColorDifference,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """借助查找表的批量查找
+        
+        稳定格子内只对查找表给出的少量候选计算精确色差并重新排序，
+        边界格子回退到 `_search`。
+        """
+        lut = self._get_lut(allowed_colors, metric)
+        candidates = lut['candidates']
+        k = min(top_n, len(candidates))
+        
+        # 一次花式索引取出所有颜色所在格子的候选
+        bins = np.clip(rgb_array, 0, 255).astype(np.intp) // (256 // self.lut_size)
+        cell_top = lut['top'][bins[:, 0], bins[:, 1], bins[:, 2]].astype(np.intp)
+        stable = lut['stable'][bins[:, 0], bins[:, 1], bins[:, 2]]
+        
+        indices = np.empty((len(rgb_array), k), dtype=np.intp)
+        distances = np.empty((len(rgb_array), k), dtype=np.float64)
+        
+        if np.any(stable):
+            input_coords = metric.to_coords(rgb_to_lab(rgb_array[stable]))
+            local = cell_top[stable]
+            padding = local >= len(candidates)
+            top_global = candidates[np.minimum(local, len(candidates) - 1)]
+            delta_e = metric.distance(
+                input_coords[:, None, :], self._get_palette_coords(metric)[top_global]
+            )
+            delta_e[padding] = np.inf
+            # 候选已按调色板顺序排列，稳定排序保证色差并列时与精确查找一致
+            order = np.argsort(delta_e, axis=1, kind='stable')[:, :k]
+            indices[stable] = np.take_along_axis(top_global, order, axis=1)
+            distances[stable] = np.take_along_axis(delta_e, order, axis=1)
+        
+        if not np.all(stable):
+            boundary = ~stable
+            indices[boundary], distances[boundary] = self._search(
+                rgb_array[boundary], k, allowed_colors, candidates, metric
+            )
+        
+        return indices, distances
+    
+    def find_closest_colors(
+        self,
+        rgbs: Union[np.ndarray, Sequence[Tuple[int, int, int]]],
+        top_n: int = 1,
+        allowed_colors: List[str] = None,
+        metric: Optional[str] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """批量查找最接近的拼豆标准色号
+        
+        一次数组运算计算 N 个输入颜色与 M 个候选色号的色差矩阵。
+        启用查找表（lut_size > 0）且 top_n 不超过 lut_top_n 时，只有落在决策边界附近的
+        颜色才做全量计算（近似，见 __init__）；候选色号很多时用 LAB 空间索引缩小计算范围，
+        结果与全量计算一致。
+        
+        Args:
+            rgbs: 形状为 (N, 3) 的输入颜色
+            top_n: 每个颜色返回前 N 个结果
+            allowed_colors: 允许的色号列表，如果为None则使用所有色号
+            metric: 色差公式名称，None 表示使用映射器的默认公式
+        
+        Returns:
+            (indices, delta_e)：形状均为 (N, top_n)，indices 为 `self.codes` 中的下标
+        """
+        metric = self._resolve_metric(metric)
+        rgb_array = np.asarray(rgbs, dtype=np.float64).reshape(-1, 3)
+        candidates = self._select_palette(allowed_colors)
+        if len(candidates) == 0:
+            raise ValueError("没有可用的候选色号")
+        
+        if self.lut_size and top_n <= self.lut_top_n:
+            return self._find_closest_lut(rgb_array, top_n, allowed_colors, metric)
+        return self._search(rgb_array, top_n, allowed_colors, candidates, metric)
+    
+    def _allowed_key(self, allowed_colors: Optional[Iterable[str]]) -> Optional[frozenset]:
+        """把允许色号列表规范化为可哈希的缓存键，None 表示全部色号"""
+        if allowed_colors is not None and len(allowed_colors) > 0:
+            return frozenset(allowed_colors)
+        return None
+    
+    def _lookup_closest(
+        self,
+        rgbs: List[Tuple[int, int, int]],
+        top_n: int,
+        allowed_colors: List[str] = None,
+        metric: Optional[str] = None,
+    ) -> List[Tuple[tuple, tuple]]:
+        """带缓存的批量匹配
+        
+        先查询缓存，只对未命中的颜色调用一次 `find_closest_colors`。
+        缓存随映射器实例保留，跨多次调用复用。
+        
+        Args:
+            rgbs: 输入颜色列表（应已去重）
+            top_n: 每个颜色返回前 N 个结果
+            allowed_colors: 允许的色号列表，如果为None则使用所有色号
+            metric: 色差公式名称，None 表示使用映射器的默认公式
+        
+        Returns:
+            与 rgbs 一一对应的 (下标元组, 色差元组) 列表
+        """
+        metric_name = self._resolve_metric(metric).name
+        allowed_key = self._allowed_key(allowed_colors)
+        results: List[Optional[Tuple[tuple, tuple]]] = [None] * len(rgbs)
+        misses: List[int] = []
+        
+        with self._cache_lock:
+            for i, rgb in enumerate(rgbs):
+                key = (metric_name, allowed_key, top_n, rgb)
+                hit = self._memo.get(key)
+                if hit is None:
+                    misses.append(i)
+                else:
+                    self._memo.move_to_end(key)
+                    results[i] = hit
+        
+        if misses:
+            indices, delta_e = self.find_closest_colors(
+                [rgbs[i] for i in misses],
+                top_n=top_n,
+                allowed_colors=allowed_colors,
+                metric=metric_name,
+            )
+            for row, i in enumerate(misses):
+                results[i] = (tuple(indices[row].tolist()), tuple(delta_e[row].tolist()))
+            
+            if self.memo_size > 0:
+                with self._cache_lock:
+                    for i in misses:
+                        self._memo[(metric_name, allowed_key, top_n, rgbs[i])] = results[i]
+                    while len(self._memo) > self.memo_size:
+                        self._memo.popitem(last=False)
+        
+        return results
+    
     def _load_colors(self, excel_path: str) -> None:
-        """从Excel文件加载拼豆标准色号
+        """加载拼豆标准色号
+        
+        优先读取编译好的调色板缓存（与 Excel 同目录的 .palette.npz），
+        缓存缺失或源文件已修改时才解析 Excel 并重新生成缓存。
+        也可以直接传入 .npz 调色板文件。
+        
+        Args:
+            excel_path: Excel文件路径（或编译好的 .npz 调色板）
+        """
+        if excel_path.endswith('.npz'):
+            codes, rgb, lab = self._read_compiled_palette(excel_path)
+        else:
+            cache_path = self._compiled_palette_path(excel_path)
+            compiled = self._read_compiled_palette(cache_path, source_path=excel_path)
+            if compiled is None:
+                codes, rgb = self._parse_excel(excel_path)
+                # 转换到 LAB 色彩空间用于色差计算
+                lab = rgb_to_lab(rgb)
+                self._write_compiled_palette(cache_path, excel_path, codes, rgb, lab)
+            else:
+                codes, rgb, lab = compiled
+        
+        self.codes: List[str] = list(codes)
+        self.palette_rgb = rgb
+        self.palette_lab = lab
+        for i, code in enumerate(self.codes):
+            self.color_map[code] = tuple(int(v) for v in rgb[i])
+            self.lab_colors[code] = lab[i]
+        
+        print(f"✅ 加载了 {len(self.color_map)} 个拼豆标准色号")
+    
+    def _compiled_palette_path(self, excel_path: str) -> str:
+        """Excel 对应的调色板缓存路径"""
+        return os.path.splitext(excel_path)[0] + '.palette.npz'
+    
+    def _source_signature(self, path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    
+    def _source_hash(self, path: str) -> str:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def _read_compiled_palette(
+        self, path: str, source_path: Optional[str] = None
+    ) -> Optional[Tuple[List[str], np.ndarray, np.ndarray]]:
+        """读取编译好的调色板
+        
+        指定 source_path 时会校验缓存：修改时间和大小一致直接使用，
+        否则比较内容哈希；哈希一致时把新的修改时间和大小写回缓存，下次不必再算哈希，
+        不一致或读取失败返回 None。
+        
+        Returns:
+            (色号列表, RGB uint8 数组, LAB float64 数组)，缓存无效时返回 None
+        """
+        if source_path is not None and not os.path.exists(path):
+            return None
+        
+        refreshed_hash = None
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if source_path is not None:
+                    mtime_ns, size = self._source_signature(source_path)
+                    if (int(data['source_mtime_ns']), int(data['source_size'])) != (mtime_ns, size):
+                        source_hash = self._source_hash(source_path)
+                        if str(data['source_hash']) != source_hash:
+                            return None
+                        # 内容没变（如文件被 touch 或重新检出），只是修改时间不同
+                        refreshed_hash = source_hash
+                codes = [str(code) for code in data['codes']]
+                rgb = data['rgb'].astype(np.uint8).reshape(-1, 3)
+                lab = data['lab'].astype(np.float64).reshape(-1, 3)
+        except (OSError, KeyError, ValueError) as e:
+            if source_path is None:
+                raise
+            print(f"⚠️ 调色板缓存无效，重新解析: {path}, 错误: {e}")
+            return None
+        
+        if refreshed_hash is not None:
+            # 写回在关闭 .npz 之后进行，替换仍打开的文件在部分平台上会失败
+            self._write_compiled_palette(path, source_path, codes, rgb, lab, refreshed_hash)
+        return codes, rgb, lab
+    
+    def _write_compiled_palette(
+        self,
+        path: str,
+        source_path: str,
+        codes: List[str],
+        rgb: np.ndarray,
+        lab: np.ndarray,
+        source_hash: Optional[str] = None,
+    ) -> None:
+        """写入调色板缓存；目录不可写时静默跳过。source_hash 为已算好的源文件哈希"""
+        mtime_ns, size = self._source_signature(source_path)
+        if source_hash is None:
+            source_hash = self._source_hash(source_path)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(
+                    f,
+                    codes=np.array(codes, dtype=str),
+                    rgb=rgb,
+                    lab=lab,
+                    source_mtime_ns=np.int64(mtime_ns),
+                    source_size=np.int64(size),
+                    source_hash=np.array(source_hash),
+                )
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ 无法写入调色板缓存: {path}, 错误: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    
+    def _parse_excel(self, excel_path: str) -> Tuple[List[str], np.ndarray]:
+        """从Excel文件解析拼豆标准色号
         
         Args:
             excel_path: Excel文件路径
+        
+        Returns:
+            (色号列表, RGB uint8 数组)
         """
+        # pandas 只在需要重新编译调色板时导入
+        import pandas as pd
+        
         df = pd.read_excel(excel_path)
+        color_map: Dict[str, Tuple[int, int, int]] = {}
         
         # Excel格式：每两列一对（色号列，颜色列）
         columns = df.columns.tolist()
@@ -177,11 +748,8 @@ class PerlerBeadColorMapper:
             code_col = columns[i]
             color_col = columns[i + 1]
             
-            # 遍历每一行
-            for idx, row in df.iterrows():
-                code = row[code_col]
-                hex_color = row[color_col]
-                
+            # 按列整体遍历
+            for code, hex_color in zip(df[code_col].tolist(), df[color_col].tolist()):
                 # 跳过 NaN 值
                 if pd.isna(code) or pd.isna(hex_color):
                     continue
@@ -197,21 +765,20 @@ class PerlerBeadColorMapper:
                     b = int(hex_color[4:6], 16)
                     
                     code = str(code).strip()
-                    self.color_map[code] = (r, g, b)
-                    
-                    # 转换到 LAB 色彩空间用于 CIEDE2000 计算
-                    self.lab_colors[code] = self._rgb_to_lab((r, g, b))
+                    color_map[code] = (r, g, b)
                     
                 except (ValueError, IndexError) as e:
                     print(f"⚠️ 解析颜色失败: {code} = {hex_color}, 错误: {e}")
                     continue
         
-        print(f"✅ 加载了 {len(self.color_map)} 个拼豆标准色号")
+        codes = list(color_map.keys())
+        rgb = np.array([color_map[code] for code in codes], dtype=np.uint8).reshape(-1, 3)
+        return codes, rgb
     
-    def find_closest_color(self, rgb: Tuple[int, int, int], top_n: int = 1, allowed_colors: List[str] = None) -> Union[Tuple[str, Tuple[int, int, int], float], List[Tuple[str, Tuple[int, int, int], float]]]:
+    def find_closest_color(self, rgb: Tuple[int, int, int], top_n: int = 1, allowed_colors: List[str] = None, metric: Optional[str] = None) -> Union[Tuple[str, Tuple[int, int, int], float], List[Tuple[str, Tuple[int, int, int], float]]]:
         """查找最接近的拼豆标准色号
         
-        使用 CIEDE2000 算法计算颜色差异，该算法考虑了：
+        默认使用 CIEDE2000 算法计算颜色差异，该算法考虑了：
         - 亮度差异
         - 色度差异
         - 色相差异
@@ -221,112 +788,196 @@ class PerlerBeadColorMapper:
             rgb: 输入颜色 (r, g, b)
             top_n: 返回前 N 个最接近的结果，默认 1
             allowed_colors: 允许的色号列表，如果为None则使用所有色号
+            metric: 色差公式名称，None 表示使用映射器的默认公式
         
         Returns:
             如果 top_n=1: (色号, RGB值, 色差值) 元组
             如果 top_n>1: [(色号, RGB值, 色差值), ...] 列表
         """
-        # 转换输入颜色到 LAB 色彩空间
-        input_lab = self._rgb_to_lab(rgb)
-        
-        # 如果指定了允许的色号，过滤色号列表
-        if allowed_colors is not None and len(allowed_colors) > 0:
-            colors_to_check = {code: rgb for code, rgb in self.color_map.items() if code in allowed_colors}
-            lab_colors_to_check = {code: lab for code, lab in self.lab_colors.items() if code in allowed_colors}
-        else:
-            colors_to_check = self.color_map
-            lab_colors_to_check = self.lab_colors
-        
-        # 计算与所有标准色号的 CIEDE2000 色差
-        results = []
-        for code, standard_rgb in colors_to_check.items():
-            standard_lab = lab_colors_to_check[code]
-            delta_e = self._delta_e_cie2000(input_lab, standard_lab)
-            results.append((code, standard_rgb, delta_e))
-        
-        # 按色差排序
-        results.sort(key=lambda x: x[2])
+        # 经过结果缓存，同一颜色的候选（如前端逐个单元格查询）只计算一次
+        [(indices, delta_e)] = self._lookup_closest(
+            [tuple(int(v) for v in rgb)], top_n, allowed_colors=allowed_colors, metric=metric
+        )
+        results = [
+            (self.codes[idx], self.color_map[self.codes[idx]], de)
+            for idx, de in zip(indices, delta_e)
+        ]
         
         # 返回前 N 个结果
         if top_n == 1:
             return results[0]
         else:
-            return results[:top_n]
+            return results
     
-    def map_colors(self, colors: List[List[Tuple[int, int, int]]], allowed_colors: List[str] = None) -> Dict:
+    def map_colors(
+        self,
+        colors: Union[ColorGrid, List[List[Tuple[int, int, int]]]],
+        allowed_colors: List[str] = None,
+        compact: bool = False,
+        metric: Optional[str] = None,
+        top_n: int = 3,
+    ) -> Dict:
         """将颜色网格映射到拼豆标准色号
         
         Args:
-            colors: 二维颜色列表 [[color, ...], ...]
+            colors: ColorGrid 或二维颜色列表 [[color, ...], ...]
             allowed_colors: 允许的色号列表，如果为None则使用所有色号
+            compact: 为 True 时返回以下标数组表示的紧凑结果（见 `_map_colors_compact`），
+                否则返回逐单元格的字典网格
+            metric: 色差公式名称，None 表示使用映射器的默认公式
+            top_n: 每种颜色计算的候选数量。为 1 时只计算最佳匹配，单元格不带 top_3，
+                候选可以之后按颜色用 `find_closest_color` 单独查询
         
         Returns:
             包含映射结果的字典
         """
-        result = {
-            'grid': [],
-            'palette': {},
-            'statistics': {
-                'total_cells': 0,
-                'unique_colors': 0,
-                'avg_delta_e': 0.0,
-                'max_delta_e': 0.0
+        mapping = self._map_colors_compact(colors, allowed_colors, metric, top_n)
+        if compact:
+            return mapping
+        return self.expand_compact_mapping(mapping)
+    
+    def _map_colors_compact(
+        self,
+        colors: Union[ColorGrid, List[List[Tuple[int, int, int]]]],
+        allowed_colors: List[str] = None,
+        metric: Optional[str] = None,
+        top_n: int = 3,
+    ) -> Dict:
+        """紧凑格式的颜色映射
+        
+        网格中重复颜色很多，先去重，每种颜色只匹配一次，结果以下标数组表示：
+        
+        - colors: (U, 3) uint8，去重后的输入颜色
+        - color_grid: (rows, cols)，每个单元格对应的输入颜色下标
+        - codes / palette_rgb: 结果中出现的色号表及其 RGB，(P, 3) uint8
+        - top_indices: (U, top_n) uint16，每种输入颜色的前 top_n 名在色号表中的下标
+        - top_delta_e: (U, top_n) float64，对应的色差
+        - top_n: 请求的候选数量
+        - index_grid: (rows, cols) uint16，每个单元格最佳匹配在色号表中的下标
+        - palette / statistics: 与字典网格格式相同的调色板统计
+        
+        Returns:
+            紧凑格式的映射结果字典
+        """
+        # 去重颜色表由 ColorGrid 缓存，前面的阶段已经算过时直接复用
+        grid = ColorGrid.from_colors(colors)
+        rows, cols = grid.shape
+        unique_colors = grid.palette
+        inverse = grid.inverse
+        
+        # 获取前 top_n 名结果（考虑用户选中的色号）
+        matches = self._lookup_closest(
+            grid.unique_colors(),
+            top_n=top_n,
+            allowed_colors=allowed_colors,
+            metric=metric,
+        )
+        k = len(matches[0][0]) if matches else top_n
+        top_global = np.array([m[0] for m in matches], dtype=np.intp).reshape(-1, k)
+        top_delta_e = np.array([m[1] for m in matches], dtype=np.float64).reshape(-1, k)
+        
+        # 只保留结果中出现的色号
+        used, top_local = np.unique(top_global, return_inverse=True)
+        top_local = top_local.reshape(top_global.shape).astype(np.uint16)
+        
+        index_dtype = np.uint16 if len(unique_colors) <= np.iinfo(np.uint16).max else np.uint32
+        color_grid = inverse.reshape(rows, cols).astype(index_dtype)
+        index_grid = top_local[color_grid, 0] if len(matches) else np.zeros((rows, cols), np.uint16)
+        cell_delta_e = top_delta_e[inverse.reshape(-1), 0] if len(matches) else np.zeros(0)
+        
+        # 构建调色板（按使用次数排序，次数相同按首次出现顺序）
+        flat_index = index_grid.reshape(-1)
+        counts = np.bincount(flat_index, minlength=len(used))
+        present, first_seen = np.unique(flat_index, return_index=True)
+        order = sorted(
+            zip(present.tolist(), first_seen.tolist()), key=lambda x: (-counts[x[0]], x[1])
+        )
+        codes = [self.codes[idx] for idx in used]
+        palette = {}
+        for local_idx, _ in order:
+            rgb = self.color_map[codes[local_idx]]
+            palette[codes[local_idx]] = {
+                'rgb': rgb,
+                'hex': '#{:02x}{:02x}{:02x}'.format(*rgb),
+                'count': int(counts[local_idx])
             }
+        
+        # 计算统计信息
+        statistics = {
+            'total_cells': int(rows * cols),
+            'unique_colors': len(palette),
+            'avg_delta_e': 0.0,
+            'max_delta_e': 0.0
+        }
+        if len(cell_delta_e):
+            statistics['avg_delta_e'] = round(np.mean(cell_delta_e), 2)
+            statistics['max_delta_e'] = round(float(cell_delta_e.max()), 2)
+        
+        return {
+            'rows': rows,
+            'cols': cols,
+            'colors': unique_colors,
+            'color_grid': color_grid,
+            'codes': codes,
+            'palette_rgb': self.palette_rgb[used],
+            'top_indices': top_local,
+            'top_delta_e': top_delta_e,
+            'top_n': top_n,
+            'index_grid': index_grid,
+            'palette': palette,
+            'statistics': statistics,
         }
+    
+    def expand_compact_mapping(self, mapping: Dict) -> Dict:
+        """把紧凑格式的映射结果展开为逐单元格的字典网格（兼容原有格式）
         
-        delta_e_values = []
-        color_usage = {}  # 统计每个色号的使用次数
+        映射时 top_n 为 1 的结果不含候选，单元格中省略 top_3。
+        
+        Args:
+            mapping: `map_colors(..., compact=True)` 的返回值
         
-        # 处理每个单元格
-        for row in colors:
+        Returns:
+            包含 grid、palette、statistics 的字典
+        """
+        codes = mapping['codes']
+        with_alternatives = mapping.get('top_n', 3) > 1
+        
+        # 每种输入颜色只构建一次（相同颜色的单元格共享同一个 top_3 列表）
+        cell_templates = []
+        for rgb, indices, deltas in zip(
+            mapping['colors'].tolist(), mapping['top_indices'].tolist(), mapping['top_delta_e'].tolist()
+        ):
+            top_3 = [(codes[idx], self.color_map[codes[idx]], de) for idx, de in zip(indices, deltas)]
+            code, mapped_rgb, delta_e = top_3[0]  # 使用最佳匹配
+            alternatives = [{
+                'code': c,
+                'rgb': r,
+                'hex': '#{:02x}{:02x}{:02x}'.format(*r),
+                'delta_e': round(d, 2)
+            } for c, r, d in top_3] if with_alternatives else None
+            cell_templates.append((tuple(rgb), code, mapped_rgb, round(delta_e, 2), alternatives))
+        
+        grid = []
+        for row in mapping['color_grid'].tolist():
             mapped_row = []
-            for rgb in row:
-                # 获取 Top 3 结果（考虑用户选中的色号）
-                top_3 = self.find_closest_color(rgb, top_n=3, allowed_colors=allowed_colors)
-                code, mapped_rgb, delta_e = top_3[0]  # 使用最佳匹配
-                
-                mapped_row.append({
-                    'original': rgb,
+            for color_idx in row:
+                original, code, mapped_rgb, delta_e, top_3 = cell_templates[color_idx]
+                cell = {
+                    'original': original,
                     'code': code,
                     'mapped': mapped_rgb,
-                    'delta_e': round(delta_e, 2),
-                    'top_3': [{
-                        'code': c,
-                        'rgb': r,
-                        'hex': '#{:02x}{:02x}{:02x}'.format(*r),
-                        'delta_e': round(d, 2)
-                    } for c, r, d in top_3]
-                })
-                
-                delta_e_values.append(delta_e)
-                result['statistics']['total_cells'] += 1
-                
-                # 统计色号使用
-                if code not in color_usage:
-                    color_usage[code] = {
-                        'count': 0,
-                        'rgb': mapped_rgb
-                    }
-                color_usage[code]['count'] += 1
-            
-            result['grid'].append(mapped_row)
-        
-        # 构建调色板（按使用次数排序）
-        sorted_colors = sorted(color_usage.items(), key=lambda x: x[1]['count'], reverse=True)
-        for code, info in sorted_colors:
-            result['palette'][code] = {
-                'rgb': info['rgb'],
-                'hex': '#{:02x}{:02x}{:02x}'.format(*info['rgb']),
-                'count': info['count']
-            }
+                    'delta_e': delta_e,
+                }
+                if with_alternatives:
+                    cell['top_3'] = top_3
+                mapped_row.append(cell)
+            grid.append(mapped_row)
         
-        # 计算统计信息
-        result['statistics']['unique_colors'] = len(color_usage)
-        if delta_e_values:
-            result['statistics']['avg_delta_e'] = round(np.mean(delta_e_values), 2)
-            result['statistics']['max_delta_e'] = round(max(delta_e_values), 2)
-        
-        return result
+        return {
+            'grid': grid,
+            'palette': mapping['palette'],
+            'statistics': mapping['statistics'],
+        }
     
     def get_color_info(self, code: str) -> Dict:
         """获取色号详细信息
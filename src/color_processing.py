@@ -4,38 +4,149 @@
 
 from __future__ import annotations
 
+import math
+import time
 from collections import Counter
-from typing import Dict, List, Tuple
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
-from sklearn.cluster import KMeans
-
+from .clustering import kmeans
+from .color_grid import ColorGrid
+from .colorspace import rgb_to_lab_u8
 from .config import ColorProcessingConfig
 
 
+# 合并调色板时距离矩阵每块的元素数上限
+_MERGE_CHUNK_ELEMENTS = 1 << 20
+# 水印掩码按行分块计算，每块的像素数上限
+_MASK_STRIP_PIXELS = 1 << 18
+
+# 单元格颜色的来源路径，ExtractionStats.path_codes 中的取值为其下标
+PATH_NAMES = (
+    'empty',  # 去掉边距后没有像素，返回白色
+    'integral',  # 区域和纯色快速路径
+    'batched',  # 批量提取
+    'small_mean',  # 有效像素少于 10 个，取均值
+    'uniform_median',  # 颜色一致，取中位数
+    'histogram',  # 量化直方图
+    'kmeans',  # K-means 回退
+    'kmeans_failed',  # K-means 出错，取中位数
+)
+(
+    PATH_EMPTY,
+    PATH_INTEGRAL,
+    PATH_BATCHED,
+    PATH_SMALL_MEAN,
+    PATH_UNIFORM_MEDIAN,
+    PATH_HISTOGRAM,
+    PATH_KMEANS,
+    PATH_KMEANS_FAILED,
+) = range(len(PATH_NAMES))
+
+
+@dataclass
+class ExtractionStats:
+    """
+    extract_colors 的统计信息，只在传入 stats 参数时收集，每次调用覆盖上一次的结果。
+
+    - path_codes: (rows, cols) uint8，每个单元格的颜色来源路径，取值为 PATH_NAMES 的下标
+    - cell_seconds: (rows, cols)，逐格计算的单元格耗时；快速路径的单元格为 0
+    - stage_seconds: 各阶段耗时（masks / preprocess / integral / batched / cells）
+    """
+
+    path_codes: Optional[np.ndarray] = None
+    cell_seconds: Optional[np.ndarray] = None
+    stage_seconds: Dict[str, float] = field(default_factory=dict)
+
+    @property
+    def path_counts(self) -> Dict[str, int]:
+        """每条路径的单元格数"""
+        if self.path_codes is None:
+            return {}
+        counts = np.bincount(self.path_codes.reshape(-1), minlength=len(PATH_NAMES))
+        return dict(zip(PATH_NAMES, counts.tolist()))
+
+    @property
+    def path_seconds(self) -> Dict[str, float]:
+        """每条逐格路径的累计耗时"""
+        if self.path_codes is None:
+            return {}
+        seconds = np.bincount(
+            self.path_codes.reshape(-1),
+            weights=self.cell_seconds.reshape(-1),
+            minlength=len(PATH_NAMES),
+        )
+        return dict(zip(PATH_NAMES, seconds.tolist()))
+
+    def summary(self) -> str:
+        lines = ["颜色提取统计:"]
+        seconds = self.path_seconds
+        for name, count in self.path_counts.items():
+            if count:
+                lines.append(f"  {name:<16}{count:>8} 格 {seconds[name] * 1000:>10.1f} ms")
+        stages = ", ".join(f"{name} {sec * 1000:.1f} ms" for name, sec in self.stage_seconds.items())
+        lines.append(f"  阶段耗时: {stages}")
+        return "\n".join(lines)
+
+
+class _StageClock:
+    """记录各阶段耗时；stats 为 None 时什么也不做"""
+
+    def __init__(self, stats: Optional[ExtractionStats]):
+        self.stats = stats
+        self.last = time.perf_counter() if stats is not None else 0.0
+
+    def lap(self, stage: str) -> None:
+        if self.stats is not None:
+            now = time.perf_counter()
+            self.stats.stage_seconds[stage] = now - self.last
+            self.last = now
+
+
+# 直方图量化：每通道 8 级，9 位 bin 编码 r<<6 | g<<3 | b，编码顺序即量化颜色的字典序
+_BIN_CENTERS = np.stack([(np.arange(512) >> shift) & 7 for shift in (6, 3, 0)], axis=-1) * 32 + 16
+
+
+def _quantize_codes(pixels: np.ndarray) -> np.ndarray:
+    levels = pixels.astype(np.intp) >> 5
+    return (levels[..., 0] << 6) | (levels[..., 1] << 3) | levels[..., 2]
+
+
 def _build_watermark_mask(
     image: np.ndarray, config: ColorProcessingConfig
 ) -> np.ndarray | None:
     if not config.watermark_filter_enabled:
         return None
 
-    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    r = rgb[:, :, 0].astype(np.int16)
-    g = rgb[:, :, 1].astype(np.int16)
-    b = rgb[:, :, 2].astype(np.int16)
-    brightness = (r + g + b) / 3.0
-    color_range = np.maximum(np.maximum(r, g), b) - np.minimum(np.minimum(r, g), b)
-
-    mask = (
-        (brightness >= config.watermark_brightness_min)
-        & (brightness <= config.watermark_brightness_max)
-        & (color_range <= config.watermark_color_range)
-    )
+    # 按行分块单次遍历：亮度用通道和比较（(r+g+b)/3 >= t 等价于 r+g+b >= 3t），
+    # 中间结果为 uint8/uint16，不生成整幅图像的 int16、float64 副本
+    low_sum = 3 * config.watermark_brightness_min
+    high_sum = 3 * config.watermark_brightness_max
+    mask = np.empty(image.shape[:2], dtype=bool)
+    strip = max(1, _MASK_STRIP_PIXELS // max(image.shape[1], 1))
+    for start in range(0, image.shape[0], strip):
+        b, g, r = cv2.split(image[start:start + strip])
+        color_range = cv2.subtract(cv2.max(cv2.max(b, g), r), cv2.min(cv2.min(b, g), r))
+        total = cv2.add(cv2.add(b, g, dtype=cv2.CV_16U), r, dtype=cv2.CV_16U)
+        mask[start:start + strip] = (
+            (total >= low_sum) & (total <= high_sum) & (color_range <= config.watermark_color_range)
+        )
 
     return mask
 
 
+def _median_u8(values: np.ndarray) -> float:
+    """uint8 数组的中位数（与 np.median 相同），用直方图代替排序"""
+    histogram = np.bincount(values.reshape(-1), minlength=256)
+    cumulative = np.cumsum(histogram)
+    total = int(cumulative[-1])
+    lower = int(np.searchsorted(cumulative, (total - 1) // 2, side='right'))
+    upper = int(np.searchsorted(cumulative, total // 2, side='right'))
+    return (lower + upper) / 2.0
+
+
 def _build_watermark_edge_mask(
     image: np.ndarray, config: ColorProcessingConfig
 ) -> np.ndarray | None:
@@ -43,7 +154,7 @@ def _build_watermark_edge_mask(
         return None
 
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    v = float(np.median(gray))
+    v = _median_u8(gray)
     lower = int(max(0, (1.0 - config.watermark_edge_sigma) * v))
     upper = int(min(255, (1.0 + config.watermark_edge_sigma) * v))
     edges = cv2.Canny(gray, lower, upper)
@@ -63,78 +174,465 @@ def _merge_similar_palette(
     if threshold <= 0 or len(colors) < 2:
         return {}
 
-    color_array = np.array(colors, dtype=np.uint8).reshape(-1, 1, 3)
-    labs = cv2.cvtColor(color_array, cv2.COLOR_RGB2LAB).reshape(-1, 3).astype(np.float32)
+    labs = rgb_to_lab_u8(np.array(colors, dtype=np.uint8).reshape(-1, 3)).astype(np.float32)
 
     order = sorted(range(len(colors)), key=lambda i: counts.get(colors[i], 1), reverse=True)
-    clusters: List[Dict[str, np.ndarray | float]] = []
+
+    # 簇中心保存在预分配数组里，每个颜色与所有已有簇的距离一次算完；
+    # 贪心顺序和 float32 的更新公式与逐簇比较时相同，因此簇划分不变
+    centers = np.empty((len(colors), 3), dtype=np.float32)
+    center_rgbs = np.empty((len(colors), 3), dtype=np.float32)
+    center_counts: List[float] = []
 
     for idx in order:
         color = colors[idx]
         lab = labs[idx]
         weight = float(counts.get(color, 1))
+        k = len(center_counts)
 
         best_idx = None
-        best_dist = float('inf')
-        for c_idx, cluster in enumerate(clusters):
-            dist = float(np.linalg.norm(lab - cluster['lab']))
-            if dist <= threshold and dist < best_dist:
-                best_dist = dist
-                best_idx = c_idx
+        if k:
+            dists = np.linalg.norm(centers[:k] - lab, axis=1)
+            nearest = int(np.argmin(dists))
+            if float(dists[nearest]) <= threshold:
+                best_idx = nearest
 
         if best_idx is None:
-            clusters.append(
-                {
-                    'lab': lab.copy(),
-                    'rgb': np.array(color, dtype=np.float32),
-                    'count': weight,
-                }
-            )
+            centers[k] = lab
+            center_rgbs[k] = color
+            center_counts.append(weight)
         else:
-            cluster = clusters[best_idx]
-            total = float(cluster['count']) + weight
-            cluster['lab'] = (cluster['lab'] * cluster['count'] + lab * weight) / total
-            cluster['rgb'] = (cluster['rgb'] * cluster['count'] + np.array(color, dtype=np.float32) * weight) / total
-            cluster['count'] = total
-
-    final_labs = np.array([c['lab'] for c in clusters], dtype=np.float32)
-    final_rgbs = [tuple(map(int, np.round(c['rgb']))) for c in clusters]
+            count = center_counts[best_idx]
+            total = count + weight
+            centers[best_idx] = (centers[best_idx] * count + lab * weight) / total
+            center_rgbs[best_idx] = (
+                center_rgbs[best_idx] * count + np.array(color, dtype=np.float32) * weight
+            ) / total
+            center_counts[best_idx] = total
+
+    k = len(center_counts)
+    final_labs = centers[:k]
+    final_rgbs = np.round(center_rgbs[:k]).astype(int)
+
+    # 最终映射：分块计算颜色到所有簇中心的距离矩阵
+    nearest = np.empty(len(colors), dtype=np.intp)
+    within = np.empty(len(colors), dtype=bool)
+    chunk = max(1, _MERGE_CHUNK_ELEMENTS // k)
+    for start in range(0, len(colors), chunk):
+        dists = np.linalg.norm(final_labs[None, :, :] - labs[start:start + chunk, None, :], axis=-1)
+        nearest[start:start + chunk] = np.argmin(dists, axis=1)
+        within[start:start + chunk] = (
+            dists[np.arange(len(dists)), nearest[start:start + chunk]] <= threshold
+        )
 
     mapping: Dict[Tuple[int, int, int], Tuple[int, int, int]] = {}
-    for i, color in enumerate(colors):
-        lab = labs[i]
-        dists = np.linalg.norm(final_labs - lab, axis=1)
-        min_idx = int(np.argmin(dists))
-        if float(dists[min_idx]) <= threshold:
-            mapping[color] = final_rgbs[min_idx]
-        else:
-            mapping[color] = color
+    for color, idx, merged in zip(colors, nearest.tolist(), within.tolist()):
+        mapping[color] = tuple(final_rgbs[idx].tolist()) if merged else color
 
     return mapping
 
 
+def _cell_interiors(
+    lines: np.ndarray, config: ColorProcessingConfig
+) -> Tuple[np.ndarray, np.ndarray]:
+    """按与逐格路径相同的边距规则，计算每个单元格内部区域的起止坐标"""
+    sizes = lines[1:] - lines[:-1]
+    margins = np.minimum(
+        (sizes * config.margin_percent).astype(np.int64), sizes // config.margin_max_divisor
+    )
+    margins = np.maximum(config.margin_min, margins)
+    return lines[:-1] + margins, lines[1:] - margins
+
+
+def _cell_sums(
+    plane: np.ndarray,
+    top: np.ndarray,
+    bottom: np.ndarray,
+    left: np.ndarray,
+    right: np.ndarray,
+    squares: bool = False,
+) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """
+    逐行单元格计算每个单元格内部区域的像素和（以及平方和），返回 (rows, cols, ...) int64。
+
+    每次只对一行单元格的内部行带按列求和，再用列方向的前缀和取出各单元格的区间和，
+    不在整幅图上建积分图。
+    """
+    rows, cols = len(top), len(left)
+    shape = (rows, cols) + plane.shape[2:]
+    sums = np.zeros(shape, dtype=np.int64)
+    square_sums = np.zeros(shape, dtype=np.int64) if squares else None
+    zero = np.zeros((1,) + plane.shape[2:], dtype=np.int64)
+    for i in range(rows):
+        band = plane[top[i] : bottom[i]]
+        if band.shape[0] == 0:
+            continue
+        prefix = np.concatenate((zero, np.cumsum(band.sum(axis=0, dtype=np.int64), axis=0)))
+        sums[i] = prefix[right] - prefix[left]
+        if square_sums is not None:
+            column = np.square(band, dtype=np.int64).sum(axis=0)
+            prefix = np.concatenate((zero, np.cumsum(column, axis=0)))
+            square_sums[i] = prefix[right] - prefix[left]
+    return sums, square_sums
+
+
+def _integral_uniform_cells(
+    plane: np.ndarray,
+    h_lines: List[int],
+    v_lines: List[int],
+    config: ColorProcessingConfig,
+    watermark_mask: np.ndarray | None,
+    edge_mask: np.ndarray | None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    用区域和判断纯色单元格。
+
+    按行单元格求出 plane（BGR）每个单元格内部区域的和、平方和以及水印/边缘掩码计数，
+    得到均值和方差（见 _cell_sums，内存只与一行单元格相关）。各通道标准差低于
+    uniform_std_threshold、且掩码过滤不会生效的单元格判为纯色，颜色取均值。
+
+    返回 (colors, uniform)：(rows, cols, 3) 的 RGB 颜色和 (rows, cols) 的纯色标记。
+    """
+    top, bottom = _cell_interiors(np.asarray(h_lines, dtype=np.int64), config)
+    left, right = _cell_interiors(np.asarray(v_lines, dtype=np.int64), config)
+    height, width = plane.shape[:2]
+    top, bottom = np.clip(top, 0, height), np.clip(bottom, 0, height)
+    left, right = np.clip(left, 0, width), np.clip(right, 0, width)
+    bottom, right = np.maximum(bottom, top), np.maximum(right, left)
+    area = (np.maximum(bottom - top, 0)[:, None] * np.maximum(right - left, 0)[None, :]).astype(
+        np.float64
+    )
+
+    sums, squares = _cell_sums(plane, top, bottom, left, right, squares=True)
+    safe_area = np.maximum(area, 1)[..., None]
+    mean = sums / safe_area
+    variance = squares / safe_area - mean**2
+    std = np.sqrt(np.maximum(variance, 0))
+    uniform = (area >= 10) & np.all(std < config.uniform_std_threshold, axis=-1)
+
+    # 掩码过滤会改变参与统计的像素，只有过滤不会生效的单元格可以走快速路径
+    if watermark_mask is not None:
+        counts, _ = _cell_sums(watermark_mask.view(np.uint8), top, bottom, left, right)
+        gray_ratio = counts / np.maximum(area, 1)
+        uniform &= (counts == 0) | (gray_ratio >= config.watermark_cell_keep_gray_ratio)
+    if edge_mask is not None:
+        counts, _ = _cell_sums(edge_mask.view(np.uint8), top, bottom, left, right)
+        uniform &= counts / np.maximum(area, 1) < config.watermark_edge_ratio_threshold
+
+    colors = np.rint(mean[..., ::-1]).astype(np.int64)
+    return colors, uniform
+
+
+def _masked_quantile(
+    values: np.ndarray, valid: np.ndarray, counts: np.ndarray, percentile: float
+) -> np.ndarray:
+    """
+    按有效像素掩码逐行求分位数（线性插值，与 np.percentile 默认方式相同）。
+
+    values: (N, n, C)，valid: (N, n)，counts: 每行有效像素数
+    返回 (N, C)。
+    """
+    ordered = np.sort(np.where(valid[..., None], values, np.inf), axis=1)
+    position = (counts - 1) * (percentile / 100.0)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    fraction = (position - lower)[:, None].astype(values.dtype)
+    low = np.take_along_axis(ordered, lower[:, None, None], axis=1)[:, 0]
+    high = np.take_along_axis(ordered, upper[:, None, None], axis=1)[:, 0]
+    return low + (high - low) * fraction
+
+
+def _extract_colors_batched(
+    image: np.ndarray,
+    h_lines: List[int],
+    v_lines: List[int],
+    config: ColorProcessingConfig,
+    watermark_mask: np.ndarray | None,
+    edge_mask: np.ndarray | None,
+    blurred: np.ndarray | None = None,
+    skip: np.ndarray | None = None,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    整个网格一次性提取颜色。
+
+    每个单元格内部按最近邻从中值滤波后的图像（blurred，未提供时在此计算）
+    重采样为 k×k（k = batch_sample_size），得到
+    (rows, cols, k, k, 3) 的张量，对所有单元格同时做与 get_dominant_color 相同的
+    稳健裁剪、均匀性判断和直方图取众数。
+
+    水印和边缘过滤按相同的阈值作用于采样点，以有效像素掩码表示。
+    以下单元格标记为需要回退到逐格路径：内部区域小于 k×k，
+    或需要 K-means 的小样本非均匀单元格。
+
+    skip 标记已由其他路径得到颜色、无需计算的单元格。
+
+    返回 (colors, fallback)：(rows, cols, 3) 的 RGB 颜色和 (rows, cols) 的回退标记。
+    """
+    k = config.batch_sample_size
+    top, bottom = _cell_interiors(np.asarray(h_lines, dtype=np.int64), config)
+    left, right = _cell_interiors(np.asarray(v_lines, dtype=np.int64), config)
+    rows, cols = len(top), len(left)
+
+    fallback = ((bottom - top) < k)[:, None] | ((right - left) < k)[None, :]
+    colors = np.zeros((rows, cols, 3), dtype=np.int64)
+    if np.all(fallback):
+        return colors, fallback
+
+    # 每个子块中心的采样坐标；过小的单元格会回退，坐标只需保证不越界
+    offsets = (2 * np.arange(k) + 1)[None, :]
+    ys = top[:, None] + (np.maximum(bottom - top, 1)[:, None] * offsets) // (2 * k)
+    xs = left[:, None] + (np.maximum(right - left, 1)[:, None] * offsets) // (2 * k)
+    ys = np.clip(ys, 0, image.shape[0] - 1)[:, None, :, None]
+    xs = np.clip(xs, 0, image.shape[1] - 1)[None, :, None, :]
+
+    n = k * k
+    pending = ~fallback if skip is None else ~fallback & ~skip
+    selected = np.flatnonzero(pending.reshape(-1))
+    if blurred is None:
+        blurred = cv2.medianBlur(image, 5)
+    pixels = blurred[ys, xs][..., ::-1].reshape(rows * cols, n, 3)[selected]
+    num_cells = len(selected)
+
+    # 水印过滤；与逐格路径一致，水印过滤去掉了像素（掩码与像素数不再对应）后不再做边缘过滤
+    valid = np.ones((num_cells, n), dtype=bool)
+    filtered = np.zeros(num_cells, dtype=bool)
+    if watermark_mask is not None:
+        gray = watermark_mask[ys, xs].reshape(rows * cols, n)[selected]
+        apply = (gray.mean(axis=1) < config.watermark_cell_keep_gray_ratio) & (
+            (~gray).sum(axis=1) >= config.watermark_min_pixels
+        )
+        valid[apply] = ~gray[apply]
+        filtered = apply & gray.any(axis=1)
+    if edge_mask is not None:
+        edge = edge_mask[ys, xs].reshape(rows * cols, n)[selected]
+        apply = (
+            ~filtered
+            & (edge.mean(axis=1) >= config.watermark_edge_ratio_threshold)
+            & ((~edge).sum(axis=1) >= config.watermark_edge_min_pixels)
+        )
+        valid[apply] = ~edge[apply]
+
+    # 稳健裁剪：去掉 LAB 空间中离中位数最远的像素
+    counts = valid.sum(axis=1)
+    trim = config.robust_trim_enabled & (counts >= config.robust_trim_min_pixels)
+    if np.any(trim):
+        lab = rgb_to_lab_u8(pixels[trim]).astype(np.float32)
+        trim_valid = valid[trim]
+        trim_counts = counts[trim]
+        median = _masked_quantile(lab, trim_valid, trim_counts, 50.0)
+        distances = np.linalg.norm(lab - median[:, None, :], axis=2)
+        threshold = _masked_quantile(
+            distances[..., None], trim_valid, trim_counts, config.robust_trim_percentile
+        )
+        trimmed = trim_valid & (distances <= threshold)
+        keep_trim = trimmed.sum(axis=1) >= config.robust_trim_min_pixels
+        valid[np.flatnonzero(trim)[keep_trim]] = trimmed[keep_trim]
+
+    counts = valid.sum(axis=1)
+    weights = valid[..., None]
+    near_black = np.all(pixels < config.black_filter_threshold, axis=2)
+    dark_pixel_ratio = (near_black & valid).sum(axis=1) / counts
+
+    values = pixels.astype(np.float64)
+    mean = (values * weights).sum(axis=1) / counts[:, None]
+    std = np.sqrt((((values - mean[:, None, :]) ** 2) * weights).sum(axis=1) / counts[:, None])
+    uniform = np.all(std < config.uniform_std_threshold, axis=1)
+
+    result = np.zeros((num_cells, 3), dtype=np.int64)
+    small = counts < 10
+    result[small] = mean[small].astype(np.int64)
+
+    # 均匀单元格：有效像素的逐通道中位数（无效像素排到末尾）
+    sorted_values = np.sort(np.where(weights, pixels.astype(np.int16), 256), axis=1)
+    lower = np.take_along_axis(sorted_values, ((counts - 1) // 2)[:, None, None], axis=1)[:, 0]
+    upper = np.take_along_axis(sorted_values, (counts // 2)[:, None, None], axis=1)[:, 0]
+    use_median = uniform & ~small
+    result[use_median] = ((lower + upper) // 2)[use_median]
+
+    # 非均匀单元格：8 级量化直方图，按与逐格路径相同的规则挑选主色
+    use_histogram = ~uniform & ~small & (counts > 50)
+    if np.any(use_histogram):
+        cells = np.flatnonzero(use_histogram)
+        codes = _quantize_codes(pixels[cells])
+        flat = (np.arange(len(cells))[:, None] * 512 + codes)[valid[cells]]
+        size = len(cells) * 512
+        bin_counts = np.bincount(flat, minlength=size).reshape(-1, 512)
+        bin_sums = np.stack(
+            [
+                np.bincount(flat, weights=pixels[cells][..., c][valid[cells]], minlength=size)
+                for c in range(3)
+            ],
+            axis=-1,
+        ).reshape(-1, 512, 3)
+
+        centers = _BIN_CENTERS
+        black_bin = np.all(centers < config.black_filter_threshold, axis=1)
+        white_bin = (centers.sum(axis=1) / 3 > config.white_brightness) & (
+            centers.max(axis=1) - centers.min(axis=1) < config.white_color_range
+        )
+
+        share = bin_counts / counts[cells][:, None]
+        black_ok = (dark_pixel_ratio[cells] >= config.dark_pixel_ratio)[:, None] & (
+            share >= config.black_cluster_ratio
+        )
+        white_ok = share > config.white_cluster_ratio
+        eligible = (bin_counts > 0) & np.where(
+            black_bin, black_ok, np.where(white_bin, white_ok, True)
+        )
+
+        # 计数相同的 bin 按量化颜色顺序取第一个
+        ranked = np.where(eligible, bin_counts, -1)
+        chosen = np.where(
+            eligible.any(axis=1), ranked.argmax(axis=1), bin_counts.argmax(axis=1)
+        )
+        rows_idx = np.arange(len(cells))
+        chosen_mean = bin_sums[rows_idx, chosen] / bin_counts[rows_idx, chosen][:, None]
+        result[cells] = chosen_mean.astype(np.int64)
+
+    # 样本太少、需要 K-means 的非均匀单元格交给逐格路径
+    needs_kmeans = ~uniform & ~small & (counts <= 50)
+    fallback.reshape(-1)[selected[needs_kmeans]] = True
+    colors.reshape(-1, 3)[selected] = result
+    return colors, fallback
+
+
+def _cell_sample_step(height: int, width: int, config: ColorProcessingConfig) -> int:
+    """逐格路径的抽样步长，使每个单元格内部大约取 cell_pixel_budget 个像素"""
+    if config.cell_pixel_budget <= 0 or height <= 0 or width <= 0:
+        return 1
+    return max(1, int(round(math.sqrt(height * width / config.cell_pixel_budget))))
+
+
+def _cell_resampler(
+    inner: Tuple[slice, slice], step: int, config: ColorProcessingConfig
+) -> Callable[[np.ndarray], np.ndarray]:
+    """
+    返回把整图数组（图像、掩码、颜色平面）取成单元格样本的函数。
+
+    同一个单元格的图像和掩码用同一个函数取样，像素一一对应。
+    stride 按步长隔行隔列取；area 用 INTER_AREA 缩小到相同尺寸，掩码缩小后按 0.5 取阈值。
+    """
+    if config.cell_resample == 'stride' or step == 1:
+        region = (
+            slice(inner[0].start, inner[0].stop, step),
+            slice(inner[1].start, inner[1].stop, step),
+        )
+        return lambda plane: plane[region]
+
+    def resample(plane: np.ndarray) -> np.ndarray:
+        patch = plane[inner]
+        if patch.size == 0:
+            return patch
+        size = (-(-patch.shape[1] // step), -(-patch.shape[0] // step))
+        if patch.dtype == bool:
+            shrunk = cv2.resize(patch.astype(np.float32), size, interpolation=cv2.INTER_AREA)
+            return shrunk >= 0.5
+        return cv2.resize(patch, size, interpolation=cv2.INTER_AREA)
+
+    return resample
+
+
 def extract_colors(
-    image: np.ndarray, grid_info: Dict, config: ColorProcessingConfig
-) -> List[List[Tuple[int, int, int]]]:
-    h_lines = grid_info['h_lines']
-    v_lines = grid_info['v_lines']
+    image: np.ndarray,
+    grid_info: Dict,
+    config: ColorProcessingConfig,
+    stats: Optional[ExtractionStats] = None,
+) -> ColorGrid:
+    """
+    提取每个单元格的颜色。
+
+    stats: 可选的 ExtractionStats，传入时记录每个单元格走的路径和各阶段耗时
+    """
+    if config.cell_resample not in ('stride', 'area'):
+        raise ValueError(f"未知的单元格重采样方式: {config.cell_resample}")
+
+    h_lines = np.asarray(grid_info['h_lines'], dtype=np.intp)
+    v_lines = np.asarray(grid_info['v_lines'], dtype=np.intp)
     
     rows = len(h_lines) - 1
     cols = len(v_lines) - 1
+    if stats is not None:
+        stats.path_codes = np.full((max(rows, 0), max(cols, 0)), PATH_EMPTY, dtype=np.uint8)
+        stats.cell_seconds = np.zeros((max(rows, 0), max(cols, 0)))
+        stats.stage_seconds = {}
+    if rows <= 0 or cols <= 0:
+        return ColorGrid(np.zeros((max(rows, 0), max(cols, 0), 3), dtype=np.uint8))
+    clock = _StageClock(stats)
+
+    # 之后的所有计算只针对网格外接矩形，边框、图例等区域不参与；
+    # 单元格内部离外接矩形边缘至少 margin_min 像素，中值滤波结果与整图计算相同
+    top, left = max(int(h_lines[0]), 0), max(int(v_lines[0]), 0)
+    image = image[top : int(h_lines[-1]), left : int(v_lines[-1])]
+    h_lines = h_lines - top
+    v_lines = v_lines - left
 
-    colors: List[List[Tuple[int, int, int]]] = []
     watermark_mask = _build_watermark_mask(image, config)
-    edge_mask = _build_watermark_edge_mask(image, config)
     use_watermark_filter = (
         config.watermark_filter_enabled
         and watermark_mask is not None
         and float(np.mean(watermark_mask)) >= config.watermark_ratio_threshold
     )
+    if not use_watermark_filter:
+        watermark_mask = None
+    edge_mask = _build_watermark_edge_mask(image, config)
     use_edge_filter = config.watermark_edge_filter_enabled and edge_mask is not None
+    clock.lap('masks')
+
+    # 全局预处理：整幅图像只做一次中值滤波和颜色空间转换，单元格直接取切片
+    blurred = rgb_plane = lab_plane = None
+    if config.global_preprocessing:
+        blurred = cv2.medianBlur(image, 5)
+        rgb_plane = cv2.cvtColor(blurred, cv2.COLOR_BGR2RGB)
+        if config.robust_trim_enabled:
+            lab_plane = rgb_to_lab_u8(rgb_plane)
+        clock.lap('preprocess')
+
+    # 积分图快速路径：纯色单元格直接取均值
+    uniform_colors = None
+    if config.integral_fast_path:
+        uniform_colors, uniform = _integral_uniform_cells(
+            blurred if blurred is not None else image,
+            h_lines,
+            v_lines,
+            config,
+            watermark_mask if use_watermark_filter else None,
+            edge_mask if use_edge_filter else None,
+        )
+        clock.lap('integral')
+
+    batch_colors = None
+    if config.batched_extraction:
+        batch_colors, fallback = _extract_colors_batched(
+            image,
+            h_lines,
+            v_lines,
+            config,
+            watermark_mask if use_watermark_filter else None,
+            edge_mask if use_edge_filter else None,
+            blurred,
+            uniform if uniform_colors is not None else None,
+        )
+        clock.lap('batched')
+
+    # 快速路径已经得到的颜色直接写入结果，其余单元格逐格计算
+    grid = np.empty((rows, cols, 3), dtype=np.uint8)
+    resolved = np.zeros(grid.shape[:2], dtype=bool)
+    if uniform_colors is not None:
+        grid[uniform] = uniform_colors[uniform]
+        resolved |= uniform
+    if batch_colors is not None:
+        batched = ~fallback & ~resolved
+        grid[batched] = batch_colors[batched]
+        resolved |= batched
+    if stats is not None:
+        if uniform_colors is not None:
+            stats.path_codes[uniform] = PATH_INTEGRAL
+        if batch_colors is not None:
+            stats.path_codes[batched] = PATH_BATCHED
 
     for i in range(rows):
-        row_colors: List[Tuple[int, int, int]] = []
-        for j in range(cols):
+        for j in np.flatnonzero(~resolved[i]).tolist():
+            start = time.perf_counter() if stats is not None else 0.0
             y1, y2 = h_lines[i], h_lines[i + 1]
             x1, x2 = v_lines[j], v_lines[j + 1]
 
@@ -147,36 +645,40 @@ def extract_colors(
             margin_y = max(config.margin_min, min(margin_y, cell_height // config.margin_max_divisor))
             margin_x = max(config.margin_min, min(margin_x, cell_width // config.margin_max_divisor))
 
-            # 性能优化：对于较大的单元格，使用采样减少像素数量
-            sample_step = 1
-            if cell_height > 60 and cell_width > 60:
-                sample_step = 3
-            elif cell_height > 30 and cell_width > 30:
-                sample_step = 2
-            cell = image[y1 + margin_y : y2 - margin_y : sample_step, x1 + margin_x : x2 - margin_x : sample_step]
+            # 按像素预算抽样：单元格再大，参与计算的像素数也大致固定
+            inner = (slice(y1 + margin_y, y2 - margin_y), slice(x1 + margin_x, x2 - margin_x))
+            step = _cell_sample_step(cell_height - 2 * margin_y, cell_width - 2 * margin_x, config)
+            resample = _cell_resampler(inner, step, config)
+
+            cell = resample(image)
             cell_watermark = None
             cell_edge = None
             if use_watermark_filter and watermark_mask is not None:
-                cell_watermark = watermark_mask[
-                    y1 + margin_y : y2 - margin_y : sample_step,
-                    x1 + margin_x : x2 - margin_x : sample_step,
-                ]
+                cell_watermark = resample(watermark_mask)
             if use_edge_filter and edge_mask is not None:
-                cell_edge = edge_mask[
-                    y1 + margin_y : y2 - margin_y : sample_step,
-                    x1 + margin_x : x2 - margin_x : sample_step,
-                ]
+                cell_edge = resample(edge_mask)
 
             if cell.size == 0:
-                row_colors.append((255, 255, 255))
+                grid[i, j] = (255, 255, 255)
                 continue
 
-            color = get_dominant_color(cell, config, cell_watermark, cell_edge)
-            row_colors.append(color)
-
-        colors.append(row_colors)
-
-    return colors
+            if rgb_plane is not None:
+                # 区域平均后的 LAB 与 LAB 的平均不同，面积重采样时按需重新转换
+                cell_lab = None
+                if lab_plane is not None and config.cell_resample == 'stride':
+                    cell_lab = resample(lab_plane)
+                color, path = _dominant_color_and_path(
+                    resample(rgb_plane), config, cell_watermark, cell_edge, cell_lab
+                )
+            else:
+                color, path = _cell_color_and_path(cell, config, cell_watermark, cell_edge)
+            grid[i, j] = color
+            if stats is not None:
+                stats.path_codes[i, j] = path
+                stats.cell_seconds[i, j] = time.perf_counter() - start
+
+    clock.lap('cells')
+    return ColorGrid(grid)
 
 
 def get_dominant_color(
@@ -185,13 +687,39 @@ def get_dominant_color(
     watermark_mask: np.ndarray | None = None,
     edge_mask: np.ndarray | None = None,
 ) -> Tuple[int, int, int]:
+    return _cell_color_and_path(cell, config, watermark_mask, edge_mask)[0]
+
+
+def _cell_color_and_path(
+    cell: np.ndarray,
+    config: ColorProcessingConfig,
+    watermark_mask: np.ndarray | None = None,
+    edge_mask: np.ndarray | None = None,
+) -> Tuple[Tuple[int, int, int], int]:
     # 只对足够大的cell应用medianBlur，避免尺寸问题
     if cell.shape[0] >= 5 and cell.shape[1] >= 5:
         cell_filtered = cv2.medianBlur(cell, 5)
     else:
         cell_filtered = cell
     cell_rgb = cv2.cvtColor(cell_filtered, cv2.COLOR_BGR2RGB)
+    return _dominant_color_and_path(cell_rgb, config, watermark_mask, edge_mask)
+
+
+def _dominant_color_and_path(
+    cell_rgb: np.ndarray,
+    config: ColorProcessingConfig,
+    watermark_mask: np.ndarray | None = None,
+    edge_mask: np.ndarray | None = None,
+    cell_lab: np.ndarray | None = None,
+) -> Tuple[Tuple[int, int, int], int]:
+    """
+    get_dominant_color 去掉滤波和颜色转换后的部分，同时返回所走的路径（PATH_* 常量）。
+
+    cell_rgb 为已滤波的 RGB 像素；cell_lab 为可选的对应 8 位 LAB 像素（全局预处理时
+    由整幅图像转换得到），未提供时在稳健裁剪中按需计算。
+    """
     pixels = cell_rgb.reshape(-1, 3)
+    lab_pixels = cell_lab.reshape(-1, 3) if cell_lab is not None else None
 
     if watermark_mask is not None:
         # 确保mask和pixels维度匹配
@@ -204,6 +732,8 @@ def get_dominant_color(
                 filtered_pixels = pixels[~mask_flat]
                 if len(filtered_pixels) >= config.watermark_min_pixels:
                     pixels = filtered_pixels
+                    if lab_pixels is not None:
+                        lab_pixels = lab_pixels[~mask_flat]
 
     if edge_mask is not None:
         # 确保mask和pixels维度匹配
@@ -216,10 +746,13 @@ def get_dominant_color(
                 filtered_pixels = pixels[~edge_flat]
                 if len(filtered_pixels) >= config.watermark_edge_min_pixels:
                     pixels = filtered_pixels
+                    if lab_pixels is not None:
+                        lab_pixels = lab_pixels[~edge_flat]
 
     if config.robust_trim_enabled and len(pixels) >= config.robust_trim_min_pixels:
-        lab = cv2.cvtColor(pixels.reshape(-1, 1, 3).astype(np.uint8), cv2.COLOR_RGB2LAB)
-        lab = lab.reshape(-1, 3).astype(np.float32)
+        if lab_pixels is None:
+            lab_pixels = rgb_to_lab_u8(pixels)
+        lab = lab_pixels.astype(np.float32)
         median = np.median(lab, axis=0)
         distances = np.linalg.norm(lab - median, axis=1)
         threshold = np.percentile(distances, config.robust_trim_percentile)
@@ -235,31 +768,36 @@ def get_dominant_color(
     dark_pixel_ratio = float(np.mean(near_black_mask))
 
     if len(pixels) < 10:
-        return tuple(map(int, pixels.mean(axis=0)))
+        return tuple(map(int, pixels.mean(axis=0))), PATH_SMALL_MEAN
 
     # 快速路径：如果像素颜色非常一致，直接返回中位数
     pixel_std = np.std(pixels, axis=0)
-    if np.all(pixel_std < 15):  # 颜色非常一致
-        return tuple(map(int, np.median(pixels, axis=0)))
+    if np.all(pixel_std < config.uniform_std_threshold):  # 颜色非常一致
+        return tuple(map(int, np.median(pixels, axis=0))), PATH_UNIFORM_MEDIAN
 
     # 快速路径：使用直方图方法代替K-means
     if len(pixels) > 50:
-        # 量化颜色到较少的bin
-        quantized = (pixels // 32) * 32 + 16  # 8个level per channel
-        unique, counts = np.unique(quantized, axis=0, return_counts=True)
+        # 量化颜色到较少的bin（8个level per channel），一次 bincount 得到各 bin 的
+        # 像素数和各通道像素和，候选颜色的原始像素均值无需再扫描像素
+        codes = _quantize_codes(pixels)
+        bin_counts = np.bincount(codes, minlength=512)
+        bin_sums = np.stack(
+            [np.bincount(codes, weights=pixels[:, c], minlength=512) for c in range(3)], axis=-1
+        )
+        present = np.flatnonzero(bin_counts)  # 与 np.unique 的字典序一致
+        counts = bin_counts[present]
 
         # 找到最常见的颜色（排除黑色）
         sorted_indices = np.argsort(-counts)
         for idx in sorted_indices:
-            color = unique[idx]
-            r, g, b = color
+            code = present[idx]
+            r, g, b = _BIN_CENTERS[code]
 
             # 跳过黑色（除非黑色占比很高）
             if r < config.black_filter_threshold and g < config.black_filter_threshold and b < config.black_filter_threshold:
                 if dark_pixel_ratio >= config.dark_pixel_ratio and (counts[idx] / len(pixels)) >= config.black_cluster_ratio:
                     # 使用原始像素的平均值而不是量化值
-                    mask = np.all(quantized == color, axis=1)
-                    return tuple(map(int, pixels[mask].mean(axis=0)))
+                    return tuple(map(int, bin_sums[code] / counts[idx])), PATH_HISTOGRAM
                 continue
 
             # 跳过白色（除非白色占比很高）
@@ -267,36 +805,44 @@ def get_dominant_color(
             color_range = max(int(r), int(g), int(b)) - min(int(r), int(g), int(b))
             if avg_brightness > config.white_brightness and color_range < config.white_color_range:
                 if counts[idx] / len(pixels) > config.white_cluster_ratio:
-                    mask = np.all(quantized == color, axis=1)
-                    return tuple(map(int, pixels[mask].mean(axis=0)))
+                    return tuple(map(int, bin_sums[code] / counts[idx])), PATH_HISTOGRAM
                 continue
 
             # 返回这个颜色对应的原始像素平均值
-            mask = np.all(quantized == color, axis=1)
-            return tuple(map(int, pixels[mask].mean(axis=0)))
+            return tuple(map(int, bin_sums[code] / counts[idx])), PATH_HISTOGRAM
 
         # 如果所有颜色都被跳过，返回最常见的
-        color = unique[sorted_indices[0]]
-        mask = np.all(quantized == color, axis=1)
-        return tuple(map(int, pixels[mask].mean(axis=0)))
+        code = present[sorted_indices[0]]
+        return tuple(map(int, bin_sums[code] / bin_counts[code])), PATH_HISTOGRAM
 
     # 回退到K-means（仅用于小样本）
     try:
-        n_clusters = min(config.kmeans_clusters, len(pixels))
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=config.kmeans_n_init, max_iter=100)
-        kmeans.fit(pixels)
+        # 在唯一像素上做加权聚类，权重为出现次数
+        unique_pixels, pixel_counts = np.unique(pixels, axis=0, return_counts=True)
+        n_clusters = min(config.kmeans_clusters, len(unique_pixels))
+        centers, labels = kmeans(
+            unique_pixels,
+            n_clusters,
+            weights=pixel_counts,
+            n_init=config.kmeans_n_init,
+            max_iter=100,
+            backend=config.kmeans_backend,
+        )
 
-        labels = kmeans.labels_
-        label_counts = Counter(labels)
-        sorted_clusters = label_counts.most_common()
+        cluster_sizes = np.bincount(labels, weights=pixel_counts, minlength=len(centers))
+        sorted_clusters = [
+            (int(label), float(cluster_sizes[label]))
+            for label in np.argsort(-cluster_sizes, kind='stable')
+            if cluster_sizes[label] > 0
+        ]
 
         for cluster_label, count in sorted_clusters:
-            cluster_color = kmeans.cluster_centers_[cluster_label]
+            cluster_color = centers[cluster_label]
             r, g, b = cluster_color
 
             if r < config.black_filter_threshold and g < config.black_filter_threshold and b < config.black_filter_threshold:
                 if dark_pixel_ratio >= config.dark_pixel_ratio and (count / len(pixels)) >= config.black_cluster_ratio:
-                    return tuple(map(int, cluster_color))
+                    return tuple(map(int, cluster_color)), PATH_KMEANS
                 continue
 
             avg_brightness = (r + g + b) / 3
@@ -304,30 +850,28 @@ def get_dominant_color(
 
             if avg_brightness > config.white_brightness and color_range < config.white_color_range:
                 if count / len(pixels) > config.white_cluster_ratio:
-                    return tuple(map(int, cluster_color))
+                    return tuple(map(int, cluster_color)), PATH_KMEANS
                 continue
 
-            return tuple(map(int, cluster_color))
+            return tuple(map(int, cluster_color)), PATH_KMEANS
 
         dominant_label = sorted_clusters[0][0]
-        dominant_color = kmeans.cluster_centers_[dominant_label]
-        return tuple(map(int, dominant_color))
+        dominant_color = centers[dominant_label]
+        return tuple(map(int, dominant_color)), PATH_KMEANS
 
     except Exception as exc:
-        return tuple(map(int, np.median(pixels, axis=0)))
+        return tuple(map(int, np.median(pixels, axis=0))), PATH_KMEANS_FAILED
 
 
 def merge_similar_colors(
-    colors: List[List[Tuple[int, int, int]]],
+    colors: ColorGrid | List[List[Tuple[int, int, int]]],
     config: ColorProcessingConfig,
-) -> List[List[Tuple[int, int, int]]]:
-    all_colors: List[Tuple[int, int, int]] = []
-    for row in colors:
-        all_colors.extend(row)
-
-    color_counts = Counter(all_colors)
-
-    unique_colors = list(set(all_colors))
+) -> ColorGrid:
+    grid = ColorGrid.from_colors(colors)
+    color_counts = grid.color_counts()
+    # 贪心合并和 K-means 初始化对访问顺序敏感（计数相同的颜色先后不同，合并结果就不同），
+    # 这里保持原来逐行收集颜色再放入 set 的顺序：按第一次出现的顺序插入，set 的迭代顺序不变
+    unique_colors = list(set(grid.first_seen_colors()))
 
     white_colors = []
     other_colors = []
@@ -399,12 +943,8 @@ def merge_similar_colors(
             f"颜色数量 ({len(premerge_unique)}) 未明显超过阈值 ({merge_trigger})，跳过聚类"
         )
         if white_color_map or black_color_map or similar_color_map:
-            merged_colors = []
-            for row in colors:
-                merged_row = [_map_color(c) for c in row]
-                merged_colors.append(merged_row)
-            return merged_colors
-        return colors
+            return grid.map_colors({color: _map_color(color) for color in unique_colors})
+        return grid
 
     print("进行全局聚类...")
 
@@ -430,13 +970,20 @@ def merge_similar_colors(
         if config.protect_near_black:
             available_clusters = max(1, config.max_colors - len(near_black_colors))
         n_clusters = min(available_clusters, len(cluster_candidates))
-        kmeans = KMeans(n_clusters=n_clusters, random_state=42, n_init=config.kmeans_n_init)
-        kmeans.fit(color_array)
+        # 以每种颜色占据的单元格数为权重，聚类中心偏向主要颜色
+        weights = np.array([color_counts[color] for color in cluster_candidates], dtype=np.float64)
+        centers, labels = kmeans(
+            color_array,
+            n_clusters,
+            weights=weights,
+            n_init=config.kmeans_n_init,
+            backend=config.kmeans_backend,
+        )
 
         color_map: Dict[Tuple[int, int, int], Tuple[int, int, int]] = {}
         label_lookup = {}
         for i, original_color in enumerate(cluster_candidates):
-            cluster_id = kmeans.labels_[i]
+            cluster_id = labels[i]
             label_lookup[original_color] = cluster_id
 
         for original_color in unique_colors:
@@ -458,28 +1005,20 @@ def merge_similar_colors(
                 color_map[original_color] = original_color
                 continue
 
-            new_color = tuple(map(int, kmeans.cluster_centers_[cluster_id]))
+            new_color = tuple(map(int, centers[cluster_id]))
             color_map[original_color] = new_color
 
-        merged_colors = []
-        for row in colors:
-            merged_row = [color_map.get(color, color) for color in row]
-            merged_colors.append(merged_row)
-
-        merged_unique = set()
-        for row in merged_colors:
-            merged_unique.update(row)
-
-        print(f"合并后剩余 {len(merged_unique)} 种颜色")
+        merged = grid.map_colors(color_map)
+        print(f"合并后剩余 {len(merged.palette)} 种颜色")
 
-        return merged_colors
+        return merged
 
     except Exception as exc:
         print(f"颜色合并失败: {exc}，保持原始颜色")
-        return colors
+        return grid
 
 
 def crop_white_borders(
-    colors: List[List[Tuple[int, int, int]]], max_margin: int = 5
-) -> List[List[Tuple[int, int, int]]]:
+    colors: ColorGrid | List[List[Tuple[int, int, int]]], max_margin: int = 5
+) -> ColorGrid | List[List[Tuple[int, int, int]]]:
     return colors
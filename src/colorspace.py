@@ -0,0 +1,106 @@
+"""
+颜色空间转换
+
+统一的 RGB → LAB 批量转换（sRGB，D65 标准光源），输入输出均为数组：
+
+- rgb_to_lab: 浮点路径，L 范围 0-100，a/b 为有符号值
+- lab_to_xyz: LAB 转回 XYZ，供其他颜色模型使用
+- rgb_to_lab_u8: 8 位路径，直接调用 OpenCV 的 COLOR_RGB2LAB
+  （L*255/100，a+128，b+128），用于按该尺度调好的阈值
+- rgb_to_lab_cached: 单个颜色的带缓存转换，用于反复出现的热点颜色
+"""
+
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+# D65 白点
+_WHITE = (0.95047, 1.00000, 1.08883)
+_EPSILON = 0.008856
+
+
+def _linearize(c: np.ndarray) -> np.ndarray:
+    """sRGB Gamma 解码，c 范围 0-1"""
+    return np.where(c > 0.04045, ((c + 0.055) / 1.055) ** 2.4, c / 12.92)
+
+
+# 8 位输入的 Gamma 解码查找表
+_LINEAR_LUT = _linearize(np.arange(256, dtype=np.float64) / 255.0)
+
+
+def _linear_rgb_to_lab(r: np.ndarray, g: np.ndarray, b: np.ndarray) -> np.ndarray:
+    # RGB to XYZ
+    x = r * 0.4124564 + g * 0.3575761 + b * 0.1804375
+    y = r * 0.2126729 + g * 0.7151522 + b * 0.0721750
+    z = r * 0.0193339 + g * 0.1191920 + b * 0.9503041
+
+    # XYZ to LAB
+    xyz = np.stack([x / _WHITE[0], y / _WHITE[1], z / _WHITE[2]], axis=-1)
+    positive = xyz > _EPSILON
+    f = 7.787 * xyz + 16 / 116
+    f[positive] = xyz[positive] ** (1 / 3)
+
+    L = 116 * f[..., 1] - 16
+    a = 500 * (f[..., 0] - f[..., 1])
+    b = 200 * (f[..., 1] - f[..., 2])
+
+    return np.stack([L, a, b], axis=-1)
+
+
+def rgb_to_lab(rgb: np.ndarray) -> np.ndarray:
+    """
+    RGB 转 LAB（浮点路径）。
+
+    rgb: 形状为 (..., 3) 的数组，值范围 0-255；uint8 输入走 Gamma 查找表
+    返回形状相同的 float64 LAB 数组。
+    """
+    rgb = np.asarray(rgb)
+    if rgb.dtype == np.uint8:
+        linear = _LINEAR_LUT[rgb]
+    else:
+        linear = _linearize(rgb.astype(np.float64) / 255.0)
+    return _linear_rgb_to_lab(linear[..., 0], linear[..., 1], linear[..., 2])
+
+
+def rgb_to_lab_u8(rgb: np.ndarray) -> np.ndarray:
+    """
+    RGB 转 8 位 LAB，即 cv2.cvtColor(..., COLOR_RGB2LAB) 的 8 位输出。
+
+    rgb: 形状为 (..., 3) 的 uint8 数组
+    返回形状相同的 uint8 数组。整幅图像也直接交给 OpenCV，结果与原有逐格转换一致。
+    """
+    rgb = np.ascontiguousarray(rgb, dtype=np.uint8)
+    # 排成单行图像：单列 (N, 1, 3) 的排布实测慢约 3 倍
+    lab = cv2.cvtColor(rgb.reshape(1, -1, 3), cv2.COLOR_RGB2LAB)
+    return lab.reshape(rgb.shape)
+
+
+def lab_to_xyz(lab: np.ndarray) -> np.ndarray:
+    """
+    LAB 转 XYZ（D65，Y 范围 0-1）。
+
+    lab: 形状为 (..., 3) 的数组
+    返回形状相同的 float64 XYZ 数组。
+    """
+    lab = np.asarray(lab, dtype=np.float64)
+    fy = (lab[..., 0] + 16) / 116
+    fx = fy + lab[..., 1] / 500
+    fz = fy - lab[..., 2] / 200
+
+    f = np.stack([fx, fy, fz], axis=-1)
+    cube = f**3
+    xyz = np.where(cube > _EPSILON, cube, (f - 16 / 116) / 7.787)
+    return xyz * np.array(_WHITE)
+
+
+@lru_cache(maxsize=65536)
+def rgb_to_lab_cached(rgb: Tuple[int, int, int]) -> Tuple[float, float, float]:
+    """
+    单个颜色的 RGB 转 LAB，结果按颜色缓存。
+    """
+    L, a, b = rgb_to_lab(np.array(rgb, dtype=np.uint8)).tolist()
+    return L, a, b
@@ -22,6 +22,21 @@ class GridDetectionConfig:
     irregular_spacing_std_ratio: float = 0.35
     irregular_min_ratio: float = 0.5
     projection_std_ratio: float = 1.5
+    # 自相关估算的网格周期置信度低于该值时不采用
+    period_min_confidence: float = 0.2
+    # 网格线定位：'hough'（HoughLinesP）或 'projection'（线图的行/列投影，判断为倾斜时回退 Hough）
+    line_localizer: str = 'hough'
+    # 投影定位的滞后阈值，相对于最强的一行/列
+    localizer_high_ratio: float = 0.5
+    localizer_low_ratio: float = 0.25
+    # 最强的一行/列至少覆盖线图范围的该比例，否则视为倾斜
+    localizer_min_coverage: float = 0.5
+    # 金字塔检测：长边超过该值时先在缩小图上检测，再在全分辨率窄带内细化；0 表示关闭
+    pyramid_max_side: int = 0
+    # 缩小图上估算的网格间距（两个方向取较小者）不低于该值（像素），否则减小缩小倍数
+    pyramid_min_spacing: int = 16
+    # 细化窄带的半宽，以缩小图的像素计；窄带内找不到线时放宽到 0.4 个网格间距
+    pyramid_refine_radius: float = 1.5
 
 
 @dataclass(frozen=True)
@@ -31,6 +46,7 @@ class ColorProcessingConfig:
     margin_max_divisor: int = 3
     kmeans_clusters: int = 3  # 减少以提升速度
     kmeans_n_init: int = 3  # 减少初始化次数以提升速度
+    kmeans_backend: str = 'numpy'  # 'numpy' 或 'sklearn'（仅在选择时导入 scikit-learn）
     black_filter_threshold: int = 50
     black_cluster_ratio: float = 0.05
     dark_pixel_ratio: float = 0.08
@@ -60,3 +76,16 @@ class ColorProcessingConfig:
     robust_trim_enabled: bool = True
     robust_trim_percentile: float = 80.0
     robust_trim_min_pixels: int = 50
+    # 单元格各通道标准差都低于该值时视为纯色，直接返回代表色
+    uniform_std_threshold: float = 15.0
+    # 按行单元格求区域和（和、平方和、掩码计数）判断纯色单元格，只有非纯色单元格逐格计算
+    integral_fast_path: bool = False
+    # 整幅图像只做一次中值滤波和 LAB 转换，逐格路径直接使用其切片
+    global_preprocessing: bool = False
+    # 批量提取：规则网格的单元格内部重采样为固定边长，所有单元格一次性计算
+    batched_extraction: bool = False
+    batch_sample_size: int = 12
+    # 逐格路径每个单元格内部大约参与计算的像素数，步长为 round(sqrt(面积 / 预算))；0 表示不抽样
+    cell_pixel_budget: int = 400
+    # 抽样方式：'stride' 按步长隔行隔列取像素，'area' 按区域平均缩小（掩码同步缩小）
+    cell_resample: str = 'stride'
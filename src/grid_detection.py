@@ -4,185 +4,451 @@
 
 from __future__ import annotations
 
-from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
 
 import cv2
 import numpy as np
 
 from .config import GridDetectionConfig
 
+# 自相关峰不低于最高峰的该比例时，取其中最短的周期，避免把每 5/10 格的粗线当成网格间距
+_HARMONIC_PEAK_RATIO = 0.5
+# 可估算的最短周期（像素）
+_MIN_PERIOD = 4
+
+
+@dataclass(frozen=True)
+class GridPeriod:
+    """
+    一个方向上的网格周期。
+
+    spacing: 网格间距（像素，亚像素精度），0 表示没有估算出周期
+    confidence: 周期处的归一化自相关值，范围 [0, 1]
+    """
+
+    spacing: float
+    confidence: float
+
 
 def detect_grid(image: np.ndarray, debug: bool, config: GridDetectionConfig) -> Optional[Dict]:
     """
     检测图片中的网格结构。
+
+    长边超过 config.pyramid_max_side 时使用金字塔模式：先在缩小的图上检测间距和大致线位置，
+    再在全分辨率下只对每条线附近的窄带重新定位。
     """
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    binary = cv2.adaptiveThreshold(
-        gray,
-        255,
-        cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
-        cv2.THRESH_BINARY,
-        config.adaptive_block_size,
-        config.adaptive_c,
-    )
+    context = _GridContext(image)
+    scale, small = _pyramid_level(context, config)
+    if scale > 1:
+        positions = _detect_grid_pyramid(context, small, debug, config, scale)
+    else:
+        positions = _detect_grid_positions(context, debug, config)
+    if positions is None:
+        return None
+    h_positions, v_positions = positions
+
+    print(f"检测到 {len(h_positions)} 条水平线, {len(v_positions)} 条垂直线")
+
+    avg_h_spacing = _median_spacing(h_positions)
+    avg_v_spacing = _median_spacing(v_positions)
+
+    print(f"平均网格间距: 水平 {avg_h_spacing:.1f}, 垂直 {avg_v_spacing:.1f}")
 
-    binary = cv2.bitwise_not(binary)
+    h_period, v_period = context.periods()
+    return {
+        'h_positions': h_positions,
+        'v_positions': v_positions,
+        'h_lines': h_positions,
+        'v_lines': v_positions,
+        'h_spacing': avg_h_spacing,
+        'v_spacing': avg_v_spacing,
+        'h_period': h_period,
+        'v_period': v_period,
+    }
 
-    kernel_len = _get_grid_kernel_len(image, config)
-    kernel_horizontal, kernel_vertical = _build_grid_kernels(kernel_len)
 
-    horizontal_lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel_horizontal)
-    vertical_lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, kernel_vertical)
+class _GridContext:
+    """
+    一次检测中共享的预处理结果。
 
-    grid_lines = cv2.addWeighted(horizontal_lines, 0.5, vertical_lines, 0.5, 0)
+    灰度图、二值图、Sobel 投影与周期、Canny 边缘和开运算后的线图都在第一次用到时计算，
+    按产生它们的参数缓存，强核重试、投影法回退和金字塔细化直接复用。
+    """
 
-    if debug:
-        cv2.imshow('Binary', binary)
-        cv2.imshow('Horizontal Lines', horizontal_lines)
-        cv2.imshow('Vertical Lines', vertical_lines)
-        cv2.imshow('Grid Lines', grid_lines)
-        cv2.waitKey(0)
-        cv2.destroyAllWindows()
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self._planes: Dict[Tuple, object] = {}
 
-    h_lines = _detect_lines(
-        horizontal_lines,
-        angle_threshold=config.angle_threshold_h,
-        threshold=config.hough_threshold,
-        min_line_length=config.min_line_length,
-        max_line_gap=config.max_line_gap,
-    )
-    v_lines = _detect_lines(
-        vertical_lines,
-        angle_threshold=config.angle_threshold_v,
-        threshold=config.hough_threshold,
-        min_line_length=config.min_line_length,
-        max_line_gap=config.max_line_gap,
-    )
+    def _cached(self, key: Tuple, build: Callable[[], object]):
+        if key not in self._planes:
+            self._planes[key] = build()
+        return self._planes[key]
 
-    if len(h_lines) < 2 or len(v_lines) < 2:
-        print(
-            f"检测到的线条不足: 水平线 {len(h_lines)}, 垂直线 {len(v_lines)}，尝试投影法回退"
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return self.image.shape
+
+    @property
+    def gray(self) -> np.ndarray:
+        return self._cached(('gray',), lambda: cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY))
+
+    def binary(self, block_size: int, c: int) -> np.ndarray:
+        """自适应阈值后反转的二值图（黑线 → 白线）"""
+
+        def build() -> np.ndarray:
+            binary = cv2.adaptiveThreshold(
+                self.gray, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, block_size, c
+            )
+            return cv2.bitwise_not(binary)
+
+        return self._cached(('binary', block_size, c), build)
+
+    def line_map(self, block_size: int, c: int, kernel_len: int, horizontal: bool) -> np.ndarray:
+        """二值图经水平或垂直线形核开运算后的线图"""
+
+        def build() -> np.ndarray:
+            kernel_horizontal, kernel_vertical = _build_grid_kernels(kernel_len)
+            kernel = kernel_horizontal if horizontal else kernel_vertical
+            return cv2.morphologyEx(self.binary(block_size, c), cv2.MORPH_OPEN, kernel)
+
+        return self._cached(('line_map', block_size, c, kernel_len, horizontal), build)
+
+    def sobel_profiles(self) -> Tuple[np.ndarray, np.ndarray]:
+        """水平边缘按行、垂直边缘按列的 int32 投影"""
+
+        def build() -> Tuple[np.ndarray, np.ndarray]:
+            # 3x3 Sobel 在 uint8 上的幅值不超过 1020，用 int16 保存，每行/列求和不会溢出 int32
+            sobel_h = np.abs(cv2.Sobel(self.gray, cv2.CV_16S, 0, 1, ksize=3))
+            h_profile = sobel_h.sum(axis=1, dtype=np.int32)
+            del sobel_h
+            sobel_v = np.abs(cv2.Sobel(self.gray, cv2.CV_16S, 1, 0, ksize=3))
+            v_profile = sobel_v.sum(axis=0, dtype=np.int32)
+            return h_profile, v_profile
+
+        return self._cached(('sobel_profiles',), build)
+
+    def periods(self) -> Tuple[GridPeriod, GridPeriod]:
+        """水平线（按行）和垂直线（按列）的周期"""
+
+        def build() -> Tuple[GridPeriod, GridPeriod]:
+            h_profile, v_profile = self.sobel_profiles()
+            return _estimate_period(h_profile), _estimate_period(v_profile)
+
+        return self._cached(('periods',), build)
+
+    def edges(self) -> np.ndarray:
+        """高斯模糊后的 Canny 边缘"""
+
+        def build() -> np.ndarray:
+            return cv2.Canny(cv2.GaussianBlur(self.gray, (3, 3), 0), 50, 150)
+
+        return self._cached(('edges',), build)
+
+    def spacing(self, config: GridDetectionConfig) -> float:
+        return self._cached(
+            ('spacing', config.period_min_confidence), lambda: _estimate_grid_spacing(self, config)
         )
-        h_positions, v_positions = _detect_grid_by_projection(image, config)
-    else:
-        h_positions = _positions_from_lines(h_lines, axis='h')
-        v_positions = _positions_from_lines(v_lines, axis='v')
 
-    if len(h_positions) < 2 or len(v_positions) < 2:
-        print(f"投影法仍不足: 水平线 {len(h_positions)}, 垂直线 {len(v_positions)}")
+
+def _pyramid_level(
+    context: _GridContext, config: GridDetectionConfig
+) -> Tuple[int, Optional[_GridContext]]:
+    """
+    金字塔模式的整数缩小倍数和缩小图，倍数为 1 表示直接在原图上检测。
+
+    倍数先按长边缩到 pyramid_max_side 计算，再在缩小图上估算网格间距：
+    缩小后的间距（取两个方向中较小的）低于 pyramid_min_spacing 时减小倍数重新估算，
+    缩小图上估算失败（间距太小，周期不可辨）时倍数减半。间距不在原图上估算，
+    省下整幅图像的 Sobel。
+    """
+    if config.pyramid_max_side <= 0:
+        return 1, None
+    h, w = context.shape[:2]
+    scale = -(-max(h, w) // config.pyramid_max_side)
+    while scale > 1:
+        small = _GridContext(
+            cv2.resize(context.image, (w // scale, h // scale), interpolation=cv2.INTER_AREA)
+        )
+        spacings = [
+            period.spacing
+            for period in small.periods()
+            if period.spacing > 0 and period.confidence >= config.period_min_confidence
+        ]
+        if not spacings:
+            scale //= 2
+            continue
+        # 取两个方向中较小的间距：缩小后细线变淡，自相关可能锁定在间距的整数倍上
+        fit = int(min(spacings) * scale // config.pyramid_min_spacing)
+        if fit >= scale:
+            return scale, small
+        scale = fit
+    return 1, None
+
+
+def _detect_grid_pyramid(
+    context: _GridContext, small: _GridContext, debug: bool, config: GridDetectionConfig, scale: int
+) -> Optional[Tuple[List[int], List[int]]]:
+    coarse = _detect_grid_positions(small, debug, config)
+    if coarse is None:
+        print("缩小图上未检测到网格，改用全分辨率检测")
+        return _detect_grid_positions(context, debug, config)
+
+    gray = context.gray
+    h_coarse, v_coarse = coarse
+    h_positions = _refine_positions(gray, h_coarse, scale, config)
+    v_positions = _refine_positions(gray.T, v_coarse, scale, config)
+    if h_positions is None or v_positions is None:
+        # 某条线在放宽的窄带内也找不到，粗略位置不可信，该方向改用全分辨率检测的结果
+        print("金字塔细化失败，改用全分辨率检测")
+        full = _detect_grid_positions(context, debug, config)
+        if full is None:
+            return None
+        h_positions = full[0] if h_positions is None else h_positions
+        v_positions = full[1] if v_positions is None else v_positions
+    return h_positions, v_positions
+
+
+def _refine_positions(
+    gray: np.ndarray, coarse: List[int], scale: int, config: GridDetectionConfig
+) -> Optional[List[int]]:
+    """
+    在全分辨率下细化水平线位置（垂直线传入转置后的灰度图）。
+
+    每条线只处理其粗略位置上下 pyramid_refine_radius 个缩小图像素的窄带：自适应阈值
+    （窄带上下各多取半个块，结果与整图计算相同）和横向开运算后，有线像素的连续行构成候选段。
+    线像素数不到该方向各条线中位数一半的段是文字或噪声，忽略；取离粗略位置最近的一段，
+    位置为按像素数加权的中心。窄带内没有这样的段时，把窄带放宽到 0.4 个网格间距再找一次，
+    仍然没有则返回 None。
+    """
+    spacing = _median_spacing(coarse) * scale
+    kernel_len = _kernel_len_from_spacing(spacing) if spacing > 0 else config.kernel_len_min
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_len, 1))
+    radius = int(np.ceil(config.pyramid_refine_radius * scale))
+    wide_radius = max(radius, int(spacing * 0.4))
+    pad = config.adaptive_block_size // 2
+    height = gray.shape[0]
+
+    def band_runs(center: int, radius: int) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """窄带内的候选段：(行号, 每行线像素数)"""
+        lo, hi = max(0, center - radius), min(height, center + radius + 1)
+        top, bottom = max(0, lo - pad), min(height, hi + pad)
+        binary = cv2.adaptiveThreshold(
+            np.ascontiguousarray(gray[top:bottom]),
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY,
+            config.adaptive_block_size,
+            config.adaptive_c,
+        )
+        band = cv2.morphologyEx(cv2.bitwise_not(binary[lo - top : hi - top]), cv2.MORPH_OPEN, kernel)
+        profile = np.count_nonzero(band, axis=1)
+        rows = np.flatnonzero(profile >= config.min_line_length)
+        runs = np.split(rows, np.flatnonzero(np.diff(rows) > 1) + 1) if len(rows) else []
+        return [(run + lo, profile[run]) for run in runs]
+
+    def nearest_line(runs, center: int, strength: float) -> Optional[int]:
+        lines = [(rows, counts) for rows, counts in runs if counts.max() >= strength]
+        if not lines:
+            return None
+        rows, counts = min(lines, key=lambda line: np.min(np.abs(line[0] - center)))
+        return int(round(np.average(rows, weights=counts)))
+
+    # 缩小图的第 c 行对应原图 [c * scale, (c + 1) * scale) 的中心
+    centers = [int(round(position * scale + (scale - 1) / 2)) for position in coarse]
+    all_runs = [band_runs(center, radius) for center in centers]
+    peaks = [max(counts.max() for _, counts in runs) for runs in all_runs if runs]
+    if not peaks:
         return None
+    strength = 0.5 * float(np.median(peaks))
 
-    h_positions, v_positions = _postprocess_grid_positions(h_positions, v_positions, config)
+    refined: List[int] = []
+    for center, runs in zip(centers, all_runs):
+        position = nearest_line(runs, center, strength)
+        if position is None:
+            position = nearest_line(band_runs(center, wide_radius), center, strength)
+        if position is None:
+            return None
+        refined.append(position)
 
-    if _is_irregular_grid(h_positions, config) or _is_irregular_grid(v_positions, config):
-        strong_kernel_len = int(kernel_len * 1.5)
-        strong_kernel_horizontal, strong_kernel_vertical = _build_grid_kernels(strong_kernel_len)
+    return sorted(set(refined))
+
+
+def _detect_grid_positions(
+    context: _GridContext, debug: bool, config: GridDetectionConfig
+) -> Optional[Tuple[List[int], List[int]]]:
+    block_size, c = config.adaptive_block_size, config.adaptive_c
+
+    kernel_len = _get_grid_kernel_len(context, config)
+    horizontal_lines = context.line_map(block_size, c, kernel_len, horizontal=True)
+    vertical_lines = context.line_map(block_size, c, kernel_len, horizontal=False)
 
-        horizontal_lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, strong_kernel_horizontal)
-        vertical_lines = cv2.morphologyEx(binary, cv2.MORPH_OPEN, strong_kernel_vertical)
+    if debug:
+        grid_lines = cv2.addWeighted(horizontal_lines, 0.5, vertical_lines, 0.5, 0)
+        cv2.imshow('Binary', context.binary(block_size, c))
+        cv2.imshow('Horizontal Lines', horizontal_lines)
+        cv2.imshow('Vertical Lines', vertical_lines)
+        cv2.imshow('Grid Lines', grid_lines)
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
 
+    positions = _localize_grid_lines(horizontal_lines, vertical_lines, config)
+    if positions is not None:
+        h_positions, v_positions = positions
+    else:
         h_lines = _detect_lines(
             horizontal_lines,
             angle_threshold=config.angle_threshold_h,
-            threshold=config.hough_threshold_strong,
+            threshold=config.hough_threshold,
             min_line_length=config.min_line_length,
             max_line_gap=config.max_line_gap,
         )
         v_lines = _detect_lines(
             vertical_lines,
             angle_threshold=config.angle_threshold_v,
-            threshold=config.hough_threshold_strong,
+            threshold=config.hough_threshold,
             min_line_length=config.min_line_length,
             max_line_gap=config.max_line_gap,
         )
 
-        if len(h_lines) >= 2 and len(v_lines) >= 2:
+        if len(h_lines) < 2 or len(v_lines) < 2:
+            print(
+                f"检测到的线条不足: 水平线 {len(h_lines)}, 垂直线 {len(v_lines)}，尝试投影法回退"
+            )
+            h_positions, v_positions = _detect_grid_by_projection(context, config)
+        else:
             h_positions = _positions_from_lines(h_lines, axis='h')
             v_positions = _positions_from_lines(v_lines, axis='v')
-            h_positions, v_positions = _postprocess_grid_positions(
-                h_positions, v_positions, config
-            )
 
-    print(f"检测到 {len(h_positions)} 条水平线, {len(v_positions)} 条垂直线")
+    if len(h_positions) < 2 or len(v_positions) < 2:
+        print(f"投影法仍不足: 水平线 {len(h_positions)}, 垂直线 {len(v_positions)}")
+        return None
 
-    avg_h_spacing = _median_spacing(h_positions)
-    avg_v_spacing = _median_spacing(v_positions)
+    h_positions, v_positions = _postprocess_grid_positions(h_positions, v_positions, config)
 
-    print(f"平均网格间距: 水平 {avg_h_spacing:.1f}, 垂直 {avg_v_spacing:.1f}")
+    if _is_irregular_grid(h_positions, config) or _is_irregular_grid(v_positions, config):
+        strong_kernel_len = int(kernel_len * 1.5)
+        horizontal_lines = context.line_map(block_size, c, strong_kernel_len, horizontal=True)
+        vertical_lines = context.line_map(block_size, c, strong_kernel_len, horizontal=False)
+
+        positions = _localize_grid_lines(horizontal_lines, vertical_lines, config)
+        if positions is None:
+            h_lines = _detect_lines(
+                horizontal_lines,
+                angle_threshold=config.angle_threshold_h,
+                threshold=config.hough_threshold_strong,
+                min_line_length=config.min_line_length,
+                max_line_gap=config.max_line_gap,
+            )
+            v_lines = _detect_lines(
+                vertical_lines,
+                angle_threshold=config.angle_threshold_v,
+                threshold=config.hough_threshold_strong,
+                min_line_length=config.min_line_length,
+                max_line_gap=config.max_line_gap,
+            )
+            if len(h_lines) >= 2 and len(v_lines) >= 2:
+                positions = (
+                    _positions_from_lines(h_lines, axis='h'),
+                    _positions_from_lines(v_lines, axis='v'),
+                )
 
-    return {
-        'h_positions': h_positions,
-        'v_positions': v_positions,
-        'h_lines': h_positions,
-        'v_lines': v_positions,
-        'h_spacing': avg_h_spacing,
-        'v_spacing': avg_v_spacing,
-    }
+        if positions is not None:
+            h_positions, v_positions = _postprocess_grid_positions(*positions, config)
+
+    return h_positions, v_positions
 
 
-def _get_grid_kernel_len(image: np.ndarray, config: GridDetectionConfig) -> int:
+def _get_grid_kernel_len(context: _GridContext, config: GridDetectionConfig) -> int:
     """
     自适应计算形态学核长度。
     先用边缘检测估算网格间距，然后选择合适的核长度。
     """
-    h, w = image.shape[:2]
+    h, w = context.shape[:2]
 
     # 先估算网格间距
-    estimated_spacing = _estimate_grid_spacing(image)
+    estimated_spacing = context.spacing(config)
 
     if estimated_spacing > 0:
-        # kernel 长度设为网格间距的 1.2 倍，确保能检测到网格线
-        adaptive_len = int(estimated_spacing * 1.2)
-        # 限制在合理范围内
-        adaptive_len = max(15, min(adaptive_len, 60))
-        return adaptive_len
+        return _kernel_len_from_spacing(estimated_spacing)
 
     # 回退到原来的计算方式
     return max(config.kernel_len_min, int(min(h, w) * config.kernel_len_ratio))
 
 
-def _estimate_grid_spacing(image: np.ndarray) -> float:
+def _kernel_len_from_spacing(spacing: float) -> int:
+    # kernel 长度设为网格间距的 1.2 倍，确保能检测到网格线，并限制在合理范围内
+    return max(15, min(int(spacing * 1.2), 60))
+
+
+def _estimate_grid_spacing(context: _GridContext, config: GridDetectionConfig) -> float:
     """
-    使用 Sobel 边缘检测估算网格间距。
+    用 Sobel 边缘投影的自相关估算网格间距，取置信度足够的方向的平均值。
     """
-    try:
-        from scipy.signal import find_peaks
-    except ImportError:
-        return 0.0
-
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-
-    # 用 Sobel 检测垂直和水平边缘
-    sobel_h = np.abs(cv2.Sobel(gray, cv2.CV_64F, 0, 1, ksize=3))
-    sobel_v = np.abs(cv2.Sobel(gray, cv2.CV_64F, 1, 0, ksize=3))
-
-    # 投影
-    h_profile = sobel_h.sum(axis=1)
-    v_profile = sobel_v.sum(axis=0)
-
-    # 归一化
-    h_profile = h_profile / (h_profile.max() + 1e-6)
-    v_profile = v_profile / (v_profile.max() + 1e-6)
-
-    # 找峰值
-    h_peaks, _ = find_peaks(h_profile, distance=10, prominence=0.05)
-    v_peaks, _ = find_peaks(v_profile, distance=10, prominence=0.05)
-
-    # 计算中位间距
-    spacings = []
-    if len(h_peaks) > 2:
-        h_spacing = np.median(np.diff(h_peaks))
-        spacings.append(h_spacing)
-    if len(v_peaks) > 2:
-        v_spacing = np.median(np.diff(v_peaks))
-        spacings.append(v_spacing)
-
+    spacings = [
+        period.spacing
+        for period in context.periods()
+        if period.spacing > 0 and period.confidence >= config.period_min_confidence
+    ]
     if spacings:
         return float(np.mean(spacings))
     return 0.0
 
 
+def _estimate_period(profile: np.ndarray) -> GridPeriod:
+    """
+    用自相关估算一维边缘投影的周期。
+
+    自相关通过补零 FFT 计算并按零延迟归一化。在 [_MIN_PERIOD, n/2] 的局部极大中，
+    取不低于最高峰 _HARMONIC_PEAK_RATIO 倍的最短延迟作为周期，抛物线插值到亚像素，
+    再用最远的整数倍峰细化。
+    """
+    n = len(profile)
+    none = GridPeriod(0.0, 0.0)
+    half = n // 2
+    if half <= _MIN_PERIOD + 1:
+        return none
+
+    signal = profile.astype(np.float64)
+    signal -= signal.mean()
+    size = 1 << int(np.ceil(np.log2(2 * n)))
+    spectrum = np.fft.rfft(signal, size)
+    autocorr = np.fft.irfft(spectrum * np.conj(spectrum), size)[:n]
+    if autocorr[0] <= 0:
+        return none
+    autocorr /= autocorr[0]
+
+    window = autocorr[_MIN_PERIOD - 1 : half + 1]
+    maxima = (
+        np.flatnonzero((window[1:-1] > window[:-2]) & (window[1:-1] >= window[2:])) + _MIN_PERIOD
+    )
+    if len(maxima) == 0 or autocorr[maxima].max() <= 0:
+        return none
+    lag = int(maxima[np.argmax(autocorr[maxima] >= autocorr[maxima].max() * _HARMONIC_PEAK_RATIO)])
+    spacing = _parabolic_peak(autocorr, lag)
+
+    # 第 m 个倍数峰的位置误差不随 m 增大，除以 m 后间距更准
+    multiple = int((half - 2) // spacing)
+    if multiple > 1:
+        reach = max(1, int(spacing / 4))
+        center = int(round(multiple * spacing))
+        lo, hi = max(1, center - reach), min(n - 2, center + reach)
+        far = lo + int(np.argmax(autocorr[lo : hi + 1]))
+        if lo < far < hi:
+            spacing = _parabolic_peak(autocorr, far) / multiple
+
+    return GridPeriod(float(spacing), float(max(autocorr[lag], 0.0)))
+
+
+def _parabolic_peak(values: np.ndarray, index: int) -> float:
+    # 用相邻三点拟合抛物线，返回顶点位置
+    left, mid, right = values[index - 1], values[index], values[index + 1]
+    curvature = left - 2 * mid + right
+    if curvature >= 0:
+        return float(index)
+    return index + 0.5 * (left - right) / curvature
+
+
 def _build_grid_kernels(kernel_len: int) -> Tuple[np.ndarray, np.ndarray]:
     kernel_horizontal = cv2.getStructuringElement(cv2.MORPH_RECT, (kernel_len, 1))
     kernel_vertical = cv2.getStructuringElement(cv2.MORPH_RECT, (1, kernel_len))
@@ -227,6 +493,66 @@ def _median_spacing(positions: List[int]) -> float:
     return 0.0
 
 
+def _localize_grid_lines(
+    horizontal_lines: np.ndarray, vertical_lines: np.ndarray, config: GridDetectionConfig
+) -> Optional[Tuple[List[int], List[int]]]:
+    """
+    按 config.line_localizer 用投影定位网格线。
+
+    返回 None 表示应使用 Hough 变换：配置为 'hough'，或投影结果不可靠（图片可能倾斜）。
+    """
+    if config.line_localizer == 'hough':
+        return None
+    if config.line_localizer != 'projection':
+        raise ValueError(f"未知的网格线定位方式: {config.line_localizer}")
+
+    h_positions = _localize_lines(horizontal_lines, horizontal=True, config=config)
+    v_positions = _localize_lines(vertical_lines, horizontal=False, config=config)
+    if h_positions is None or v_positions is None:
+        print("投影定位不可靠（图片可能倾斜），改用 Hough 变换")
+        return None
+    return h_positions, v_positions
+
+
+def _localize_lines(
+    line_map: np.ndarray, horizontal: bool, config: GridDetectionConfig
+) -> Optional[List[int]]:
+    """
+    从开运算后的线图投影中定位线中心（水平线按行求和，垂直线按列求和）。
+
+    不低于 低阈值 的连续行构成候选线，其中至少一行不低于 高阈值 的才保留（滞后阈值），
+    位置取该段按像素数加权的中心。两个阈值都相对于最强的一行。
+    最强的一行覆盖不到线图范围的 localizer_min_coverage 时，线条很可能是倾斜的，返回 None。
+    """
+    profile = cv2.reduce(
+        line_map, 1 if horizontal else 0, cv2.REDUCE_SUM, dtype=cv2.CV_32S
+    ).ravel() // 255
+    # 线图在线条方向上的范围
+    occupied = np.flatnonzero(cv2.reduce(line_map, 0 if horizontal else 1, cv2.REDUCE_MAX))
+    if len(occupied) == 0:
+        return None
+    peak = int(profile.max())
+    if peak < config.localizer_min_coverage * (occupied[-1] - occupied[0] + 1):
+        return None
+
+    high = max(config.min_line_length, config.localizer_high_ratio * peak)
+    low = config.localizer_low_ratio * peak
+    above = np.concatenate(([False], profile >= low, [False]))
+    boundaries = np.flatnonzero(above[1:] != above[:-1])
+    starts, ends = boundaries[::2], boundaries[1::2]
+
+    weights = np.where(above[1:-1], profile, 0).astype(np.float64)
+    keep = np.maximum.reduceat(weights, starts) >= high
+    cumulative = np.concatenate(([0.0], np.cumsum(weights)))
+    weighted = np.concatenate(([0.0], np.cumsum(weights * np.arange(len(weights)))))
+    totals = cumulative[ends] - cumulative[starts]
+    centers = (weighted[ends] - weighted[starts])[keep] / totals[keep]
+
+    if len(centers) < 2:
+        return None
+    return np.round(centers).astype(int).tolist()
+
+
 def _detect_lines(
     image: np.ndarray,
     angle_threshold: float = 10,
@@ -345,11 +671,9 @@ def _is_irregular_grid(positions: List[int], config: GridDetectionConfig) -> boo
 
 
 def _detect_grid_by_projection(
-    image: np.ndarray, config: GridDetectionConfig
+    context: _GridContext, config: GridDetectionConfig
 ) -> Tuple[List[int], List[int]]:
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (3, 3), 0)
-    edges = cv2.Canny(blurred, 50, 150)
+    edges = context.edges()
 
     h_profile = edges.sum(axis=1)
     v_profile = edges.sum(axis=0)
@@ -6,10 +6,16 @@
 import cv2
 import numpy as np
 from dataclasses import replace
-from typing import List, Tuple, Dict, Optional
+from typing import List, Tuple, Dict, Optional, Union
 import svgwrite
 
-from .color_processing import crop_white_borders, extract_colors, merge_similar_colors
+from .color_grid import ColorGrid
+from .color_processing import (
+    ExtractionStats,
+    crop_white_borders,
+    extract_colors,
+    merge_similar_colors,
+)
 from .config import ColorProcessingConfig, GridDetectionConfig
 from .grid_detection import detect_grid
 
@@ -29,6 +35,7 @@ class PerlerBeadDetector:
         self.max_grid_size = max_grid_size
         self.grid_data = None
         self.colors = None
+        self.extraction_stats = None
         self.grid_config = GridDetectionConfig()
         self.color_config = ColorProcessingConfig()
         
@@ -60,16 +67,21 @@ class PerlerBeadDetector:
             raise ValueError("无法检测到网格结构")
         
         # 1.5 根据网格信息进行精确裁剪（移除非网格区域和多余margin）
-        image = self._crop_by_grid(image, grid_info, max_margin=1)
+        cropped = self._crop_by_grid(image, grid_info, max_margin=1)
         
-        # 重新检测网格（可选，确保裁剪后的图片仍能检测到网格）
-        grid_info = self._detect_grid(image, debug)
-        
-        if grid_info is None:
-            raise ValueError("裁剪后无法检测到网格结构")
+        # 裁剪改变了图片时重新检测网格（确保裁剪后的图片仍能检测到网格），否则沿用上面的结果
+        if cropped is not image:
+            image = cropped
+            grid_info = self._detect_grid(image, debug)
+            
+            if grid_info is None:
+                raise ValueError("裁剪后无法检测到网格结构")
         
-        # 2. 提取每个方格的颜色
-        colors = self._extract_colors(image, grid_info)
+        # 2. 提取每个方格的颜色（调试模式下统计每个单元格走的路径和耗时）
+        stats = ExtractionStats() if debug else None
+        colors = self._extract_colors(image, grid_info, stats)
+        if stats is not None:
+            print(stats.summary())
         
         # 4. 对所有颜色进行全局聚类，合并相似颜色
         colors = self._merge_similar_colors(colors)
@@ -77,14 +89,18 @@ class PerlerBeadDetector:
         # 5. 存储结果
         self.grid_data = grid_info
         self.colors = colors
+        self.extraction_stats = stats
         
         result = {
             'grid_info': grid_info,
             'colors': colors,
-            'rows': len(colors),
-            'cols': len(colors[0]) if colors else 0
+            'rows': colors.rows,
+            'cols': colors.cols
         }
         
+        if stats is not None:
+            result['extraction_stats'] = stats
+        
         print(f"检测到 {result['rows']}x{result['cols']} 的网格")
         
         return result
@@ -104,7 +120,8 @@ class PerlerBeadDetector:
         """
         return detect_grid(image, debug, self.grid_config)
     
-    def _extract_colors(self, image: np.ndarray, grid_info: Dict) -> List[List[Tuple[int, int, int]]]:
+    def _extract_colors(self, image: np.ndarray, grid_info: Dict,
+                        stats: Optional[ExtractionStats] = None) -> ColorGrid:
         """
         提取每个方格的颜色
         
@@ -113,15 +130,16 @@ class PerlerBeadDetector:
         Args:
             image: 原始图片
             grid_info: 网格信息
+            stats: 可选的统计对象，记录每个单元格走的路径和耗时
             
         Returns:
-            颜色矩阵 (rows x cols)，每个元素是RGB颜色元组
+            颜色网格 (rows x cols)，每个单元格是RGB颜色
         """
-        return extract_colors(image, grid_info, self.color_config)
+        return extract_colors(image, grid_info, self.color_config, stats)
     
-    def _merge_similar_colors(self, colors: List[List[Tuple[int, int, int]]], 
+    def _merge_similar_colors(self, colors: Union[ColorGrid, List[List[Tuple[int, int, int]]]], 
                              max_colors: int = 20, 
-                             color_threshold: int = 20) -> List[List[Tuple[int, int, int]]]:
+                             color_threshold: int = 20) -> ColorGrid:
         """
         合并相似的颜色，减少总颜色数量
         
@@ -146,9 +164,8 @@ class PerlerBeadDetector:
             cell_size: 每个方格的大小（像素）
             grid_width: 网格线宽度（像素）
         """
-        colors = result['colors']
-        rows = result['rows']
-        cols = result['cols']
+        grid = ColorGrid.from_colors(result['colors'])
+        rows, cols = grid.shape
         
         # 创建SVG
         width = cols * cell_size
@@ -156,11 +173,13 @@ class PerlerBeadDetector:
         
         dwg = svgwrite.Drawing(output_path, size=(width, height))
         
+        # 每种颜色只格式化一次
+        fills = [f'rgb({r},{g},{b})' for r, g, b in grid.palette.tolist()]
+        
         # 绘制每个方格
-        for i in range(rows):
-            for j in range(cols):
-                r, g, b = colors[i][j]
-                color = f'rgb({r},{g},{b})'
+        for i, row in enumerate(grid.inverse.tolist()):
+            for j, color_idx in enumerate(row):
+                color = fills[color_idx]
                 
                 dwg.add(dwg.rect(
                     insert=(j * cell_size, i * cell_size),
@@ -208,15 +227,8 @@ class PerlerBeadDetector:
             result: process_image返回的结果
             output_path: 输出文件路径
         """
-        colors = result['colors']
-        
-        # 收集所有颜色
-        all_colors = []
-        for row in colors:
-            all_colors.extend(row)
-        
         # 统计颜色频率
-        color_counts = Counter(all_colors)
+        color_counts = ColorGrid.from_colors(result['colors']).color_counts()
         
         # 保存到文件
         with open(output_path, 'w', encoding='utf-8') as f:
@@ -232,8 +244,8 @@ class PerlerBeadDetector:
         
         return color_counts
     
-    def _crop_white_borders(self, colors: List[List[Tuple[int, int, int]]], 
-                           max_margin: int = 5) -> List[List[Tuple[int, int, int]]]:
+    def _crop_white_borders(self, colors: Union[ColorGrid, List[List[Tuple[int, int, int]]]], 
+                           max_margin: int = 5) -> Union[ColorGrid, List[List[Tuple[int, int, int]]]]:
         """
         裁剪颜色矩阵 - 已禁用
         
@@ -259,28 +271,15 @@ class PerlerBeadDetector:
         image = cv2.imread(image_path)
         image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
         
-        # 创建结果图
-        colors = result['colors']
-        rows = result['rows']
-        cols = result['cols']
-        
         # 智能裁剪colors矩阵，移除全白色的边界行/列
-        colors = self._crop_white_borders(colors)
-        rows = len(colors)
-        cols = len(colors[0]) if rows > 0 else 0
+        grid = ColorGrid.from_colors(self._crop_white_borders(result['colors']))
+        rows, cols = grid.shape
         
         # 创建高分辨率的结果图，每个方格放大以便绘制网格线
         cell_size = 20  # 每个方格的像素大小
-        result_image = np.zeros((rows * cell_size, cols * cell_size, 3), dtype=np.uint8)
-        
-        # 填充颜色并绘制网格线
-        for i in range(rows):
-            for j in range(cols):
-                b, g, r = colors[i][j]  # colors 中存储的是 BGR
-                # 填充方格
-                y1, y2 = i * cell_size, (i + 1) * cell_size
-                x1, x2 = j * cell_size, (j + 1) * cell_size
-                result_image[y1:y2, x1:x2] = [b, g, r]
+        
+        # 填充颜色：每个单元格放大为 cell_size x cell_size 的色块
+        result_image = np.repeat(np.repeat(grid.array, cell_size, axis=0), cell_size, axis=1)
         
         # 绘制网格线
         grid_color = [0, 0, 0]  # 黑色网格线
@@ -0,0 +1,36 @@
+"""
+测试公共设置：把项目根目录加入路径，提供合成调色板
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.colorspace import rgb_to_lab
+
+
+def write_palette(path, size: int, seed: int = 0, duplicates: int = 0) -> str:
+    """生成 size 个随机色号的 .npz 调色板；duplicates 个色号重复前面的颜色，用于检查并列排序"""
+    rng = np.random.default_rng(seed)
+    rgb = rng.integers(0, 256, (size, 3)).astype(np.uint8)
+    if duplicates:
+        rgb[-duplicates:] = rgb[:duplicates]
+    codes = np.array([f'S{i:04d}' for i in range(size)], dtype=str)
+    np.savez(path, codes=codes, rgb=rgb, lab=rgb_to_lab(rgb))
+    return str(path)
+
+
+@pytest.fixture(scope='session')
+def palette_path(tmp_path_factory):
+    """200 个色号的合成调色板，其中最后 5 个与前 5 个颜色相同"""
+    return write_palette(tmp_path_factory.mktemp('palette') / 'palette.npz', 200, duplicates=5)
+
+
+@pytest.fixture
+def random_rgbs():
+    return np.random.default_rng(1).integers(0, 256, (500, 3))
@@ -0,0 +1,153 @@
+"""
+测试用的参考实现：优化之前的逐个颜色 / 列表版本，用来对照现有实现的输出。
+基准测试也从这里导入参考实现和样本数据。
+"""
+
+from collections import Counter
+
+import numpy as np
+
+from src.clustering import kmeans
+from src.color_processing import _merge_similar_palette
+from src.colorspace import rgb_to_lab_u8
+
+
+def reference_merge_similar_colors(colors, config):
+    """二维颜色列表上的全局颜色合并（ColorGrid 之前的实现，去掉了日志）"""
+    all_colors = [color for row in colors for color in row]
+    color_counts = Counter(all_colors)
+    unique_colors = list(set(all_colors))
+
+    white_colors = []
+    other_colors = []
+    near_black_colors = []
+    for color in unique_colors:
+        r, g, b = color
+        avg_brightness = (r + g + b) / 3
+        color_range = max(r, g, b) - min(r, g, b)
+        if avg_brightness > config.white_brightness and color_range < config.white_color_range:
+            white_colors.append(color)
+        elif (
+            config.protect_near_black
+            and r < config.black_filter_threshold
+            and g < config.black_filter_threshold
+            and b < config.black_filter_threshold
+        ):
+            near_black_colors.append(color)
+        else:
+            other_colors.append(color)
+
+    white_color_map = {}
+    if len(white_colors) > 1:
+        avg_white = tuple(map(int, np.mean(white_colors, axis=0)))
+        white_color_map = {c: avg_white for c in white_colors}
+
+    black_color_map = {}
+    if config.near_black_merge_enabled and len(near_black_colors) > config.near_black_merge_limit:
+        avg_black = tuple(map(int, np.mean(near_black_colors, axis=0)))
+        black_color_map = {c: avg_black for c in near_black_colors}
+
+    similar_color_map = _merge_similar_palette(other_colors, color_counts, config.color_threshold)
+
+    merge_trigger = max(
+        int(config.max_colors * config.merge_trigger_ratio),
+        config.max_colors + config.merge_trigger_min_overflow,
+    )
+
+    def _map_color(color):
+        mapped = white_color_map.get(color)
+        if mapped is not None:
+            return mapped
+        mapped = black_color_map.get(color)
+        if mapped is not None:
+            return mapped
+        return similar_color_map.get(color, color)
+
+    if len({_map_color(color) for color in unique_colors}) <= merge_trigger:
+        return [[_map_color(c) for c in row] for row in colors]
+
+    cluster_candidates = [
+        color
+        for color in unique_colors
+        if color not in white_color_map
+        and color not in black_color_map
+        and color not in similar_color_map
+        and (not config.protect_near_black or color not in near_black_colors)
+    ]
+    try:
+        available_clusters = config.max_colors
+        if config.protect_near_black:
+            available_clusters = max(1, config.max_colors - len(near_black_colors))
+        n_clusters = min(available_clusters, len(cluster_candidates))
+        weights = np.array([color_counts[c] for c in cluster_candidates], dtype=np.float64)
+        centers, labels = kmeans(
+            np.array(cluster_candidates),
+            n_clusters,
+            weights=weights,
+            n_init=config.kmeans_n_init,
+            backend=config.kmeans_backend,
+        )
+    except Exception:
+        # 原实现聚类失败时保持原始颜色
+        return colors
+    label_lookup = dict(zip(cluster_candidates, labels))
+
+    color_map = {}
+    for color in unique_colors:
+        if color in white_color_map or color in black_color_map or color in similar_color_map:
+            color_map[color] = _map_color(color)
+        elif color in label_lookup:
+            color_map[color] = tuple(map(int, centers[label_lookup[color]]))
+        else:
+            color_map[color] = color
+    return [[color_map[color] for color in row] for row in colors]
+
+
+def reference_merge_palette(colors, counts, threshold):
+    """逐颜色、逐簇比较的贪心合并（向量化之前的实现）"""
+    labs = rgb_to_lab_u8(np.array(colors, dtype=np.uint8).reshape(-1, 3)).astype(np.float32)
+    order = sorted(range(len(colors)), key=lambda i: counts.get(colors[i], 1), reverse=True)
+    clusters = []
+    for idx in order:
+        color = colors[idx]
+        lab = labs[idx]
+        weight = float(counts.get(color, 1))
+        best_idx = None
+        best_dist = float('inf')
+        for c_idx, cluster in enumerate(clusters):
+            dist = float(np.linalg.norm(lab - cluster['lab']))
+            if dist <= threshold and dist < best_dist:
+                best_dist = dist
+                best_idx = c_idx
+        if best_idx is None:
+            clusters.append(
+                {'lab': lab.copy(), 'rgb': np.array(color, dtype=np.float32), 'count': weight}
+            )
+        else:
+            cluster = clusters[best_idx]
+            total = float(cluster['count']) + weight
+            cluster['lab'] = (cluster['lab'] * cluster['count'] + lab * weight) / total
+            rgb = np.array(color, dtype=np.float32)
+            cluster['rgb'] = (cluster['rgb'] * cluster['count'] + rgb * weight) / total
+            cluster['count'] = total
+
+    final_labs = np.array([c['lab'] for c in clusters], dtype=np.float32)
+    final_rgbs = [tuple(map(int, np.round(c['rgb']))) for c in clusters]
+    mapping = {}
+    for i, color in enumerate(colors):
+        dists = np.linalg.norm(final_labs - labs[i], axis=1)
+        min_idx = int(np.argmin(dists))
+        mapping[color] = final_rgbs[min_idx] if float(dists[min_idx]) <= threshold else color
+    return mapping
+
+
+def sample_palette(size: int, seed: int = 0):
+    """生成 size 个唯一颜色及其出现次数：若干主色加高斯噪声"""
+    rng = np.random.default_rng(seed)
+    bases = rng.integers(0, 256, (max(1, size // 20), 3))
+    colors = {}
+    while len(colors) < size:
+        base = bases[rng.integers(0, len(bases))]
+        color = tuple(np.clip(base + rng.normal(0, 12, 3), 0, 255).astype(int).tolist())
+        colors.setdefault(color, int(rng.integers(1, 60)))
+    return list(colors), Counter(colors)
@@ -0,0 +1,76 @@
+"""
+加权 K-means：与 scikit-learn 在全部像素上的结果对照
+"""
+
+import numpy as np
+import pytest
+
+from src.clustering import kmeans, weighted_kmeans
+
+
+@pytest.fixture
+def pixels():
+    """三团颜色的像素，取整后大量重复"""
+    rng = np.random.default_rng(5)
+    bases = np.array([[200, 40, 40], [40, 180, 60], [50, 60, 210]])
+    sizes = [900, 500, 200]
+    groups = [np.clip(np.rint(b + rng.normal(0, 6, (n, 3))), 0, 255) for b, n in zip(bases, sizes)]
+    return np.concatenate(groups)
+
+
+def sorted_centers(centers):
+    return centers[np.lexsort(centers.T[::-1])]
+
+
+def test_weighted_unique_matches_sklearn_on_all_pixels(pixels):
+    # scikit-learn 是可选依赖，只用作参考实现
+    KMeans = pytest.importorskip('sklearn.cluster').KMeans
+    unique, counts = np.unique(pixels, axis=0, return_counts=True)
+    assert len(unique) < len(pixels)
+
+    centers, labels = weighted_kmeans(unique, 3, weights=counts)
+    reference = KMeans(n_clusters=3, random_state=42, n_init=3, max_iter=100).fit(pixels)
+
+    np.testing.assert_allclose(
+        sorted_centers(centers), sorted_centers(reference.cluster_centers_), atol=1e-6
+    )
+    # 像素按所属唯一颜色展开后，划分与 scikit-learn 相同（簇编号可以不同）
+    inverse = np.unique(pixels, axis=0, return_inverse=True)[1].ravel()
+    pairs = set(zip(labels[inverse].tolist(), reference.labels_.tolist()))
+    assert len(pairs) == 3
+
+
+def test_weights_equal_repeated_points(pixels):
+    unique, counts = np.unique(pixels, axis=0, return_counts=True)
+    weighted, _ = weighted_kmeans(unique, 3, weights=counts)
+    repeated, _ = weighted_kmeans(pixels, 3)
+
+    np.testing.assert_allclose(sorted_centers(weighted), sorted_centers(repeated), atol=1e-9)
+
+
+def test_sklearn_backend_agrees(pixels):
+    pytest.importorskip('sklearn')
+    unique, counts = np.unique(pixels, axis=0, return_counts=True)
+    numpy_centers, _ = kmeans(unique, 3, weights=counts)
+    sklearn_centers, _ = kmeans(unique, 3, weights=counts, backend='sklearn')
+
+    np.testing.assert_allclose(
+        sorted_centers(numpy_centers), sorted_centers(sklearn_centers), atol=1e-6
+    )
+
+
+def test_fewer_points_than_clusters():
+    points = np.array([[10, 10, 10], [10, 10, 10], [200, 200, 200]])
+    centers, labels = weighted_kmeans(points, 5)
+
+    assert len(centers) <= 3
+    assert labels[0] == labels[1] != labels[2]
+
+
+def test_invalid_input():
+    with pytest.raises(ValueError):
+        weighted_kmeans(np.empty((0, 3)), 2)
+    with pytest.raises(ValueError):
+        weighted_kmeans(np.ones((4, 3)), 2, weights=np.ones(3))
+    with pytest.raises(ValueError):
+        kmeans(np.ones((4, 3)), 2, backend='faiss')
@@ -0,0 +1,396 @@
+"""
+PerlerBeadColorMapper 的批量查找与逐个计算的参考实现对照
+"""
+
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from src.color_mapper import PerlerBeadColorMapper
+
+from conftest import write_palette
+
+
+def reference_ranking(mapper, rgb, top_n):
+    """逐个色号调用标量 CIEDE2000 后稳定排序（向量化之前的实现）"""
+    lab = mapper._rgb_to_lab(rgb)
+    scores = [mapper._delta_e_cie2000(lab, mapper.lab_colors[code]) for code in mapper.codes]
+    order = sorted(range(len(scores)), key=lambda i: scores[i])[:top_n]
+    return order, [scores[i] for i in order]
+
+
+@pytest.mark.parametrize('top_n', [1, 3, 8])
+def test_vectorized_ranking_matches_scalar_loop(palette_path, random_rgbs, top_n):
+    mapper = PerlerBeadColorMapper(palette_path, memo_size=0, index_threshold=None)
+    indices, delta_e = mapper.find_closest_colors(random_rgbs, top_n=top_n)
+
+    assert indices.shape == delta_e.shape == (len(random_rgbs), top_n)
+    for row, rgb in enumerate(random_rgbs[:100]):
+        expected_indices, expected_delta_e = reference_ranking(mapper, tuple(rgb), top_n)
+        assert indices[row].tolist() == expected_indices
+        np.testing.assert_allclose(delta_e[row], expected_delta_e, rtol=1e-9, atol=1e-9)
+
+
+def test_ties_keep_palette_order(palette_path):
+    """颜色相同的色号色差并列，按调色板顺序排列"""
+    mapper = PerlerBeadColorMapper(palette_path, memo_size=0, index_threshold=None)
+    duplicate = tuple(int(v) for v in mapper.palette_rgb[0])
+    indices, delta_e = mapper.find_closest_colors([duplicate], top_n=2)
+
+    assert indices[0].tolist() == [0, len(mapper.codes) - 5]
+    assert delta_e[0, 0] == delta_e[0, 1]
+
+
+def test_lut_lookup_matches_exact_search(palette_path, random_rgbs):
+    exact = PerlerBeadColorMapper(palette_path, memo_size=0, index_threshold=None)
+    lut = PerlerBeadColorMapper(palette_path, memo_size=0, index_threshold=None, lut_size=16)
+
+    expected_indices, _ = exact.find_closest_colors(random_rgbs, top_n=1)
+    indices, delta_e = lut.find_closest_colors(random_rgbs, top_n=1)
+    assert indices.tolist() == expected_indices.tolist()
+
+
+def test_lut_top_3_is_opt_in(palette_path, random_rgbs):
+    """默认只有 top_n 为 1 时用查找表，前 3 名走精确查找"""
+    exact = PerlerBeadColorMapper(palette_path, memo_size=0, index_threshold=None)
+    lut = PerlerBeadColorMapper(palette_path, memo_size=0, index_threshold=None, lut_size=16)
+
+    indices, delta_e = lut.find_closest_colors(random_rgbs, top_n=3)
+    expected_indices, expected_delta_e = exact.find_closest_colors(random_rgbs, top_n=3)
+    assert len(lut._lut_cache) == 0
+    assert indices.tolist() == expected_indices.tolist()
+    np.testing.assert_array_equal(delta_e, expected_delta_e)
+
+
+def test_lut_top_3_is_approximate(palette_path, random_rgbs):
+    """lut_top_n=3 时前 3 名只允许极少数决策边界附近的颜色不同；返回的色差始终是精确值"""
+    exact = PerlerBeadColorMapper(palette_path, memo_size=0, index_threshold=None)
+    lut = PerlerBeadColorMapper(
+        palette_path, memo_size=0, index_threshold=None, lut_size=16, lut_top_n=3
+    )
+
+    expected_indices, _ = exact.find_closest_colors(random_rgbs, top_n=3)
+    indices, delta_e = lut.find_closest_colors(random_rgbs, top_n=3)
+    assert len(lut._lut_cache) == 1
+    assert (indices == expected_indices).all(axis=1).mean() >= 0.99
+    for row in range(0, len(random_rgbs), 50):
+        lab = exact._rgb_to_lab(tuple(random_rgbs[row]))
+        for idx, de in zip(indices[row], delta_e[row]):
+            assert de == pytest.approx(exact._delta_e_cie2000(lab, exact.palette_lab[idx]))
+
+
+def test_lut_respects_allowed_colors(palette_path, random_rgbs):
+    mapper = PerlerBeadColorMapper(
+        palette_path, memo_size=0, index_threshold=None, lut_size=16, lut_top_n=3
+    )
+    allowed = mapper.codes[::7]
+    indices, _ = mapper.find_closest_colors(random_rgbs, top_n=3, allowed_colors=allowed)
+
+    assert len(mapper._lut_cache) == 1
+    assert {mapper.codes[idx] for idx in indices.ravel()} <= set(allowed)
+
+
+def test_lut_cache_is_bounded(palette_path):
+    mapper = PerlerBeadColorMapper(
+        palette_path, memo_size=0, index_threshold=None, lut_size=8, lut_cache_size=2
+    )
+    for allowed in (mapper.codes[:50], mapper.codes[50:100], mapper.codes[100:150]):
+        mapper.find_closest_colors([(10, 20, 30)], allowed_colors=allowed)
+
+    assert len(mapper._lut_cache) == 2
+    assert ('ciede2000', frozenset(mapper.codes[:50])) not in mapper._lut_cache
+
+
+def test_lut_skipped_for_large_top_n(palette_path):
+    """top_n 超过 lut_top_n 时直接走精确查找"""
+    mapper = PerlerBeadColorMapper(
+        palette_path, memo_size=0, index_threshold=None, lut_size=8, lut_top_n=2
+    )
+    mapper.find_closest_colors([(10, 20, 30)], top_n=3)
+
+    assert len(mapper._lut_cache) == 0
+
+
+def test_lut_size_must_divide_256(palette_path):
+    with pytest.raises(ValueError):
+        PerlerBeadColorMapper(palette_path, lut_size=24)
+
+
+@pytest.mark.parametrize('lut_top_n', [0, PerlerBeadColorMapper.LUT_TOP_N + 1])
+def test_lut_top_n_range(palette_path, lut_top_n):
+    """查找表的候选只够前 LUT_TOP_N 名"""
+    with pytest.raises(ValueError):
+        PerlerBeadColorMapper(palette_path, lut_size=8, lut_top_n=lut_top_n)
+
+
+@pytest.mark.parametrize('top_n', [1, 3, 10])
+def test_indexed_search_matches_exact(tmp_path, top_n):
+    """KD 树球查询剪枝后的结果与全量计算完全一致"""
+    path = write_palette(tmp_path / 'large.npz', 1500, seed=2, duplicates=20)
+    exact = PerlerBeadColorMapper(path, memo_size=0, index_threshold=None)
+    indexed = PerlerBeadColorMapper(path, memo_size=0, index_threshold=0)
+
+    rng = np.random.default_rng(3)
+    # 随机颜色、调色板颜色本身（色差为 0 且有并列）以及 RGB 立方体的角点
+    corners = np.array([[r, g, b] for r in (0, 255) for g in (0, 255) for b in (0, 255)])
+    rgbs = np.concatenate([rng.integers(0, 256, (3000, 3)), exact.palette_rgb[:50], corners])
+
+    expected_indices, expected_delta_e = exact.find_closest_colors(rgbs, top_n=top_n)
+    indices, delta_e = indexed.find_closest_colors(rgbs, top_n=top_n)
+
+    assert len(indexed._index_cache) == 1
+    assert indices.tolist() == expected_indices.tolist()
+    np.testing.assert_allclose(delta_e, expected_delta_e, rtol=1e-12, atol=1e-12)
+
+
+def count_searches(monkeypatch, mapper):
+    """记录每次实际计算（未命中缓存）的颜色"""
+    searched = []
+    search = mapper.find_closest_colors
+
+    def recording(rgbs, *args, **kwargs):
+        searched.append([tuple(rgb) for rgb in rgbs])
+        return search(rgbs, *args, **kwargs)
+
+    monkeypatch.setattr(mapper, 'find_closest_colors', recording)
+    return searched
+
+
+def test_memo_results_match_fresh_search(palette_path, random_rgbs):
+    memo = PerlerBeadColorMapper(palette_path)
+    fresh = PerlerBeadColorMapper(palette_path, memo_size=0)
+    rgbs = [tuple(int(v) for v in rgb) for rgb in random_rgbs[:100]]
+    allowed = memo.codes[::4]
+
+    # 第二轮全部来自缓存；不同的 top_n、允许色号和色差公式各自缓存，互不混用
+    queries = [
+        {'top_n': 1},
+        {'top_n': 3},
+        {'top_n': 3, 'allowed_colors': allowed},
+        {'top_n': 3, 'metric': 'cie76'},
+    ]
+    for _ in range(2):
+        for kwargs in queries:
+            for rgb in rgbs:
+                expected = fresh.find_closest_color(rgb, **kwargs)
+                assert memo.find_closest_color(rgb, **kwargs) == expected
+
+
+def test_memo_hits_skip_search(palette_path, monkeypatch):
+    mapper = PerlerBeadColorMapper(palette_path)
+    searched = count_searches(monkeypatch, mapper)
+
+    first = mapper._lookup_closest([(1, 2, 3), (4, 5, 6)], 3)
+    second = mapper._lookup_closest([(4, 5, 6), (7, 8, 9), (1, 2, 3)], 3)
+
+    assert searched == [[(1, 2, 3), (4, 5, 6)], [(7, 8, 9)]]
+    assert second[0] == first[1] and second[2] == first[0]
+
+
+def test_memo_evicts_least_recently_used(palette_path, monkeypatch):
+    mapper = PerlerBeadColorMapper(palette_path, memo_size=2)
+    mapper._lookup_closest([(1, 1, 1)], 1)
+    mapper._lookup_closest([(2, 2, 2)], 1)
+    mapper._lookup_closest([(1, 1, 1)], 1)  # 命中后变为最近使用
+    mapper._lookup_closest([(3, 3, 3)], 1)  # 淘汰 (2, 2, 2)
+
+    assert [key[-1] for key in mapper._memo] == [(1, 1, 1), (3, 3, 3)]
+    searched = count_searches(monkeypatch, mapper)
+    mapper._lookup_closest([(1, 1, 1), (2, 2, 2)], 1)
+    assert searched == [[(2, 2, 2)]]
+
+
+def test_memo_concurrent_lookups(palette_path):
+    """多个线程共用一个映射器（web 服务），缓存频繁淘汰时结果仍与直接计算一致"""
+    mapper = PerlerBeadColorMapper(palette_path, memo_size=64)
+    fresh = PerlerBeadColorMapper(palette_path, memo_size=0)
+    colors = np.random.default_rng(5).integers(0, 256, (300, 3))
+    rgbs = [tuple(int(v) for v in rgb) for rgb in colors]
+    expected = fresh._lookup_closest(rgbs, 3)
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def worker(seed):
+        order = np.random.default_rng(seed).permutation(len(rgbs))
+        barrier.wait()
+        for start in range(0, len(order), 10):
+            batch = order[start : start + 10].tolist()
+            got = mapper._lookup_closest([rgbs[i] for i in batch], 3)
+            if got != [expected[i] for i in batch]:
+                errors.append(seed)
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert len(mapper._memo) <= 64
+
+
+def reference_map_colors(mapper, colors, allowed_colors=None):
+    """逐单元格调用 find_closest_color 构建字典网格（紧凑格式之前的实现）"""
+    grid = []
+    usage = {}
+    delta_e_values = []
+    for row in colors:
+        mapped_row = []
+        for rgb in row:
+            top_3 = mapper.find_closest_color(rgb, top_n=3, allowed_colors=allowed_colors)
+            code, mapped_rgb, delta_e = top_3[0]
+            mapped_row.append({
+                'original': rgb,
+                'code': code,
+                'mapped': mapped_rgb,
+                'delta_e': round(delta_e, 2),
+                'top_3': [{
+                    'code': c,
+                    'rgb': r,
+                    'hex': '#{:02x}{:02x}{:02x}'.format(*r),
+                    'delta_e': round(d, 2)
+                } for c, r, d in top_3]
+            })
+            delta_e_values.append(delta_e)
+            usage.setdefault(code, {'count': 0, 'rgb': mapped_rgb})['count'] += 1
+        grid.append(mapped_row)
+
+    palette = {}
+    for code, info in sorted(usage.items(), key=lambda x: x[1]['count'], reverse=True):
+        palette[code] = {
+            'rgb': info['rgb'],
+            'hex': '#{:02x}{:02x}{:02x}'.format(*info['rgb']),
+            'count': info['count']
+        }
+    statistics = {
+        'total_cells': len(delta_e_values),
+        'unique_colors': len(usage),
+        'avg_delta_e': round(np.mean(delta_e_values), 2),
+        'max_delta_e': round(max(delta_e_values), 2),
+    }
+    return {'grid': grid, 'palette': palette, 'statistics': statistics}
+
+
+@pytest.fixture
+def color_rows():
+    """12×15 的网格，颜色取自 20 种随机颜色，重复很多"""
+    rng = np.random.default_rng(4)
+    colors = [tuple(int(v) for v in rgb) for rgb in rng.integers(0, 256, (20, 3))]
+    picks = rng.integers(0, len(colors), (12, 15))
+    return [[colors[i] for i in row] for row in picks]
+
+
+@pytest.mark.parametrize('allowed', [None, slice(0, None, 3)])
+def test_compact_mapping_expands_to_dict_format(palette_path, color_rows, allowed):
+    mapper = PerlerBeadColorMapper(palette_path)
+    allowed_colors = mapper.codes[allowed] if allowed is not None else None
+
+    expected = reference_map_colors(mapper, color_rows, allowed_colors)
+    result = mapper.map_colors(color_rows, allowed_colors=allowed_colors)
+
+    assert result['grid'] == expected['grid']
+    assert list(result['palette'].items()) == list(expected['palette'].items())
+    assert result['statistics'] == expected['statistics']
+
+
+def test_compact_mapping_indices(palette_path, color_rows):
+    mapper = PerlerBeadColorMapper(palette_path)
+    compact = mapper.map_colors(color_rows, compact=True, top_n=1)
+    expanded = mapper.expand_compact_mapping(compact)
+
+    assert compact['color_grid'].shape == compact['index_grid'].shape == (12, 15)
+    for i, row in enumerate(color_rows):
+        for j, rgb in enumerate(row):
+            assert tuple(compact['colors'][compact['color_grid'][i, j]]) == rgb
+            cell = expanded['grid'][i][j]
+            assert compact['codes'][compact['index_grid'][i, j]] == cell['code']
+            # top_n 为 1 时不带候选
+            assert 'top_3' not in cell
+
+
+def write_excel(path, colors):
+    """色号/颜色两列的 Excel 调色板"""
+    pd = pytest.importorskip('pandas')
+    pytest.importorskip('openpyxl')
+    frame = pd.DataFrame(
+        {'色号': list(colors), '颜色': ['#{:02x}{:02x}{:02x}'.format(*rgb) for rgb in colors.values()]}
+    )
+    frame.to_excel(path, index=False)
+    return str(path)
+
+
+@pytest.fixture
+def excel_palette(tmp_path):
+    colors = {'A1': (250, 250, 250), 'A2': (200, 30, 40), 'A3': (20, 90, 200)}
+    return write_excel(tmp_path / 'colors.xlsx', colors), colors
+
+
+def forbid(monkeypatch, name):
+    def fail(*args, **kwargs):
+        raise AssertionError(f'{name} should not be called')
+
+    monkeypatch.setattr(PerlerBeadColorMapper, name, fail)
+
+
+def test_palette_cache_hit(excel_palette, monkeypatch):
+    path, colors = excel_palette
+    PerlerBeadColorMapper(path)
+    assert os.path.exists(os.path.join(os.path.dirname(path), 'colors.palette.npz'))
+
+    # 修改时间和大小一致：不解析 Excel，也不计算哈希
+    forbid(monkeypatch, '_parse_excel')
+    forbid(monkeypatch, '_source_hash')
+    mapper = PerlerBeadColorMapper(path)
+    assert mapper.color_map == colors
+
+
+def test_palette_cache_refreshes_signature_when_content_unchanged(excel_palette, monkeypatch):
+    path, colors = excel_palette
+    PerlerBeadColorMapper(path)
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    # 只有修改时间变了：按哈希确认内容相同，沿用缓存并写回新的修改时间
+    forbid(monkeypatch, '_parse_excel')
+    assert PerlerBeadColorMapper(path).color_map == colors
+    with np.load(os.path.splitext(path)[0] + '.palette.npz') as data:
+        assert int(data['source_mtime_ns']) == os.stat(path).st_mtime_ns
+
+    # 之后的加载不再计算哈希
+    forbid(monkeypatch, '_source_hash')
+    assert PerlerBeadColorMapper(path).color_map == colors
+
+
+def test_palette_cache_invalidated_by_content_change(excel_palette):
+    path, colors = excel_palette
+    PerlerBeadColorMapper(path)
+    changed = dict(colors, A2=(10, 160, 60))
+    write_excel(path, changed)
+
+    assert PerlerBeadColorMapper(path).color_map == changed
+
+
+@pytest.mark.parametrize('damage', ['corrupt', 'missing'])
+def test_palette_cache_rebuilt_when_unreadable(excel_palette, damage):
+    path, colors = excel_palette
+    PerlerBeadColorMapper(path)
+    cache_path = os.path.splitext(path)[0] + '.palette.npz'
+    if damage == 'corrupt':
+        with open(cache_path, 'wb') as f:
+            f.write(b'not a zip file')
+    else:
+        os.remove(cache_path)
+
+    assert PerlerBeadColorMapper(path).color_map == colors
+    with np.load(cache_path) as data:
+        assert [str(code) for code in data['codes']] == list(colors)
+
+
+def test_corrupt_npz_palette_raises(tmp_path):
+    """直接传入的 .npz 调色板没有源文件可回退，读取失败时报错"""
+    path = tmp_path / 'broken.npz'
+    path.write_bytes(b'not a zip file')
+    with pytest.raises((OSError, ValueError)):
+        PerlerBeadColorMapper(str(path))
@@ -0,0 +1,251 @@
+"""
+颜色提取与合并：向量化实现与参考实现对照
+"""
+
+import io
+import os
+from contextlib import redirect_stdout
+from dataclasses import replace
+
+import cv2
+import numpy as np
+import pytest
+
+from src.color_grid import ColorGrid
+from src.color_processing import (
+    PATH_KMEANS,
+    _dominant_color_and_path,
+    _extract_colors_batched,
+    _integral_uniform_cells,
+    _merge_similar_palette,
+    merge_similar_colors,
+)
+from src.config import ColorProcessingConfig
+from src.perler_bead_detector import PerlerBeadDetector
+
+from reference import reference_merge_palette, reference_merge_similar_colors, sample_palette
+
+DEBUG_IMAGE = os.path.join(os.path.dirname(__file__), '..', 'debug.jpg')
+
+
+@pytest.mark.parametrize('size', [2, 60, 600])
+@pytest.mark.parametrize('threshold', [2.0, 5.0, 15.0])
+def test_vectorized_merge_matches_reference(size, threshold):
+    colors, counts = sample_palette(size, seed=size)
+    expected = reference_merge_palette(colors, counts, threshold)
+    merged = _merge_similar_palette(colors, counts, threshold)
+
+    assert merged == expected
+
+
+def test_merge_disabled_for_non_positive_threshold():
+    colors, counts = sample_palette(20)
+    assert _merge_similar_palette(colors, counts, 0) == {}
+
+
+def tied_color_rows(n_colors, seed):
+    """40×40 的网格，n_colors 种随机颜色，每种只占 1-3 个单元格，计数大量并列"""
+    rng = np.random.default_rng(seed)
+    colors = [tuple(int(v) for v in c) for c in rng.integers(0, 256, (n_colors, 3))]
+    picks = rng.choice(n_colors, 1600, p=rng.dirichlet(np.ones(n_colors)))
+    return [[colors[i] for i in row] for row in picks.reshape(40, 40)]
+
+
+@pytest.mark.parametrize(
+    'n_colors, max_colors, threshold', [(60, 40, 20), (400, 20, 20), (150, 20, 10), (400, 20, 0)]
+)
+def test_merge_matches_list_implementation(n_colors, max_colors, threshold):
+    """ColorGrid 只改变表示方式：合并结果与原来的列表实现完全相同
+
+    阈值为 0 时不做相近颜色合并，所有颜色进入全局 K-means
+    """
+    rows = tied_color_rows(n_colors, seed=n_colors + max_colors)
+    config = replace(ColorProcessingConfig(), max_colors=max_colors, color_threshold=threshold)
+
+    with redirect_stdout(io.StringIO()):
+        merged = merge_similar_colors(ColorGrid(rows), config)
+    assert merged.to_list() == reference_merge_similar_colors(rows, config)
+
+
+def test_merge_matches_list_implementation_on_debug_image():
+    detector = PerlerBeadDetector()
+    extracted = {}
+    merge = detector._merge_similar_colors
+
+    def capture(colors, *args, **kwargs):
+        extracted['colors'] = colors
+        return merge(colors, *args, **kwargs)
+
+    detector._merge_similar_colors = capture
+    with redirect_stdout(io.StringIO()):
+        result = detector.process_image(DEBUG_IMAGE)
+
+    # 检测器合并时使用的参数
+    config = replace(detector.color_config, max_colors=20, color_threshold=20)
+    expected = reference_merge_similar_colors(extracted['colors'].to_list(), config)
+    assert result['colors'].to_list() == expected
+
+
+def test_color_counts_in_first_seen_order():
+    rows = [[(3, 3, 3), (1, 1, 1)], [(2, 2, 2), (1, 1, 1)]]
+    grid = ColorGrid(rows)
+
+    assert grid.first_seen_colors() == [(3, 3, 3), (1, 1, 1), (2, 2, 2)]
+    assert list(grid.color_counts().items()) == [((3, 3, 3), 1), ((1, 1, 1), 2), ((2, 2, 2), 1)]
+
+
+def random_chart(seed, height=181, width=233):
+    """随机网格线（首尾贴着图像边缘，含很窄的单元格）上的色块图，每格噪声幅度不同"""
+    rng = np.random.default_rng(seed)
+
+    def lines(size):
+        steps = rng.integers(4, 30, size)
+        positions = np.concatenate(([0], np.cumsum(steps)))
+        # 最后一格至少 12 像素，保证贴着图像边缘的单元格也有纯色的
+        return [int(p) for p in positions[positions <= size - 12]] + [size]
+
+    h_lines, v_lines = lines(height), lines(width)
+    image = np.empty((height, width, 3), np.uint8)
+    for y1, y2 in zip(h_lines[:-1], h_lines[1:]):
+        for x1, x2 in zip(v_lines[:-1], v_lines[1:]):
+            base = rng.integers(20, 236, 3)
+            noise = rng.choice([0, 4, 20, 60])
+            cell = base + rng.integers(-noise, noise + 1, (y2 - y1, x2 - x1, 3))
+            image[y1:y2, x1:x2] = np.clip(cell, 0, 255)
+    watermark = rng.random((height, width)) < 0.002
+    edge = rng.random((height, width)) < 0.002
+    return image, h_lines, v_lines, watermark, edge
+
+
+def reference_uniform_cells(plane, h_lines, v_lines, config, watermark_mask, edge_mask):
+    """逐单元格切片求均值和标准差（区域和之前的实现）"""
+    rows, cols = len(h_lines) - 1, len(v_lines) - 1
+    colors = np.zeros((rows, cols, 3), np.int64)
+    uniform = np.zeros((rows, cols), bool)
+    for i in range(rows):
+        for j in range(cols):
+            y1, y2 = h_lines[i], h_lines[i + 1]
+            x1, x2 = v_lines[j], v_lines[j + 1]
+            margin_y, margin_x = (
+                max(
+                    config.margin_min,
+                    min(int(size * config.margin_percent), size // config.margin_max_divisor),
+                )
+                for size in (y2 - y1, x2 - x1)
+            )
+            inner = (slice(y1 + margin_y, y2 - margin_y), slice(x1 + margin_x, x2 - margin_x))
+            pixels = plane[inner].reshape(-1, 3).astype(np.float64)
+            if len(pixels) == 0:
+                continue
+            colors[i, j] = np.rint(pixels.mean(axis=0)[::-1])
+            std = pixels.std(axis=0)
+            ok = len(pixels) >= 10 and bool(np.all(std < config.uniform_std_threshold))
+            if watermark_mask is not None:
+                ratio = watermark_mask[inner].mean()
+                ok &= ratio == 0 or ratio >= config.watermark_cell_keep_gray_ratio
+            if edge_mask is not None:
+                ok &= edge_mask[inner].mean() < config.watermark_edge_ratio_threshold
+            uniform[i, j] = ok
+    return colors, uniform
+
+
+@pytest.mark.parametrize('seed', range(4))
+@pytest.mark.parametrize('masks', [False, True])
+def test_integral_uniform_cells_match_masked_mean(seed, masks):
+    image, h_lines, v_lines, watermark, edge = random_chart(seed)
+    config = ColorProcessingConfig()
+    watermark, edge = (watermark, edge) if masks else (None, None)
+
+    expected_colors, expected_uniform = reference_uniform_cells(
+        image, h_lines, v_lines, config, watermark, edge
+    )
+    colors, uniform = _integral_uniform_cells(image, h_lines, v_lines, config, watermark, edge)
+
+    # 随机图上纯色与非纯色单元格都有，最后一行/列贴着图像边缘
+    assert 0 < expected_uniform.sum() < expected_uniform.size
+    assert expected_uniform[-1].any() and expected_uniform[:, -1].any()
+    assert (uniform == expected_uniform).all()
+    np.testing.assert_array_equal(colors[uniform], expected_colors[uniform])
+
+
+def textured_chart(seed, rows=14, cols=18):
+    """不均匀的网格上各种单元格：纯色、噪声、两色拼接、带数字、近黑、近白，以及内部小于采样尺寸的窄格"""
+    rng = np.random.default_rng(seed)
+    heights, widths = rng.integers(10, 40, rows), rng.integers(10, 40, cols)
+    h_lines = [0] + np.cumsum(heights).tolist()
+    v_lines = [0] + np.cumsum(widths).tolist()
+    image = np.empty((h_lines[-1], v_lines[-1], 3), np.uint8)
+    for i in range(rows):
+        for j in range(cols):
+            y1, y2, x1, x2 = h_lines[i], h_lines[i + 1], v_lines[j], v_lines[j + 1]
+            kind = rng.integers(6)
+            base = {4: rng.integers(0, 40, 3), 5: rng.integers(225, 256, 3)}.get(
+                kind, rng.integers(0, 256, 3)
+            )
+            cell = np.broadcast_to(base, (y2 - y1, x2 - x1, 3)).astype(np.int64)
+            if kind == 1:
+                cell = cell + rng.integers(-40, 41, cell.shape)
+            elif kind == 2:
+                cell = cell.copy()
+                cell[:, : (x2 - x1) // 3] = rng.integers(0, 256, 3)
+            image[y1:y2, x1:x2] = np.clip(cell, 0, 255)
+            if kind == 3:
+                cv2.putText(
+                    image, str(i + j), (x1 + 2, y2 - 4), cv2.FONT_HERSHEY_SIMPLEX, 0.35, (20,) * 3, 1
+                )
+    watermark = rng.random(image.shape[:2]) < 0.05
+    edge = rng.random(image.shape[:2]) < 0.02
+    return image, h_lines, v_lines, watermark, edge
+
+
+@pytest.mark.parametrize('seed', range(3))
+@pytest.mark.parametrize('masks', [False, True])
+@pytest.mark.parametrize('sample_size', [12, 7])
+def test_batched_extraction_matches_per_cell(seed, masks, sample_size):
+    """批量路径的每个单元格与逐格的取色规则作用在相同采样点上的结果完全一致
+
+    7×7 采样只有 49 个像素，非均匀单元格需要 K-means，覆盖回退的判断。
+    """
+    image, h_lines, v_lines, watermark, edge = textured_chart(seed)
+    config = ColorProcessingConfig(batch_sample_size=sample_size)
+    watermark, edge = (watermark, edge) if masks else (None, None)
+    k = config.batch_sample_size
+    blurred = cv2.medianBlur(image, 5)
+
+    colors, fallback = _extract_colors_batched(
+        image, h_lines, v_lines, config, watermark, edge, blurred
+    )
+
+    compared = 0
+    for i in range(len(h_lines) - 1):
+        for j in range(len(v_lines) - 1):
+            y1, y2 = h_lines[i], h_lines[i + 1]
+            x1, x2 = v_lines[j], v_lines[j + 1]
+            margin_y, margin_x = (
+                max(
+                    config.margin_min,
+                    min(int(size * config.margin_percent), size // config.margin_max_divisor),
+                )
+                for size in (y2 - y1, x2 - x1)
+            )
+            top, bottom, left, right = y1 + margin_y, y2 - margin_y, x1 + margin_x, x2 - margin_x
+            if bottom - top < k or right - left < k:
+                assert fallback[i, j]
+                continue
+            # 每个子块中心的采样点
+            ys = [top + (bottom - top) * (2 * t + 1) // (2 * k) for t in range(k)]
+            xs = [left + (right - left) * (2 * t + 1) // (2 * k) for t in range(k)]
+            sample = np.ix_(ys, xs)
+            expected, path = _dominant_color_and_path(
+                np.ascontiguousarray(blurred[sample][..., ::-1]),
+                config,
+                watermark[sample] if watermark is not None else None,
+                edge[sample] if edge is not None else None,
+            )
+            # 需要 K-means 的小样本单元格回退到逐格路径，其余必须完全一致
+            assert fallback[i, j] == (path == PATH_KMEANS)
+            if not fallback[i, j]:
+                assert tuple(colors[i, j]) == expected
+                compared += 1
+
+    assert compared > 100
@@ -0,0 +1,177 @@
+"""
+网格检测：合成图纸上的投影定位行为
+"""
+
+import cv2
+import numpy as np
+import pytest
+
+from src.config import GridDetectionConfig
+from src.grid_detection import _estimate_period, _localize_lines, _refine_positions, detect_grid
+
+PROJECTION = GridDetectionConfig(line_localizer='projection')
+MIN_CONFIDENCE = GridDetectionConfig().period_min_confidence
+
+
+def draw_chart(rows, cols, cell, thick=2, border=60, seed=0):
+    """画一张 rows×cols 的图纸：随机色块、部分单元格带数字、灰色网格线，经过一次 JPEG 压缩
+
+    返回 (图片, 水平线 y 坐标, 垂直线 x 坐标)
+    """
+    rng = np.random.default_rng(seed)
+    palette = rng.integers(30, 250, (12, 3))
+    height, width = rows * cell + 2 * border, cols * cell + 2 * border
+    image = np.full((height, width, 3), 255, np.uint8)
+    labels = rng.integers(0, len(palette), (rows, cols))
+    for i in range(rows):
+        for j in range(cols):
+            y, x = border + i * cell, border + j * cell
+            image[y:y + cell, x:x + cell] = palette[labels[i // 3 * 3, j]]
+            if (i + j) % 3 == 0:
+                cv2.putText(
+                    image, str(labels[i, j]), (x + cell // 4, y + cell * 2 // 3),
+                    cv2.FONT_HERSHEY_SIMPLEX, cell / 60, (60, 60, 60), 1,
+                )
+
+    ys = [border + i * cell for i in range(rows + 1)]
+    xs = [border + j * cell for j in range(cols + 1)]
+    for y in ys:
+        image[y - thick // 2:y - thick // 2 + thick, border - thick:width - border + thick] = 70
+    for x in xs:
+        image[border - thick:height - border + thick, x - thick // 2:x - thick // 2 + thick] = 70
+    _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return cv2.imdecode(buffer, cv2.IMREAD_COLOR), ys, xs
+
+
+@pytest.mark.parametrize('rows, cols, cell', [(30, 40, 20), (40, 50, 32)])
+def test_projection_finds_every_line(rows, cols, cell):
+    image, ys, xs = draw_chart(rows, cols, cell)
+    result = detect_grid(image, False, PROJECTION)
+
+    assert result is not None
+    assert len(result['h_lines']) == len(ys) and len(result['v_lines']) == len(xs)
+    assert np.abs(np.array(result['h_lines']) - ys).max() <= 1
+    assert np.abs(np.array(result['v_lines']) - xs).max() <= 1
+
+
+def test_projection_agrees_with_hough():
+    """两种定位方式找到的线一一对应；投影取加权中心，不比 Hough 的线段端点差"""
+    image, ys, xs = draw_chart(30, 40, 20, seed=1)
+    hough = detect_grid(image, False, GridDetectionConfig())
+    projection = detect_grid(image, False, PROJECTION)
+
+    for key, truth in (('h_lines', ys), ('v_lines', xs)):
+        assert len(projection[key]) == len(hough[key]) == len(truth)
+        assert np.abs(np.array(hough[key]) - truth).max() <= 2
+        assert np.abs(np.array(projection[key]) - truth).max() <= 1
+
+
+@pytest.mark.parametrize('cell, thick', [(29, 1), (37, 2), (53, 3)])
+def test_pyramid_matches_full_resolution(cell, thick):
+    """金字塔模式的线与全分辨率检测一一对应，位置相差不超过 1 像素"""
+    image, ys, xs = draw_chart(3600 // cell, 4400 // cell, cell, thick, seed=cell)
+    full = detect_grid(image, False, GridDetectionConfig())
+    pyramid = detect_grid(image, False, GridDetectionConfig(pyramid_max_side=1500))
+
+    for key, truth in (('h_lines', ys), ('v_lines', xs)):
+        assert len(pyramid[key]) == len(full[key]) == len(truth)
+        assert np.abs(np.array(pyramid[key]) - full[key]).max() <= 1
+
+
+def test_refine_widens_band_for_bad_coarse_position():
+    """粗略位置偏出窄带时放宽窄带重新定位，而不是保留粗略位置"""
+    gray = np.full((500, 600), 255, np.uint8)
+    lines = list(range(20, 400, 40))
+    for y in lines:
+        gray[y - 1:y + 2] = 70
+    coarse = [y // 4 for y in lines]
+    coarse[4] += 3  # 缩小图上偏 3 像素，原图偏 12 像素，超出 1.5 × 4 的窄带
+
+    assert _refine_positions(gray, coarse, 4, PROJECTION) == lines
+    # 放宽后仍找不到线（空白区域）时返回 None，由调用方改用全分辨率
+    assert _refine_positions(gray, coarse + [115], 4, PROJECTION) is None
+
+
+def test_line_centers_and_hysteresis():
+    line_map = np.zeros((80, 200), np.uint8)
+    line_map[10, :] = 255
+    line_map[30:33, :] = 255  # 3 像素粗线，中心 31
+    line_map[50, :60] = 255  # 短于高阈值的线段，丢弃
+    line_map[70, :] = 255
+
+    assert _localize_lines(line_map, horizontal=True, config=PROJECTION) == [10, 31, 70]
+
+
+def test_skewed_lines_are_rejected():
+    """线条倾斜时投影分散，最强的一行覆盖不到一半，交给 Hough"""
+    line_map = np.zeros((200, 200), np.uint8)
+    for offset in range(0, 200, 40):
+        cv2.line(line_map, (0, offset), (199, offset + 20), 255, 1)
+
+    assert _localize_lines(line_map, horizontal=True, config=PROJECTION) is None
+
+
+def test_skewed_chart_falls_back_to_hough(capsys):
+    image, _, _ = draw_chart(30, 40, 20)
+    height, width = image.shape[:2]
+    rotation = cv2.getRotationMatrix2D((width / 2, height / 2), 2, 1)
+    rotated = cv2.warpAffine(image, rotation, (width, height), borderValue=(255, 255, 255))
+
+    result = detect_grid(rotated, False, PROJECTION)
+
+    assert result is not None
+    assert '改用 Hough 变换' in capsys.readouterr().out
+
+
+def test_unknown_localizer():
+    image, _, _ = draw_chart(10, 10, 20)
+    with pytest.raises(ValueError):
+        detect_grid(image, False, GridDetectionConfig(line_localizer='ransac'))
+
+
+def line_profile(spacing, length=3000, offset=7.0, keep=1.0, noise=0.0, seed=0):
+    """合成的一维边缘投影：每 spacing 像素一条宽 2 像素的线，keep 为保留的线的比例，叠加均匀噪声"""
+    rng = np.random.default_rng(seed)
+    profile = np.zeros(length)
+    for position in np.arange(offset, length - 2, spacing):
+        if rng.random() < keep:
+            profile[int(round(position)) : int(round(position)) + 2] += 100
+    return profile + noise * 100 * rng.random(length)
+
+
+@pytest.mark.parametrize(
+    'spacing, keep, noise',
+    [
+        (23.4, 1.0, 0.0),  # 干净
+        (23.4, 1.0, 0.5),  # 噪声
+        (23.4, 0.7, 0.0),  # 缺 30% 的线
+        (31.7, 0.7, 0.5),  # 缺线且有噪声
+    ],
+)
+def test_estimate_period(spacing, keep, noise):
+    period = _estimate_period(line_profile(spacing, keep=keep, noise=noise))
+
+    assert period.spacing == pytest.approx(spacing, rel=0.01)
+    assert period.confidence >= MIN_CONFIDENCE
+
+
+def test_estimate_period_prefers_base_spacing_over_bold_lines():
+    """每 5 条线加粗一次，自相关在 5 倍间距处最高，仍应取基本间距"""
+    profile = line_profile(20.0, offset=5.0)
+    profile[np.arange(5, 3000, 100)] += 400
+
+    assert _estimate_period(profile).spacing == pytest.approx(20.0, abs=0.1)
+
+
+@pytest.mark.parametrize('seed', range(3))
+def test_estimate_period_rejects_noise(seed):
+    """没有周期的投影置信度低于阈值，不参与间距估算"""
+    profile = np.random.default_rng(seed).random(3000) * 100
+
+    assert _estimate_period(profile).confidence < MIN_CONFIDENCE
+
+
+@pytest.mark.parametrize('profile', [np.zeros(3000), np.ones(3000), np.arange(8.0)])
+def test_estimate_period_without_signal(profile):
+    """常数投影或太短的投影没有周期"""
+    assert _estimate_period(profile).spacing == 0.0
@@ -11,6 +11,7 @@ from pathlib import Path
 from flask import Flask, render_template, request, jsonify, send_from_directory
 from werkzeug.utils import secure_filename
 import json
+import numpy as np
 import svgwrite
 import xml.etree.ElementTree as ET
 
@@ -18,6 +19,9 @@ import xml.etree.ElementTree as ET
 project_root = Path(__file__).parent.parent
 sys.path.insert(0, str(project_root))
 
+from src.color_difference import get_metric
+from src.color_grid import ColorGrid
+
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max
@@ -110,6 +114,14 @@ def upload_file():
             
             print(f"用户选中的色号数量: {len(selected_colors)}")
             
+            # 色差公式（可选），预览可用 cie76 / cam02ucs 等快速公式
+            metric = request.form.get('metric') or None
+            if metric is not None:
+                try:
+                    metric = get_metric(metric).name
+                except ValueError as e:
+                    return jsonify({'error': str(e)}), 400
+            
             # 处理图片
             print(f"开始处理图片: {filename}")
             det = get_detector()
@@ -119,46 +131,39 @@ def upload_file():
                 return jsonify({'error': '无法识别图片中的网格'}), 400
             
             # 裁剪白色边界
-            colors = det._crop_white_borders(result['colors'])
-            rows = len(colors)
-            cols = len(colors[0]) if rows > 0 else 0
+            colors = ColorGrid.from_colors(det._crop_white_borders(result['colors']))
+            rows, cols = colors.shape
             print(f"检测到网格: {rows}x{cols}")
             
             # 映射到拼豆标准色号（只在用户选中的色号中查找）
+            # 只计算最佳匹配，候选色号由前端点击单元格时通过 /api/find_color 按颜色查询
             print("开始映射颜色到标准色号...")
             mapper = get_color_mapper()
-            mapping_result = mapper.map_colors(colors, allowed_colors=selected_colors)
+            mapping_result = mapper.map_colors(
+                colors, allowed_colors=selected_colors, compact=True, metric=metric, top_n=1
+            )
             print(f"映射完成，使用了 {mapping_result['statistics']['unique_colors']} 种色号")
             
-            # 转换颜色数据为前端格式
-            color_grid = []
-            mapped_color_grid = []  # 映射后的颜色
-            color_codes_grid = []  # 完整的 cell 数据（包含 top_3）
-            
-            for i in range(rows):
-                row = []
-                mapped_row = []
-                code_row = []
-                for j in range(cols):
-                    # 原始颜色
-                    r, g, b = colors[i][j]
-                    hex_color = rgb_to_hex(r, g, b)
-                    row.append(hex_color)
-                    
-                    # 映射后的颜色和完整信息
-                    cell_info = mapping_result['grid'][i][j]
-                    mapped_r, mapped_g, mapped_b = cell_info['mapped']
-                    mapped_hex = rgb_to_hex(mapped_r, mapped_g, mapped_b)
-                    mapped_row.append(mapped_hex)
-                    
-                    # 保存完整的 cell 信息（包含 top_3）
-                    code_row.append(cell_info)
-                
-                color_grid.append(row)
-                mapped_color_grid.append(mapped_row)
-                color_codes_grid.append(code_row)
-
-            color_stats = build_color_stats_from_hex_grid(color_grid)
+            # 转换颜色数据为前端格式：只传每种颜色和每个色号一次，单元格用下标表示，
+            # 由前端按下标展开为逐单元格网格
+            color_grid = mapping_result['color_grid']
+            unique_hex = [rgb_to_hex(r, g, b) for r, g, b in mapping_result['colors'].tolist()]
+            mapped_hex = [rgb_to_hex(r, g, b) for r, g, b in mapping_result['palette_rgb'].tolist()]
+            compact_mapping = {
+                'colors': unique_hex,  # 原始检测颜色
+                'colorGrid': color_grid.tolist(),  # 每个单元格的原始颜色下标
+                'codes': mapping_result['codes'],  # 用到的色号
+                'codeColors': mapped_hex,  # 色号对应的标准颜色
+                'bestIndices': mapping_result['top_indices'][:, 0].tolist(),  # 每种颜色的最佳色号下标
+                'deltaE': np.round(mapping_result['top_delta_e'][:, 0], 2).tolist(),
+            }
+
+            # 每种颜色的单元格数
+            counts = np.bincount(color_grid.ravel(), minlength=len(unique_hex)).tolist()
+            color_stats = {
+                hex_color: {'rgb': 'RGB({},{},{})'.format(*hex_to_rgb(hex_color)), 'count': count}
+                for hex_color, count in zip(unique_hex, counts)
+            }
             
             # 按使用次数排序颜色统计
             sorted_colors = sorted(
@@ -171,13 +176,12 @@ def upload_file():
                 'success': True,
                 'rows': rows,
                 'cols': cols,
-                'colors': color_grid,  # 原始检测颜色
-                'mappedColors': mapped_color_grid,  # 映射后的标准色号颜色
-                'colorCodes': color_codes_grid,  # 完整的 cell 数据（包含 code, mapped, delta_e, top_3）
+                'mapping': compact_mapping,  # 紧凑格式的颜色和色号，前端展开
                 'colorStats': dict(sorted_colors),
                 'totalColors': len(color_stats),
                 'palette': mapping_result['palette'],  # 拼豆调色板
-                'statistics': mapping_result['statistics']  # 映射统计信息
+                'statistics': mapping_result['statistics'],  # 映射统计信息
+                'metric': metric or mapper.metric  # 使用的色差公式，查询候选时沿用
             })
         
         except Exception as e:
@@ -378,11 +382,17 @@ def get_all_colors():
 
 @app.route('/api/find_color', methods=['POST'])
 def find_color():
-    """查找单个颜色的最接近色号"""
+    """查找单个颜色的最接近色号及 Top 3 候选（结果按颜色缓存）"""
     try:
         data = request.get_json()
         rgb = tuple(data.get('rgb', [0, 0, 0]))
         selected_colors = data.get('selected_colors', [])
+        metric = data.get('metric') or None
+        if metric is not None:
+            try:
+                metric = get_metric(metric).name
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
         
         mapper = get_color_mapper()
         
@@ -391,7 +401,9 @@ def find_color():
             selected_colors = None
         
         # 获取 Top 3 结果
-        top_3 = mapper.find_closest_color(rgb, top_n=3, allowed_colors=selected_colors)
+        top_3 = mapper.find_closest_color(
+            rgb, top_n=3, allowed_colors=selected_colors, metric=metric
+        )
         best_match = top_3[0]
         code, mapped_rgb, delta_e = best_match
         
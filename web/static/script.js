@@ -13,6 +13,7 @@ let cropEnd = null;
 let originalImageUrl = null;
 let colorCardMode = false; // 色卡模式：false=16进制模式，true=色卡模式
 let colorPickerModal = null; // 色号选择器弹窗
+let alternativesCache = new Map(); // 颜色 -> Top 3 候选色号（点击时按需获取）
 
 // ============ 初始化 ============
 document.addEventListener('DOMContentLoaded', () => {
@@ -152,7 +153,9 @@ async function handleFileSelect(event) {
         console.log('解析数据:', data);
         
         if (data.success) {
+            expandCompactMapping(data);
             currentData = data;
+            alternativesCache.clear();
             displayResult(data);
         } else {
             alert('❌ 处理失败: ' + (data.error || '未知错误'));
@@ -165,6 +168,42 @@ async function handleFileSelect(event) {
     }
 }
 
+// ============ 展开紧凑映射结果 ============
+// 后端只返回每种颜色和每个色号一次，单元格用下标表示；
+// 这里按下标展开为 colors / mappedColors / colorCodes 三个逐单元格网格
+function expandCompactMapping(data) {
+    const mapping = data.mapping;
+    if (!mapping) return;
+    
+    const colorRgb = mapping.colors.map(hexToRgb);
+    const codeRgb = mapping.codeColors.map(hexToRgb);
+    
+    data.colors = [];
+    data.mappedColors = [];
+    data.colorCodes = [];
+    for (const indexRow of mapping.colorGrid) {
+        const colorRow = [];
+        const mappedRow = [];
+        const codeRow = [];
+        for (const colorIdx of indexRow) {
+            const codeIdx = mapping.bestIndices[colorIdx];
+            colorRow.push(mapping.colors[colorIdx]);
+            mappedRow.push(mapping.codeColors[codeIdx]);
+            // 每个单元格一个独立对象，编辑时逐格修改
+            codeRow.push({
+                original: colorRgb[colorIdx],
+                code: mapping.codes[codeIdx],
+                mapped: codeRgb[codeIdx],
+                delta_e: mapping.deltaE[colorIdx]
+            });
+        }
+        data.colors.push(colorRow);
+        data.mappedColors.push(mappedRow);
+        data.colorCodes.push(codeRow);
+    }
+    delete data.mapping;
+}
+
 // ============ 显示识别结果 ============
 function displayResult(data) {
     // 隐藏加载，显示结果
@@ -322,11 +361,12 @@ async function handleCanvasClick(event) {
     if (row >= 0 && row < currentData.rows && col >= 0 && col < currentData.cols) {
         const clickedColor = currentData.colors[row][col];
         
-        // 色卡模式且有 Top 3 数据：显示选择器
+        // 色卡模式：显示 Top 3 选择器（候选色号按需从后端获取）
         if (colorCardMode && currentData.colorCodes && currentData.colorCodes[row] && currentData.colorCodes[row][col]) {
             const cellData = currentData.colorCodes[row][col];
-            if (cellData.top_3) {
-                showColorPicker(row, col, cellData.top_3, event);
+            const top3 = cellData.top_3 || await fetchAlternatives(clickedColor);
+            if (top3) {
+                showColorPicker(row, col, top3, event);
                 return;
             }
         }
@@ -529,6 +569,7 @@ async function handleImportSvgChange(event) {
 
         if (data.success) {
             currentData = data;
+            alternativesCache.clear();
             displayResult(data);
         } else {
             alert('❌ 导入失败: ' + (data.error || '未知错误'));
@@ -775,7 +816,8 @@ async function remapSingleColor(row, col, hexColor) {
             headers: { 'Content-Type': 'application/json' },
             body: JSON.stringify({
                 rgb: rgb,
-                selected_colors: selectedColors
+                selected_colors: selectedColors,
+                metric: currentData.metric
             })
         });
         
@@ -806,6 +848,36 @@ async function remapSingleColor(row, col, hexColor) {
     }
 }
 
+// 获取颜色的 Top 3 候选色号（按颜色和选中的色号缓存）
+async function fetchAlternatives(hexColor) {
+    const selectedColors = getSelectedColors();
+    const key = `${hexColor}|${selectedColors.join(',')}`;
+    if (alternativesCache.has(key)) {
+        return alternativesCache.get(key);
+    }
+    
+    try {
+        const response = await fetch('/api/find_color', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                rgb: hexToRgb(hexColor),
+                selected_colors: selectedColors,
+                metric: currentData.metric
+            })
+        });
+        
+        const data = await response.json();
+        if (data.success) {
+            alternativesCache.set(key, data.top_3);
+            return data.top_3;
+        }
+    } catch (error) {
+        console.error('获取候选色号失败:', error);
+    }
+    return null;
+}
+
 // 辅助函数：hex 转 rgb 数组
 function hexToRgb(hex) {
     const result = /^#?([a-f\d]{2})([a-f\d]{2})([a-f\d]{2})$/i.exec(hex);